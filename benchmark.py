@@ -0,0 +1,96 @@
+import random
+import time
+import tracemalloc
+
+from structures import Disk
+from tree import Tree
+from tracker import Tracker
+
+def make_items(num_records, seed=0):
+    # returns sorted list[(augmented_key, (block_id, offset))] shaped like the IMDb data
+    rng = random.Random(seed)
+    keys = sorted((rng.randint(10, 100) / 10, f"tt{i:07d}") for i in range(num_records))
+    return [(key, (i + 1, 13)) for i, key in enumerate(keys)]
+
+def benchmark_lookup(block_sizes=(100, 500, 4096, 8192), num_records=100000, num_lookups=20000, seed=0, tconst_prefix=None,
+                     packed_keys=False):
+    # times point lookups (search_first_gte) on trees built with different block sizes
+    # tconst_prefix builds the trees with compressed index blocks, packed_keys with int keys (see Tree)
+    # returns list[(block_size, max_keys, height, microseconds per lookup)]
+    items = make_items(num_records, seed)
+    rng = random.Random(seed)
+    lookups = [rng.choice(items)[0] for _ in range(num_lookups)]
+    results = []
+    for block_size in block_sizes:
+        tree = Tree.bulk_load(Disk(block_size), items, tconst_prefix=tconst_prefix, packed_keys=packed_keys)
+        node_keys = [tree.encode_key(key) for key in lookups]
+        start = time.perf_counter()
+        for key in node_keys:
+            tree.root.search_first_gte(key)
+        end = time.perf_counter()
+        Tracker.reset_all()
+        results.append((block_size, tree.max_keys, tree.get_height(), (end - start) / num_lookups * 1e6))
+    return results
+
+def benchmark_memory(block_sizes=(100, 500, 4096), num_records=100000, seed=0):
+    # measures the memory held by the nodes of a tree built with list-backed and compact (array-backed) leaves
+    # returns list[(block_size, compact, bytes per record, microseconds per lookup)]
+    rng = random.Random(seed)
+    lookups = [key for key, _ in rng.sample(make_items(num_records, seed), num_records // 10)]
+    results = []
+    for block_size in block_sizes:
+        for compact in [False, True]:
+            # the items are created inside the measurement since list-backed leaves keep references to them
+            tracemalloc.start()
+            items = make_items(num_records, seed)
+            tree = Tree.bulk_load(Disk(block_size), items, compact=compact)
+            del items
+            size, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            start = time.perf_counter()
+            for key in lookups:
+                tree.root.search_first_gte(key)
+            end = time.perf_counter()
+            Tracker.reset_all()
+            results.append((block_size, compact, size / num_records, (end - start) / len(lookups) * 1e6))
+    return results
+
+def benchmark_open(block_sizes=(100, 500, 4096), num_records=100000, num_lookups=20000, seed=0):
+    # times point lookups on a saved tree reopened with a node cache of 1 node, so every node on the path is loaded
+    # from its index block, with every key decoded on load or with lazy_keys
+    # returns list[(block_size, lazy_keys, microseconds per lookup)]
+    items = make_items(num_records, seed)
+    rng = random.Random(seed)
+    lookups = [rng.choice(items)[0] for _ in range(num_lookups)]
+    results = []
+    for block_size in block_sizes:
+        disk = Disk(block_size)
+        tree = Tree.bulk_load(disk, items)
+        tree.save()
+        for lazy_keys in [False, True]:
+            opened = Tree.open(disk, tree.root.block_id, cache_size=1, lazy_keys=lazy_keys)
+            start = time.perf_counter()
+            for key in lookups:
+                opened.root.search_first_gte(key)
+                opened.evict()
+            end = time.perf_counter()
+            Tracker.reset_all()
+            results.append((block_size, lazy_keys, (end - start) / num_lookups * 1e6))
+    return results
+
+def main():
+    print(f"{'block size':>10} | {'keys':>10} | {'max keys':>8} | {'height':>6} | {'us/lookup':>9}")
+    for keys, tconst_prefix, packed_keys in [("full", None, False), ("compressed", "tt", False), ("packed", "tt", True)]:
+        for block_size, max_keys, height, latency in benchmark_lookup(tconst_prefix=tconst_prefix, packed_keys=packed_keys):
+            print(f"{block_size:>10} | {keys:>10} | {max_keys:>8} | {height:>6} | {latency:>9.2f}")
+    print()
+    print(f"{'block size':>10} | {'keys':>7} | {'us/lookup':>9} (reopened tree, every node read from its index block)")
+    for block_size, lazy_keys, latency in benchmark_open():
+        print(f"{block_size:>10} | {'lazy' if lazy_keys else 'decoded':>7} | {latency:>9.2f}")
+    print()
+    print(f"{'block size':>10} | {'leaves':>7} | {'B/record':>8} | {'us/lookup':>9}")
+    for block_size, compact, size, latency in benchmark_memory():
+        print(f"{block_size:>10} | {'compact' if compact else 'list':>7} | {size:>8.1f} | {latency:>9.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import argparse
+import concurrent.futures
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from buffer_pool import BufferPool
+from ingest import augmented_key, external_sort, store_record
+from parallel import parallel_bulk_load
+from query import fetch_records
+from structures import Disk
+from tracker import Tracker
+from tree import get_max_keys
+from utils import *
+
+BLOCK_SIZES = (100, 500, 4096)
+SELECTIVITIES = (0.0001, 0.001, 0.01) # fraction of the rows selected by a range scan
+RATING_SKEW = (6.4, 3.4) # averageRating is 1 + 9 * beta(alpha, beta), mean about 6.9 and skewed to the left like IMDb
+SAMPLE_SIZE = 10000 # keys sampled while loading, used as lookup targets and range bounds
+REGRESSION_THRESHOLD = 0.1
+# metric => 1 if higher is better, -1 if lower is better
+METRICS = {"throughput": 1, "p50_us": -1, "p99_us": -1, "peak_rss_mb": -1, "physical_reads": -1, "physical_writes": -1}
+
+def generate_records(num_rows, seed=0, rating_skew=RATING_SKEW, start=0):
+    # yields num_rows IMDb-shaped records [tconst, averageRating, numVotes], the same ones for the same seed
+    # tconst numbers run from start, numVotes is heavy tailed: at least 5, mostly tens, a few in the millions
+    rng = random.Random(seed)
+    alpha, beta = rating_skew
+    for i in range(start, start + num_rows):
+        rating = round(1 + 9 * rng.betavariate(alpha, beta), 1)
+        yield [f"tt{i:07d}", rating, min(int(5 * rng.paretovariate(0.9)), 2500000)]
+
+def write_tsv(path, records):
+    # writes records in the format of data.tsv, e.g. to run main.py on a synthetic dataset
+    with open(path, "w") as f:
+        f.write("tconst\taverageRating\tnumVotes\n")
+        for tconst, rating, num_votes in records:
+            f.write(f"{tconst}\t{rating}\t{num_votes}\n")
+
+def sample_keys(records, sample, size, seed=0):
+    # passes the records through, keeping a uniform sample of size of their augmented keys in sample (reservoir sampling)
+    rng = random.Random(seed)
+    for i, record in enumerate(records):
+        if i < size:
+            sample.append(augmented_key(record))
+        else:
+            j = rng.randrange(i + 1)
+            if j < size:
+                sample[j] = augmented_key(record)
+        yield record
+
+def get_disk_size(block_size, num_rows):
+    # upper bound on the bytes of a database of num_rows records, a Disk is only backed by memory where it is written
+    records_per_block = (block_size - 13) // RECORD_STRUCT.size
+    min_leaf_keys = (get_max_keys(block_size) + 1) // 2
+    return block_size * (num_rows // records_per_block + 2 * num_rows // min_leaf_keys + 1000)
+
+def get_percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def get_peak_rss_mb():
+    # peak resident set size of this process, or of the largest of its finished child processes (the load workers)
+    # so far, ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = max(resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+def summarize(block_size, workload, num_ops, seconds, latencies_ns, stats, **extra):
+    # 1 row of results, latencies in microseconds
+    latencies_ns.sort()
+    res = {
+        "block_size": block_size,
+        "workload": workload,
+        "ops": num_ops,
+        "seconds": seconds,
+        "throughput": num_ops / seconds if seconds else None,
+        "p50_us": get_percentile(latencies_ns, 0.5) / 1000 if latencies_ns else None,
+        "p99_us": get_percentile(latencies_ns, 0.99) / 1000 if latencies_ns else None,
+        "peak_rss_mb": get_peak_rss_mb(),
+        "logical_reads": stats.get_io("logical_read"),
+        "physical_reads": stats.get_io("physical_read"),
+        "logical_writes": stats.get_io("logical_write"),
+        "physical_writes": stats.get_io("physical_write"),
+        "counts": stats.to_dict()["counts"],
+    }
+    res.update(extra)
+    return res
+
+def run_block_size(block_size, num_rows, seed=0, num_ops=10000, num_range_ops=200, selectivities=SELECTIVITIES,
+                   rating_skew=RATING_SKEW, buffer_frames=1024, cache_size=256, workers=1):
+    # runs every workload on a database of num_rows generated records with blocks of block_size bytes
+    # load: external sort, then parallel_bulk_load with workers processes into a temporary file, save
+    # the tree is loaded with a node cache of cache_size nodes over a BufferPool, so memory stays bounded however many
+    # rows there are, and both index and data blocks are read through the pool by the other workloads
+    # point: lookup of 1 record by augmented key, range_<selectivity>: range scan of the records of a key range,
+    # mixed: inserts of new records alternating with deletes of existing ones
+    # returns list of result rows (see summarize), peak_rss_mb is the peak of the process up to the end of the workload
+    results = []
+    tmp_dir = tempfile.TemporaryDirectory()
+    disk = Disk(block_size, get_disk_size(block_size, num_rows + num_ops), os.path.join(tmp_dir.name, "disk.bin"))
+    pool = BufferPool(disk, buffer_frames)
+    sample = []
+    with Tracker.measure() as stats:
+        start = time.perf_counter()
+        records = sample_keys(generate_records(num_rows, seed, rating_skew), sample, SAMPLE_SIZE, seed)
+        tree = parallel_bulk_load(pool, external_sort(records), workers, cache_size=cache_size)
+        tree.save()
+        pool.flush()
+        seconds = time.perf_counter() - start
+    results.append(summarize(block_size, "load", num_rows, seconds, [], stats, height=tree.get_height(), max_keys=tree.max_keys))
+    sample.sort()
+    rng = random.Random(seed)
+
+    latencies = []
+    with Tracker.measure() as stats:
+        start = time.perf_counter()
+        for _ in range(num_ops):
+            key = tree.encode_key(rng.choice(sample))
+            op_start = time.perf_counter_ns()
+            node, i = tree.root.search_first_gte(key)
+            if node.keys[i] != key:
+                raise Exception(f"Key {key} not found")
+            block_id, offset = node.pointers[i]
+            convert_bytes_to_record(read_record_bytes(pool.read_block(block_id), offset))
+            tree.evict()
+            latencies.append(time.perf_counter_ns() - op_start)
+        seconds = time.perf_counter() - start
+    results.append(summarize(block_size, "point", num_ops, seconds, latencies, stats))
+
+    for selectivity in selectivities:
+        span = max(1, int(selectivity * len(sample)))
+        latencies = []
+        num_records = 0
+        with Tracker.measure() as stats:
+            start = time.perf_counter()
+            for _ in range(num_range_ops):
+                i = rng.randrange(max(1, len(sample) - span))
+                lower, upper = sample[i], sample[min(i + span, len(sample) - 1)]
+                op_start = time.perf_counter_ns()
+                pointers = tree.root.search_range(tree.encode_key(lower), tree.encode_key(upper))
+                tree.evict()
+                records, _ = fetch_records(pool, pointers)
+                latencies.append(time.perf_counter_ns() - op_start)
+                num_records += len(records)
+            seconds = time.perf_counter() - start
+        results.append(summarize(block_size, f"range_{selectivity}", num_range_ops, seconds, latencies, stats,
+                                 records_per_op=num_records / num_range_ops))
+
+    # each sampled key is deleted at most once, the inserted records get new tconsts
+    to_delete = list(sample)
+    rng.shuffle(to_delete)
+    new_records = generate_records(num_ops, seed + 1, rating_skew, num_rows)
+    latencies = []
+    with Tracker.measure() as stats:
+        start = time.perf_counter()
+        for i in range(num_ops):
+            op_start = time.perf_counter_ns()
+            if i % 2 == 0 or not to_delete:
+                key, pointer = store_record(pool, next(new_records))
+                tree.insert(key, pointer)
+            else:
+                tree.delete_key(to_delete.pop())
+            latencies.append(time.perf_counter_ns() - op_start)
+        tree.save()
+        pool.flush()
+        seconds = time.perf_counter() - start
+    results.append(summarize(block_size, "mixed", num_ops, seconds, latencies, stats))
+    tmp_dir.cleanup()
+    return results
+
+def get_environment():
+    environment = {"python": platform.python_version(), "platform": platform.platform(), "processor": platform.processor(),
+                   "time": datetime.datetime.now().isoformat(timespec="seconds")}
+    try:
+        environment["commit"] = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return environment
+
+def run_suite(block_sizes=BLOCK_SIZES, num_rows=1000000, isolate=True, **kwargs):
+    # runs run_block_size for every block size, each in a new process (isolate == True) so peak RSS is per block size
+    # returns {"config", "environment", "results"} as stored by save_results
+    config = json.loads(json.dumps({"block_sizes": list(block_sizes), "num_rows": num_rows, **kwargs})) # as stored
+    results = []
+    for block_size in block_sizes:
+        if isolate:
+            with concurrent.futures.ProcessPoolExecutor(1, multiprocessing.get_context("spawn")) as executor:
+                results.extend(executor.submit(run_block_size, block_size, num_rows, **kwargs).result())
+        else:
+            results.extend(run_block_size(block_size, num_rows, **kwargs))
+    return {"config": config, "environment": get_environment(), "results": results}
+
+def save_results(path, suite):
+    with open(path, "w") as f:
+        json.dump(suite, f, indent=2)
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+def compare_results(baseline, current, threshold=REGRESSION_THRESHOLD):
+    # compares the METRICS of the results of 2 runs of run_suite, matched by (block_size, workload)
+    # a metric regresses if it got worse by more than threshold (relative to the baseline)
+    # returns list[(block_size, workload, metric, baseline value, current value, regressed)]
+    if baseline["config"] != current["config"]:
+        print(f"Warning: the runs have different configs: {baseline['config']} vs {current['config']}")
+    baseline_rows = {(row["block_size"], row["workload"]): row for row in baseline["results"]}
+    res = []
+    for row in current["results"]:
+        old_row = baseline_rows.get((row["block_size"], row["workload"]))
+        if old_row == None:
+            continue
+        for metric, direction in METRICS.items():
+            old, new = old_row.get(metric), row.get(metric)
+            if old == None or new == None:
+                continue
+            change = (new - old) / old if old else 0.0 if new == old else float("inf")
+            res.append((row["block_size"], row["workload"], metric, old, new, change * direction < -threshold))
+    return res
+
+def print_results(suite):
+    print(f"{'block size':>10} | {'workload':>12} | {'ops/s':>10} | {'p50 us':>9} | {'p99 us':>9} | {'peak MB':>8} | "
+          f"{'reads':>9} | {'phys reads':>10} | {'writes':>9} | {'phys writes':>11}")
+    for row in suite["results"]:
+        p50 = f"{row['p50_us']:>9.1f}" if row["p50_us"] != None else f"{'-':>9}"
+        p99 = f"{row['p99_us']:>9.1f}" if row["p99_us"] != None else f"{'-':>9}"
+        print(f"{row['block_size']:>10} | {row['workload']:>12} | {row['throughput']:>10.1f} | {p50} | {p99} | "
+              f"{row['peak_rss_mb']:>8.1f} | {row['logical_reads']:>9} | {row['physical_reads']:>10} | "
+              f"{row['logical_writes']:>9} | {row['physical_writes']:>11}")
+
+def print_comparison(comparison):
+    print(f"{'block size':>10} | {'workload':>12} | {'metric':>15} | {'baseline':>12} | {'current':>12} | {'change':>8}")
+    for block_size, workload, metric, old, new, regressed in comparison:
+        change = f"{(new - old) / old * 100:>+7.1f}%" if old else f"{'-':>8}"
+        print(f"{block_size:>10} | {workload:>12} | {metric:>15} | {old:>12.1f} | {new:>12.1f} | {change}{' REGRESSION' if regressed else ''}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load, point lookup, range scan and mixed insert/delete benchmarks on synthetic IMDb-shaped data")
+    parser.add_argument("--rows", type=int, default=1000000, help="number of records generated, e.g. 1000000 to 50000000")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes bulk loading the tree")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated records and operations")
+    parser.add_argument("--block-sizes", type=int, nargs="+", default=list(BLOCK_SIZES))
+    parser.add_argument("--ops", type=int, default=10000, help="number of point lookups and of mixed inserts/deletes")
+    parser.add_argument("--range-ops", type=int, default=200, help="number of range scans per selectivity")
+    parser.add_argument("--selectivities", type=float, nargs="+", default=list(SELECTIVITIES), help="fractions of the rows per range scan")
+    parser.add_argument("--rating-skew", type=float, nargs=2, default=list(RATING_SKEW), metavar=("ALPHA", "BETA"),
+                        help="averageRating is 1 + 9 * beta(ALPHA, BETA), 1 1 for uniform")
+    parser.add_argument("--buffer-frames", type=int, default=1024)
+    parser.add_argument("--cache-size", type=int, default=256, help="number of nodes kept materialized by the loaded tree")
+    parser.add_argument("--out", default="benchmark_results.json", help="path the results are stored to")
+    parser.add_argument("--compare", help="results of an earlier run to compare against, exits with 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="relative change counted as a regression")
+    parser.add_argument("--write-tsv", help="only write the generated records to this path in the format of data.tsv")
+    args = parser.parse_args()
+
+    if args.write_tsv:
+        write_tsv(args.write_tsv, generate_records(args.rows, args.seed, tuple(args.rating_skew)))
+        return
+    suite = run_suite(args.block_sizes, args.rows, seed=args.seed, num_ops=args.ops, num_range_ops=args.range_ops,
+                      selectivities=args.selectivities, rating_skew=args.rating_skew, buffer_frames=args.buffer_frames,
+                      cache_size=args.cache_size, workers=args.workers)
+    print_results(suite)
+    save_results(args.out, suite)
+    print(f'Results saved to "{args.out}"')
+    if args.compare:
+        comparison = compare_results(load_results(args.compare), suite, args.threshold)
+        print()
+        print_comparison(comparison)
+        if any(regressed for *_, regressed in comparison):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
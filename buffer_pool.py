@@ -0,0 +1,209 @@
+import collections
+import threading
+
+from structures import Block
+from tracker import Tracker
+
+class LRUPolicy:
+    # evicts the unpinned block that was accessed least recently
+    def __init__(self, num_frames):
+        self.order = collections.OrderedDict() # block_id => True, least recently used first
+
+    def record_access(self, block_id):
+        self.order[block_id] = True
+        self.order.move_to_end(block_id)
+
+    def remove(self, block_id):
+        self.order.pop(block_id, None)
+
+    def choose_victim(self, frames):
+        for block_id in self.order:
+            if frames[block_id].pin_count == 0:
+                return block_id
+        return None
+
+class ClockPolicy:
+    # second chance: the hand sweeps the frames, clearing reference bits, and evicts the first unpinned unreferenced block
+    def __init__(self, num_frames):
+        self.slots = [None] * num_frames # block id in each frame slot
+        self.slot_of = {} # block_id => slot
+        self.free_slots = list(range(num_frames - 1, -1, -1))
+        self.referenced = {} # block_id => reference bit
+        self.hand = 0
+
+    def record_access(self, block_id):
+        if block_id not in self.slot_of:
+            slot = self.free_slots.pop()
+            self.slots[slot] = block_id
+            self.slot_of[block_id] = slot
+        self.referenced[block_id] = True
+
+    def remove(self, block_id):
+        slot = self.slot_of.pop(block_id, None)
+        if slot == None:
+            return
+        self.slots[slot] = None
+        self.free_slots.append(slot)
+        del self.referenced[block_id]
+
+    def choose_victim(self, frames):
+        # 2 sweeps, the first one may only clear reference bits
+        for _ in range(2 * len(self.slots)):
+            block_id = self.slots[self.hand]
+            self.hand = (self.hand + 1) % len(self.slots)
+            if block_id == None or frames[block_id].pin_count > 0:
+                continue
+            if self.referenced[block_id]:
+                self.referenced[block_id] = False
+                continue
+            return block_id
+        return None
+
+POLICIES = {"lru": LRUPolicy, "clock": ClockPolicy}
+
+class Frame:
+    def __init__(self, block):
+        self.block = block # the buffered copy of the block
+        self.pin_count = 0
+        self.dirty = False
+
+class BufferPool:
+    # keeps up to num_frames blocks of a Disk in memory, the disk is only read on a miss and only written on write-back
+    # hits, misses (physical block reads) and write-backs (physical block writes) are counted in Tracker:
+    # "buffer_hit", "buffer_miss", "buffer_write_back", read_block, pin and write_block are counted as logical accesses
+    # has the same interface as Disk (read_block, write_block, get_next_free, deallocate, ...) so it can be used in its place
+    # lock guards the frames like Disk.lock guards the allocation state
+    def __init__(self, disk, num_frames=1024, policy="lru"):
+        if num_frames < 1:
+            raise Exception(f"num_frames: {num_frames} must be at least 1")
+        if policy not in POLICIES:
+            raise Exception(f"Invalid policy: {policy}. Must be one of {list(POLICIES)}")
+        self.disk = disk
+        self.block_size = disk.block_size
+        self.num_blocks = disk.num_blocks
+        self.non_full_data_queue = disk.non_full_data_queue
+        self.num_frames = num_frames
+        self.policy = POLICIES[policy](num_frames)
+        self.frames = {} # block_id => Frame
+        self.lock = threading.RLock()
+
+    def check_block_id(self, block_id):
+        if not 1 <= block_id < self.num_blocks:
+            raise Exception(
+                f"Invalid block id. Address must be within [1, {self.num_blocks-1}]"
+            )
+
+    def get_frame(self, block_id, read=True):
+        # returns the frame of block_id, bringing the block in (evicting if needed) on a miss
+        # read=False skips reading the block from disk, for when the caller overwrites the whole block
+        frame = self.frames.get(block_id)
+        if frame != None:
+            Tracker.increment_count("buffer_hit")
+        else:
+            self.check_block_id(block_id)
+            if len(self.frames) >= self.num_frames:
+                self.evict()
+            if read:
+                Tracker.increment_count("buffer_miss")
+                frame = Frame(Block(bytes_=bytearray(self.disk.read_block(block_id, logical=False).bytes)))
+            else:
+                frame = Frame(Block(self.block_size))
+            self.frames[block_id] = frame
+        self.policy.record_access(block_id)
+        return frame
+
+    def evict(self):
+        victim = self.policy.choose_victim(self.frames)
+        if victim == None:
+            raise Exception("Buffer pool full, all frames are pinned")
+        self.flush_block(victim)
+        del self.frames[victim]
+        self.policy.remove(victim)
+
+    def pin(self, block_id):
+        # the returned block stays in the pool until unpin is called, changes to it must be reported with unpin(dirty=True)
+        with self.lock:
+            frame = self.get_frame(block_id)
+            frame.pin_count += 1
+            if Tracker.enabled:
+                Tracker.count_io("logical_read", frame.block)
+            return frame.block
+
+    def unpin(self, block_id, dirty=False):
+        with self.lock:
+            frame = self.frames.get(block_id)
+            if frame == None or frame.pin_count == 0:
+                raise Exception(f"Block {block_id} is not pinned")
+            frame.pin_count -= 1
+            frame.dirty = frame.dirty or dirty
+
+    def flush_block(self, block_id):
+        # write back the block if it is dirty
+        with self.lock:
+            frame = self.frames[block_id]
+            if frame.dirty:
+                Tracker.increment_count("buffer_write_back")
+                self.disk.write_block(block_id, frame.block, logical=False)
+                frame.dirty = False
+
+    def flush(self):
+        # write back all dirty blocks and persist the disk
+        with self.lock:
+            for block_id in self.frames:
+                self.flush_block(block_id)
+            self.disk.flush()
+
+    def commit(self):
+        # write back all dirty blocks and commit them (see Disk.commit)
+        with self.lock:
+            for block_id in self.frames:
+                self.flush_block(block_id)
+            self.disk.commit()
+
+    def read_block(self, block_id):
+        # the returned block is only valid until it is evicted, use pin/unpin to hold on to it
+        with self.lock:
+            block = self.get_frame(block_id).block
+            if Tracker.enabled:
+                Tracker.count_io("logical_read", block)
+            return block
+
+    def write_block(self, block_id, block):
+        with self.lock:
+            if len(block) != self.block_size:
+                raise Exception(f"Block size: {len(block)} != {self.block_size}")
+            frame = self.get_frame(block_id, read=False)
+            if frame.block is not block:
+                frame.block.bytes[:] = block.bytes
+            frame.dirty = True
+            if Tracker.enabled:
+                Tracker.count_io("logical_write", block)
+
+    def get_next_free(self):
+        return self.disk.get_next_free()
+
+    def reserve(self, num_blocks):
+        return self.disk.reserve(num_blocks)
+
+    def release(self, block_ids):
+        self.disk.release(block_ids)
+
+    def get_non_full_data_block(self):
+        return self.disk.get_non_full_data_block()
+
+    def add_non_full_data_block(self, block_id):
+        self.disk.add_non_full_data_block(block_id)
+
+    def deallocate(self, block_id):
+        # the buffered copy is dropped without write-back
+        with self.lock:
+            frame = self.frames.get(block_id)
+            if frame != None:
+                if frame.pin_count > 0:
+                    raise Exception(f"Cannot deallocate pinned block {block_id}")
+                del self.frames[block_id]
+                self.policy.remove(block_id)
+            self.disk.deallocate(block_id)
+
+    def info(self):
+        return f"{self.disk.info()}, Buffer frames: {self.num_frames}"
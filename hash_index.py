@@ -0,0 +1,205 @@
+import struct
+import zlib
+
+from structures import Block
+from tracker import Tracker
+from utils import *
+
+# extendible hashing on tconst => (block_id, offset) of the record
+# the directory (2^global_depth bucket block ids, indexed by the low bits of the hash) is kept in memory,
+# so a lookup reads exactly 1 bucket block. save() writes the directory into a chain of directory blocks
+#
+# bucket block (header 13 bytes)
+#   type (1 byte, 4), block id (4), local depth (4), number of entries (4)
+#   entries: tconst (10 bytes, zero padded), block id (4), offset (4) => 18 bytes each
+# directory block (header 13 bytes)
+#   type (1 byte, 5), block id (4), next directory block id (4, 0 for the last), number of bucket ids (4)
+#   bucket ids (4 bytes each)
+ENTRY_STRUCT = struct.Struct("<10sII")
+MAX_DEPTH = 24 # bounds the directory to 2^24 bucket ids, only reached if more than a bucket of tconsts share 24 hash bits
+
+def hash_tconst(tconst):
+    # stable across runs unlike hash()
+    return zlib.crc32(encode_string(tconst, 10))
+
+class HashIndex:
+    # bucket reads and writes are counted in Tracker: "hash_bucket_read", "hash_bucket_write"
+    def __init__(self, disk, directory_block_id=None):
+        self.disk = disk
+        self.capacity = (disk.block_size - 13) // ENTRY_STRUCT.size
+        self.directory_capacity = (disk.block_size - 13) // 4
+        if self.capacity < 1:
+            raise Exception(f"Block size: {disk.block_size} is too small for a hash bucket")
+        self.directory_block_ids = [] # blocks the directory was last saved to
+        self.directory_dirty = True
+        if directory_block_id == None:
+            self.directory = [self.new_bucket(0)]
+        else:
+            self.load_directory(directory_block_id)
+
+    @classmethod
+    def open(cls, disk, directory_block_id):
+        # CLIENT API
+        return cls(disk, directory_block_id)
+
+    @classmethod
+    def build(cls, tree):
+        # CLIENT API
+        # indexes the tconst of every record of tree, and keeps the index in sync with tree from then on
+        index = cls(tree.disk)
+        node = tree.root
+        while not node.leaf:
+            node = node.get_child(0)
+        while node != None:
+            for key, pointer in zip(node.keys, node.pointers[:-1]):
+                index.insert(tree.decode_key(key)[1], pointer)
+            node = node.get_next_leaf()
+            tree.evict(keep=node)
+        tree.evict()
+        tree.hash_index = index
+        return index
+
+    def get_global_depth(self):
+        return len(self.directory).bit_length() - 1
+
+    def get_bucket_id(self, tconst):
+        return self.directory[hash_tconst(tconst) & (len(self.directory) - 1)]
+
+    def new_bucket(self, local_depth):
+        block_id = self.disk.get_next_free()
+        block = Block(self.disk.block_size)
+        self.set_bucket_header(block, block_id, local_depth, 0)
+        self.write_bucket(block_id, block)
+        return block_id
+
+    def set_bucket_header(self, block, block_id, local_depth, num_entries):
+        block.bytes[0] = 4
+        block.bytes[1:5] = convert_uint_to_bytes(block_id)
+        block.bytes[5:9] = convert_uint_to_bytes(local_depth)
+        block.bytes[9:13] = convert_uint_to_bytes(num_entries)
+
+    def get_bucket_header(self, block):
+        # returns local depth, number of entries
+        return convert_bytes_to_uint(block.bytes[5:9]), convert_bytes_to_uint(block.bytes[9:13])
+
+    def read_bucket(self, block_id):
+        Tracker.increment_count("hash_bucket_read")
+        block = self.disk.read_block(block_id)
+        if get_block_type(block) != "bucket":
+            raise Exception(f"Block {block_id} is not a hash bucket")
+        return block
+
+    def write_bucket(self, block_id, block):
+        Tracker.increment_count("hash_bucket_write")
+        self.disk.write_block(block_id, block)
+
+    def find(self, block, tconst_bytes):
+        # returns the offset of the entry of tconst in the bucket, -1 if it is not there
+        _, num_entries = self.get_bucket_header(block)
+        entries = bytes(block.bytes[13: 13 + num_entries * ENTRY_STRUCT.size])
+        pos = entries.find(tconst_bytes)
+        while pos != -1 and pos % ENTRY_STRUCT.size != 0:
+            pos = entries.find(tconst_bytes, pos + 1)
+        return pos + 13 if pos != -1 else -1
+
+    def search(self, tconst):
+        # CLIENT API
+        # returns (block_id, offset) of the record with tconst, None if there is none
+        block = self.read_bucket(self.get_bucket_id(tconst))
+        offset = self.find(block, convert_string_to_bytes(tconst, 10))
+        if offset == -1:
+            return None
+        _, block_id, record_offset = ENTRY_STRUCT.unpack_from(block.bytes, offset)
+        return block_id, record_offset
+
+    def insert(self, tconst, pointer):
+        # CLIENT API
+        # adds tconst => pointer, or moves tconst to pointer if it is already indexed
+        tconst_bytes = convert_string_to_bytes(tconst, 10)
+        while True:
+            bucket_id = self.get_bucket_id(tconst)
+            block = self.read_bucket(bucket_id)
+            offset = self.find(block, tconst_bytes)
+            local_depth, num_entries = self.get_bucket_header(block)
+            if offset == -1 and num_entries < self.capacity:
+                offset = 13 + num_entries * ENTRY_STRUCT.size
+                self.set_bucket_header(block, bucket_id, local_depth, num_entries + 1)
+            if offset != -1:
+                ENTRY_STRUCT.pack_into(block.bytes, offset, tconst_bytes, pointer[0], pointer[1])
+                self.write_bucket(bucket_id, block)
+                return
+            self.split(bucket_id, block)
+
+    def split(self, bucket_id, block):
+        # moves the entries whose hash has bit local_depth set into a new bucket, doubling the directory if needed
+        local_depth, num_entries = self.get_bucket_header(block)
+        if local_depth == MAX_DEPTH:
+            raise Exception(f"Hash bucket {bucket_id} cannot be split further")
+        if local_depth == self.get_global_depth():
+            self.directory = self.directory * 2
+        entries = list(ENTRY_STRUCT.iter_unpack(block.bytes[13: 13 + num_entries * ENTRY_STRUCT.size]))
+        stay = [entry for entry in entries if not hash_tconst(convert_bytes_to_string(entry[0])) >> local_depth & 1]
+        move = [entry for entry in entries if hash_tconst(convert_bytes_to_string(entry[0])) >> local_depth & 1]
+
+        new_id = self.disk.get_next_free()
+        for block_id, bucket, bucket_entries in [(bucket_id, block, stay), (new_id, Block(self.disk.block_size), move)]:
+            bucket.bytes[13:] = bytearray(len(bucket) - 13)
+            self.set_bucket_header(bucket, block_id, local_depth + 1, len(bucket_entries))
+            for i, entry in enumerate(bucket_entries):
+                ENTRY_STRUCT.pack_into(bucket.bytes, 13 + i * ENTRY_STRUCT.size, *entry)
+            self.write_bucket(block_id, bucket)
+        for i in range(len(self.directory)):
+            if self.directory[i] == bucket_id and i >> local_depth & 1:
+                self.directory[i] = new_id
+        self.directory_dirty = True
+
+    def delete(self, tconst):
+        # CLIENT API
+        # returns True if tconst was indexed, the last entry of the bucket fills the hole
+        # buckets are not merged back, so the directory never shrinks
+        bucket_id = self.get_bucket_id(tconst)
+        block = self.read_bucket(bucket_id)
+        offset = self.find(block, convert_string_to_bytes(tconst, 10))
+        if offset == -1:
+            return False
+        local_depth, num_entries = self.get_bucket_header(block)
+        last = 13 + (num_entries - 1) * ENTRY_STRUCT.size
+        block.bytes[offset: offset + ENTRY_STRUCT.size] = block.bytes[last: last + ENTRY_STRUCT.size]
+        block.bytes[last: last + ENTRY_STRUCT.size] = bytearray(ENTRY_STRUCT.size)
+        self.set_bucket_header(block, bucket_id, local_depth, num_entries - 1)
+        self.write_bucket(bucket_id, block)
+        return True
+
+    def save(self):
+        # CLIENT API
+        # writes the directory if it changed since the last save, returns the id of its first block for open
+        if self.directory_dirty:
+            num_blocks = -(-len(self.directory) // self.directory_capacity)
+            while len(self.directory_block_ids) < num_blocks:
+                self.directory_block_ids.append(self.disk.get_next_free())
+            while len(self.directory_block_ids) > num_blocks:
+                self.disk.deallocate(self.directory_block_ids.pop())
+            for i, block_id in enumerate(self.directory_block_ids):
+                bucket_ids = self.directory[i * self.directory_capacity: (i + 1) * self.directory_capacity]
+                next_block_id = self.directory_block_ids[i + 1] if i + 1 < num_blocks else 0
+                block = Block(self.disk.block_size)
+                block.bytes[0] = 5
+                block.bytes[1:5] = convert_uint_to_bytes(block_id)
+                block.bytes[5:9] = convert_uint_to_bytes(next_block_id)
+                block.bytes[9:13] = convert_uint_to_bytes(len(bucket_ids))
+                block.bytes[13: 13 + 4 * len(bucket_ids)] = struct.pack(f"<{len(bucket_ids)}I", *bucket_ids)
+                self.disk.write_block(block_id, block)
+            self.directory_dirty = False
+        return self.directory_block_ids[0]
+
+    def load_directory(self, block_id):
+        self.directory = []
+        while block_id != 0:
+            block = self.disk.read_block(block_id)
+            if get_block_type(block) != "directory":
+                raise Exception(f"Block {block_id} is not a hash directory block")
+            self.directory_block_ids.append(block_id)
+            num_bucket_ids = convert_bytes_to_uint(block.bytes[9:13])
+            self.directory.extend(struct.unpack_from(f"<{num_bucket_ids}I", block.bytes, 13))
+            block_id = convert_bytes_to_uint(block.bytes[5:9])
+        self.directory_dirty = False
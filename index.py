@@ -0,0 +1,78 @@
+from tree import Tree
+from utils import *
+
+MIN_KEY = (float("-inf"), "")
+MAX_KEY = (float("inf"), chr(255))
+
+# fields of a record that can be indexed => (position in the record, key format of the first key component)
+# keys are (value, tconst) so they are unique, the tconst index uses (0, tconst)
+INDEX_FIELDS = {
+    "averageRating": (1, "f"),
+    "numVotes": (2, "I"),
+    "tconst": (0, "I"),
+}
+
+class Index:
+    # a B+ tree over 1 field of the records
+    # the clustered index is the one the data blocks are sorted by (averageRating, built from pack_records)
+    # the others are secondary indexes pointing into the same data blocks
+    def __init__(self, field, tree, clustered=False):
+        if field not in INDEX_FIELDS:
+            raise Exception(f"Invalid field: {field}. Must be one of {list(INDEX_FIELDS)}")
+        self.field = field
+        self.tree = tree
+        self.clustered = clustered
+
+    def get_key(self, record):
+        position, _ = INDEX_FIELDS[self.field]
+        if self.field == "tconst":
+            return (0, record[0])
+        return (record[position], record[0])
+
+    def get_key_range(self, op, value):
+        # returns the (lower, upper) augmented keys, inclusive, of the keys satisfying field op value, None is unbounded
+        # for tconst the bounds of < and > include value itself, the query layer rechecks every condition on the records
+        if self.field == "tconst":
+            low, high = (0, value), (0, value)
+        else:
+            low, high = (value, ""), (value, chr(255)) # below and above every key with this value
+        if op == "==":
+            return low, high
+        if op == ">=":
+            return low, None
+        if op == ">":
+            return high, None
+        if op == "<=":
+            return None, high
+        if op == "<":
+            return None, low
+        raise Exception(f"Invalid operator: {op}")
+
+    def insert(self, record, pointer):
+        self.tree.insert(self.get_key(record), pointer)
+
+    def delete(self, record):
+        # only for secondary indexes, the clustered index deletes records with Tree.delete/delete_range
+        self.tree._delete(self.tree.encode_key(self.get_key(record)))
+        self.tree.evict()
+
+def iter_records_with_pointers(tree):
+    # yields (record, (block_id, offset)) for every record of the tree in key order, each data block is decoded once
+    block_id, records = None, None
+    for pointer in tree.root.iter_range(tree.encode_key(MIN_KEY), tree.encode_key(MAX_KEY)):
+        if pointer[0] != block_id:
+            block_id = pointer[0]
+            records = read_all_slots_from_data_block(tree.disk.read_block(block_id))
+        yield records[(pointer[1] - 13) // RECORD_STRUCT.size], pointer
+
+def build_index(tree, field, fill_factor=1.0, compact=False):
+    # builds a secondary index on field over the records of tree, in the same disk
+    # and keeps it in sync with the inserts, deletes and compaction of tree from then on
+    _, key_format = INDEX_FIELDS[field]
+    index = Index(field, None)
+    items = sorted((index.get_key(record), pointer) for record, pointer in iter_records_with_pointers(tree))
+    tree.evict()
+    index.tree = Tree.bulk_load(tree.disk, items, fill_factor, tree.max_keys, compact, key_format, secondary=True,
+                                tconst_prefix=tree.tconst_prefix, packed_keys=tree.packed_keys)
+    tree.secondary_indexes.append(index)
+    return index
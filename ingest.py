@@ -0,0 +1,149 @@
+import heapq
+import itertools
+import tempfile
+
+from structures import Block
+from utils import *
+
+RUN_SIZE = 500000 # records sorted in memory at a time, 1 run file is RUN_SIZE * 18 bytes
+READ_SIZE = 4096 # records read from a run file at a time
+
+def augmented_key(record):
+    # the B+ tree key of a record, (averageRating, tconst) since averageRating has duplicates
+    return (record[1], record[0])
+
+def external_sort(records, run_size=RUN_SIZE, tmp_dir=None):
+    # sorts a stream of records by augmented_key while holding at most run_size records in memory
+    # sorted runs are spilled to temporary files as fixed length records and then merged lazily
+    records = iter(records)
+    runs = []
+    try:
+        while True:
+            run = list(itertools.islice(records, run_size))
+            if not run:
+                break
+            run.sort(key=augmented_key)
+            if not runs and len(run) < run_size:
+                # everything fits in 1 run, no need to spill
+                yield from run
+                return
+            f = tempfile.TemporaryFile(dir=tmp_dir)
+            runs.append(f)
+            for i in range(0, len(run), READ_SIZE):
+                f.write(convert_records_to_bytes(run[i:i+READ_SIZE]))
+            f.seek(0)
+            del run
+        yield from heapq.merge(*(read_run(f) for f in runs), key=augmented_key)
+    finally:
+        for f in runs:
+            f.close()
+
+def read_run(f):
+    # streams the records of a run file written by external_sort
+    while True:
+        bytes_ = f.read(READ_SIZE * RECORD_STRUCT.size)
+        if not bytes_:
+            return
+        yield from convert_bytes_to_records(bytes_)
+
+def pack_records(disk, sorted_records, data_block_ids=None):
+    # packs the sorted records into data blocks and yields (augmented_key, (block_id, offset)) for Tree.bulk_load
+    # each data block is built in memory and written to disk once, when it is full (or at the end)
+    # if data_block_ids is given, the id of every data block used is appended to it
+    data_id = None
+    data_block = None
+    for record in sorted_records:
+        record_bytes = convert_record_to_bytes(record)
+        # insert into data block
+        inserted_at = insert_record_bytes(data_block, record_bytes) if data_block else -1
+        if inserted_at == -1:
+            if data_block:
+                disk.write_block(data_id, data_block)
+            data_id = disk.get_next_free()
+            data_block = Block(disk.block_size)
+            set_data_block_header(data_block, data_id)
+            if data_block_ids != None:
+                data_block_ids.append(data_id)
+            inserted_at = insert_record_bytes(data_block, record_bytes)
+            assert inserted_at != -1
+        yield augmented_key(record), (data_id, inserted_at)
+    if data_block:
+        disk.write_block(data_id, data_block)
+        if not is_data_block_full(data_block):
+            disk.add_non_full_data_block(data_id)
+
+def store_record(disk, record):
+    # stores 1 record in a data block with room for it, reusing the slot of a deleted record if there is one
+    # returns (augmented_key, (block_id, offset)) for Tree.insert
+    record_bytes = convert_record_to_bytes(record)
+    with disk.lock:
+        data_id = disk.get_non_full_data_block()
+        if data_id == -1:
+            data_id = disk.get_next_free()
+            data_block = Block(disk.block_size)
+            set_data_block_header(data_block, data_id)
+        else:
+            data_block = disk.read_block(data_id)
+        free_slots = get_free_slots(data_block)
+        inserted_at = insert_record_bytes(data_block, record_bytes, free_slots[0] if free_slots else None)
+        assert inserted_at != -1
+        disk.write_block(data_id, data_block)
+        if not is_data_block_full(data_block):
+            disk.add_non_full_data_block(data_id)
+    return augmented_key(record), (data_id, inserted_at)
+
+def compact_data_blocks(tree, min_fill=0.5):
+    # online compaction: the records of data blocks that are less than min_fill full are repacked into as few
+    # data blocks as possible, and the leaf pointers to them are patched in place
+    # the old blocks are only freed once every pointer is moved, a failure midway moves the pointers back
+    # returns the number of data blocks freed
+    disk = tree.disk
+    capacity = (disk.block_size - 13) // RECORD_STRUCT.size
+    sparse_ids = []
+    records = []
+    for block_id in list(disk.non_full_data_queue):
+        block_records = read_all_records_from_data_block(disk.read_block(block_id))
+        if len(block_records) < min_fill * capacity:
+            sparse_ids.append(block_id)
+            records.extend(block_records)
+    if -(-len(records) // capacity) >= len(sparse_ids):
+        return 0 # nothing to gain
+    # repacked in key order, so a range scan over them touches as few blocks as possible
+    records.sort(key=augmented_key)
+    def move(key, record, pointer):
+        # patches the leaf and index pointers of the record, returns its old pointer
+        node_key = tree.encode_key(key)
+        found = tree.root.search_first_gte(node_key)
+        if found == None or found[0].keys[found[1]] != node_key:
+            raise Exception(f"Record {key} is not in the tree")
+        leaf, i = found
+        old_pointer = leaf.pointers[i]
+        leaf.pointers[i] = pointer
+        leaf.mark_dirty()
+        if tree.hash_index != None:
+            tree.hash_index.insert(key[1], pointer)
+        for index in tree.secondary_indexes:
+            index.delete(record)
+            index.insert(record, pointer)
+        tree.evict(keep=leaf)
+        return old_pointer
+    data_block_ids = []
+    # every new data block is written before the first pointer is moved to it (pack_records yields a pointer before
+    # its block is written)
+    packed = list(pack_records(disk, records, data_block_ids))
+    moved = [] # (key, record, old pointer)
+    try:
+        for (key, pointer), record in zip(packed, records):
+            moved.append((key, record, move(key, record, pointer)))
+    except Exception:
+        # the pointers moved so far go back to the old blocks, which are untouched, and the new blocks are freed
+        for key, record, old_pointer in moved:
+            move(key, record, old_pointer)
+        tree.evict()
+        for block_id in data_block_ids:
+            disk.deallocate(block_id)
+        raise
+    tree.evict()
+    for block_id in sparse_ids:
+        disk.deallocate(block_id)
+    return len(sparse_ids) - len(data_block_ids)
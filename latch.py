@@ -0,0 +1,46 @@
+import threading
+
+class RWLatch:
+    # a read/write latch: any number of readers or 1 writer
+    # waiting writers go first, a reader that arrives while a writer waits blocks until the writer is done
+    # so a stream of readers cannot starve a writer
+    __slots__ = ("cond", "readers", "writer", "waiting_writers")
+
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+
+    def acquire_read(self, blocking=True):
+        # returns False without waiting if blocking == False and the latch is not free for readers
+        with self.cond:
+            if not blocking and (self.writer or self.waiting_writers):
+                return False
+            while self.writer or self.waiting_writers:
+                self.cond.wait()
+            self.readers += 1
+            return True
+
+    def release_read(self):
+        with self.cond:
+            if self.readers == 0:
+                raise Exception("Latch is not read latched")
+            self.readers -= 1
+            if self.readers == 0:
+                self.cond.notify_all()
+
+    def acquire_write(self):
+        with self.cond:
+            self.waiting_writers += 1
+            while self.writer or self.readers:
+                self.cond.wait()
+            self.waiting_writers -= 1
+            self.writer = True
+
+    def release_write(self):
+        with self.cond:
+            if not self.writer:
+                raise Exception("Latch is not write latched")
+            self.writer = False
+            self.cond.notify_all()
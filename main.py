@@ -1,59 +1,62 @@
 from structures import Block, Disk, BLOCK_SIZE
 from tree import Tree
+from ingest import external_sort, pack_records
+from parallel import parallel_bulk_load
+from buffer_pool import BufferPool, POLICIES
+from index import Index, build_index
+from query import execute_query, execute_range_query
 from tracker import Tracker
 from utils import *
 
+import argparse
+import json
+import os
+import tempfile
 import time
 import random
 import pandas as pd
 
-def main():
-    start = time.time()
-
-    # read in the data as a list[list[tconst, average_rating, num_votes]]
-    data = parse_data()
-    data.sort(key=lambda record: (record[1], record[0]))
-
-    # init tree
-    tree = Tree()
-
-    # initialize data block
-    data_id = Disk.get_next_free()
-    data_block = Disk.read_block(data_id)
-    set_data_block_header(data_block, data_id)
-
-    # keep track of the number of data blocks
-    num_data_blocks = 0
-    
-    # insert the data
-    for i, record in enumerate(data):
-        if i != 0 and i % 50000 == 0:
-            print(f"{i} records inserted")
-        record_bytes = convert_record_to_bytes(record)
-        # insert into data block
-        inserted_at = insert_record_bytes(data_block, record_bytes)
-        if inserted_at == -1:
-            num_data_blocks += 1
-            data_id = Disk.get_next_free()
-            data_block = Disk.read_block(data_id)
-            set_data_block_header(data_block, data_id)
-            inserted_at = insert_record_bytes(data_block, record_bytes)
-            assert inserted_at != -1
-        # write to disk for every record insertion
-        Disk.write_block(data_id, data_block)
-        # insert to B+ Tree (block_id, offset, key)
-        tree.insert((record[1], record[0]), (data_id, inserted_at))
-
-    end = time.time()
-    print(f"Seconds for insertion: {end-start}")
-
-    start = time.time()
-    tree.save()
-    end = time.time()
-    print(f"Seconds for saving tree to disk: {end-start}")
+def main(block_size=BLOCK_SIZE, buffer_frames=1024, buffer_policy="lru", tconst_prefix=None, packed_keys=False, workers=1,
+         stats_path=None):
+    # all block I/O goes through the buffer pool so that physical reads/writes can be measured and bounded
+    # with more than 1 worker the disk is backed by a temporary file that the worker processes write into
+    # every experiment is measured in its own Stats, written as JSON to stats_path if given
+    experiment_stats = {}
+    tmp_dir = tempfile.TemporaryDirectory() if workers > 1 else None
+    pool = BufferPool(Disk(block_size, path=os.path.join(tmp_dir.name, "disk.bin") if tmp_dir else None), buffer_frames, buffer_policy)
+    print(pool.info())
+    with Tracker.measure() as stats:
+        start = time.time()
+        with Tracker.phase("insert"):
+            # stream the data sorted by the augmented key (averageRating, tconst) with bounded memory
+            data = external_sort(iter_data())
+
+            # pack the records into data blocks and build the B+ Tree bottom-up since data is already sorted
+            data_block_ids = []
+            if workers > 1:
+                tree = parallel_bulk_load(pool, data, workers, tconst_prefix=tconst_prefix, packed_keys=packed_keys,
+                                          data_block_ids=data_block_ids)
+            else:
+                tree = Tree.bulk_load(pool, pack_records(pool, data, data_block_ids), tconst_prefix=tconst_prefix, packed_keys=packed_keys)
+
+        end = time.time()
+        print(f"Seconds for insertion: {end-start}")
+
+        start = time.time()
+        with Tracker.phase("save"):
+            tree.save()
+            pool.flush()
+        end = time.time()
+        print(f"Seconds for saving tree to disk: {end-start}")
+    experiment_stats["load"] = stats
+
+    def print_buffer_statistic(stats):
+        print(f"Buffer pool: {stats.counts['buffer_hit']} hits, "
+              f"{stats.counts['buffer_miss']} misses (physical block reads), "
+              f"{stats.counts['buffer_write_back']} write-backs (physical block writes)")
 
     def get_ptr_key_sequence(node):
-        keys_list = node.keys
+        keys_list = [node.tree.decode_key(key) for key in node.keys]
         ptrs_list = node.get_child_ids()
         lastPtr = ptrs_list.pop()
         result = ""
@@ -64,12 +67,7 @@ def main():
         result += f"{lastPtr} | \n"
         return result
 
-    def generate_select_query_statistic(leaf_nodes_dict, non_leaf_nodes_dict, blocks_offsets_list, file_settings):
-        unique_data_block_ids = set(
-            block_id for block_id, _ in blocks_offsets_list)  # since pointers can point to same data block
-        selected_records = [convert_bytes_to_record(read_record_bytes(Disk.read_block(block_id), offset)) for
-                            block_id, offset in blocks_offsets]
-
+    def generate_select_query_statistic(result, file_settings):
         # Index Nodes
         index_file = file_settings[0]
         data_file = file_settings[1]
@@ -78,7 +76,7 @@ def main():
         # index nodes
         ind_file = open(index_file, "w")
         ind_file.write("The content of the non-leaf index nodes:\n")
-        for ind, index_node in enumerate(Tracker.track_set["non-leaf"]):
+        for ind, index_node in enumerate(result.non_leaf_nodes):
             if index_node.parent:
                 ind_file.write(
                     f"{ind}. node_id = {index_node.block_id} with parent_node_id = {index_node.parent.block_id}\n")
@@ -88,44 +86,45 @@ def main():
 
         ind_file.write("\nThe content of the leaf index nodes:\n")
         count = 0
-        for index_node in Tracker.track_set["leaf"]:  # might just give first 5 in report
+        for index_node in result.leaf_nodes:  # might just give first 5 in report
             count += 1
             ind_file.write(
                 f"{count}. node_id = {index_node.block_id} with parent_block_id = {index_node.parent.block_id}\n")
             ind_file.write(get_ptr_key_sequence(index_node))
-        print(f"The number of index nodes the process accessed: {len(leaf_nodes_dict) + len(non_leaf_nodes_dict)} "
-              f"({len(non_leaf_nodes_dict)} Non-leaf nodes, {len(leaf_nodes_dict)} leaf nodes)")
+        print(f"The number of index nodes the process accessed: {result.get_num_index_nodes()} "
+              f"({len(result.non_leaf_nodes)} Non-leaf nodes, {len(result.leaf_nodes)} leaf nodes)")
         print(f'Content of index nodes accessed saved to "{index_file}"\n')
 
         # data blocks
         d_file = open(data_file, "w")
         d_file.write("The content of the data blocks:\n")
-        for data_block_id in unique_data_block_ids:
+        for data_block_id, records in result.data_blocks.items():
             d_file.write(f"Records for data block with id {data_block_id}:\n")
             d_file.write("| ")
-            d_file.write(f"{' | '.join('{:^27}'.format(str(record)) for record in read_all_records_from_data_block(Disk.read_block(data_block_id)))}")
+            d_file.write(f"{' | '.join('{:^27}'.format(str(record)) for record in records)}")
             d_file.write(" |\n")
-        print(f"The number of data blocks the process accessed: {len(unique_data_block_ids)}")
+        print(f"The number of data blocks the process accessed: {result.get_num_data_blocks()}")
+        print_buffer_statistic(result.stats)
         print(f'Content of data blocks accessed saved to "{data_file}"\n')
 
         # tconst of movies
-        tconst_records = [record[0] for record in selected_records]
+        tconst_records = [record[0] for record in result.records]
         df = pd.DataFrame(tconst_records, columns=["tconst of movies"])
         df.to_csv(result_file)
         print(f"Result:")
-        print(f'tconst of {len(selected_records)} movies saved to "{result_file}"\n')
+        print(f'tconst of {len(result.records)} movies saved to "{result_file}"\n')
 
     # experiment 1
     print("Experiment 1: Storing the data on the disk...\n")
-    block_count = num_data_blocks + 1
+    block_count = len(data_block_ids)
     node_count = tree.get_num_nodes()
-    print(f"Total number of data blocks: {block_count}") # num_data_blocks were fully filled, last is partially filled
+    print(f"Total number of data blocks: {block_count}") # all were fully filled except the last
     print(f"Total number of index nodes: {node_count}")
-    print(f"Total size of database: ({block_count} + {node_count}) * {BLOCK_SIZE}B = {(block_count + node_count)*BLOCK_SIZE}B\n")
+    print(f"Total size of database: ({block_count} + {node_count}) * {block_size}B = {(block_count + node_count)*block_size}B\n")
 
     # experiment 2
     print("Experiment 2: Building a B+ tree on the attribute 'averageRating'...\n")
-    print(f"The parameter n of the B+ tree is: {tree.root.max_keys}")
+    print(f"The parameter n of the B+ tree is: {tree.max_keys}")
     print(f"Total number of nodes in the B+ tree is: {tree.get_num_nodes()}")
     print(f"The height of the B+ tree is: {tree.get_height()}")
     print(f"The root node contents are: \n"
@@ -141,45 +140,63 @@ def main():
 
     # experiment 3
     print("Experiment 3: Retrieving tconst of movies with averageRating == 8...\n")
-    file_settings = [f"{BLOCK_SIZE}B_experiment_3_index_nodes.txt", f"{BLOCK_SIZE}B_experiment_3_data_blocks.txt",
-                     f"{BLOCK_SIZE}B_experiment_3_tconst_result.csv"]
+    file_settings = [f"{block_size}B_experiment_3_index_nodes.txt", f"{block_size}B_experiment_3_data_blocks.txt",
+                     f"{block_size}B_experiment_3_tconst_result.csv"]
 
-    Tracker.reset_all()
-    blocks_offsets = tree.search(8.0)
-    generate_select_query_statistic(Tracker.track_set['leaf'], Tracker.track_set['non-leaf'], blocks_offsets, file_settings)
+    result = execute_range_query(tree, 8.0, 8.0)
+    experiment_stats["experiment_3"] = result.stats
+    generate_select_query_statistic(result, file_settings)
 
-    selected_records = [convert_bytes_to_record(read_record_bytes(Disk.read_block(block_id), offset)) for
-                        block_id, offset in blocks_offsets]
     # the part below only for validation
     actual_records = []
-    for record in data:
+    for record in iter_data():
         if record[1] == 8.0:
             actual_records.append(record)
-    assert sorted(selected_records) == sorted(actual_records)
+    assert sorted(result.records) == sorted(actual_records)
     # tree.validate()
 
     # experiment 4
     print("\nExperiment 4: Retrieving tconst of movies with 7 <= averageRating <= 9...\n")
-    file_settings = [f"{BLOCK_SIZE}B_experiment_4_index_nodes.txt", f"{BLOCK_SIZE}B_experiment_4_data_blocks.txt",
-                     f"{BLOCK_SIZE}B_experiment_4_tconst_result.csv"]
-    Tracker.reset_all()
-    blocks_offsets = tree.search_range(7.0, 9.0)
-    generate_select_query_statistic(Tracker.track_set['leaf'], Tracker.track_set['non-leaf'], blocks_offsets, file_settings)
+    file_settings = [f"{block_size}B_experiment_4_index_nodes.txt", f"{block_size}B_experiment_4_data_blocks.txt",
+                     f"{block_size}B_experiment_4_tconst_result.csv"]
+    result = execute_range_query(tree, 7.0, 9.0)
+    experiment_stats["experiment_4"] = result.stats
+    generate_select_query_statistic(result, file_settings)
 
-    selected_records = [convert_bytes_to_record(read_record_bytes(Disk.read_block(block_id), offset)) for block_id, offset in blocks_offsets]
     # the part below only for validation
     actual_records = []
-    for record in data:
+    for record in iter_data():
         if 7.0 <= record[1] <= 9.0:
             actual_records.append(record)
-    assert sorted(selected_records) == sorted(actual_records)
+    assert sorted(result.records) == sorted(actual_records)
     # tree.validate()
 
+    # conjunctive query over the clustered index and a secondary index on numVotes
+    print("Retrieving movies with averageRating >= 8 and numVotes > 100000...\n")
+    indexes = {"averageRating": Index("averageRating", tree, clustered=True), "numVotes": build_index(tree, "numVotes")}
+    conditions = [("averageRating", ">=", 8.0), ("numVotes", ">", 100000)]
+    result = execute_query(indexes, conditions)
+    experiment_stats["conjunctive_query"] = result.stats
+    print(f"Plan: {result.plan}")
+    print(f"The number of index nodes the process accessed: {result.get_num_index_nodes()}")
+    print(f"The number of data blocks the process accessed: {result.get_num_data_blocks()}")
+    print(f"The number of movies found: {len(result.records)}\n")
+    # the part below only for validation
+    assert sorted(result.records) == sorted(record for record in iter_data() if record[1] >= 8.0 and record[2] > 100000)
+    # the numVotes index is not used again, so experiment 5 measures deleting from the averageRating tree alone
+    tree.secondary_indexes.remove(indexes["numVotes"])
+
     # experiment 5
-    Tracker.reset_all()
     print("Experiment 5: Deleting movies with averageRating == 7 and Updating B+ Tree...\n")
-    tree.delete(7.0)
-    print(f"The number of times that a node is deleted: {Tracker.track_counts['merge']}")
+    with Tracker.measure() as stats:
+        with Tracker.phase("delete"):
+            tree.delete_range(7.0, 7.0)
+        with Tracker.phase("save"):
+            num_saved = tree.save()
+    experiment_stats["experiment_5"] = stats
+    print(f"The number of times that a node is deleted: {stats.counts['merge'] + stats.counts['free']}")
+    print(f"The number of index nodes rewritten when saving the B+ tree: {num_saved}")
+    print_buffer_statistic(stats)
     print(f"Total number of nodes in the B+ tree is: {tree.get_num_nodes()}")
     print(f"The height of the B+ tree is: {tree.get_height()}")
     print(f"The root node contents are: \n"
@@ -194,11 +211,25 @@ def main():
         print(get_ptr_key_sequence(child))
 
     # the part below only for validation
-    blocks_offsets = tree.search_range(None, None)
-    records_remaining = [convert_bytes_to_record(read_record_bytes(Disk.read_block(block_id), offset)) for block_id, offset in blocks_offsets]
-    actual_records_remaining = [record for record in data if record[1] != 7.0]
+    records_remaining = list(tree.scan(None, None))
+    actual_records_remaining = [record for record in iter_data() if record[1] != 7.0]
     assert sorted(records_remaining) == sorted(actual_records_remaining)
     # tree.validate()
 
+    if stats_path != None:
+        with open(stats_path, "w") as f:
+            json.dump({name: stats.to_dict() for name, stats in experiment_stats.items()}, f, indent=2)
+        print(f'Statistics of every experiment saved to "{stats_path}"')
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE, help="block size in bytes (e.g. 100 or 500)")
+    parser.add_argument("--buffer-frames", type=int, default=1024, help="number of blocks the buffer pool holds")
+    parser.add_argument("--buffer-policy", choices=list(POLICIES), default="lru", help="buffer pool eviction policy")
+    parser.add_argument("--compress-keys", action="store_true", help="store the tconst prefix 'tt' once per index block (higher fan-out)")
+    parser.add_argument("--packed-keys", action="store_true", help="keep the keys as packed ints (implies --compress-keys)")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes building the B+ tree")
+    parser.add_argument("--stats", help="path of a JSON file to write the I/O and timing statistics of every experiment to")
+    args = parser.parse_args()
+    main(args.block_size, args.buffer_frames, args.buffer_policy, "tt" if args.compress_keys or args.packed_keys else None, args.packed_keys,
+         args.workers, args.stats)
\ No newline at end of file
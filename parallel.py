@@ -0,0 +1,163 @@
+import collections
+import concurrent.futures
+import itertools
+import os
+
+from ingest import augmented_key, pack_records
+from structures import Disk
+from tree import Tree, get_max_keys
+from utils import *
+
+PARTITION_SIZE = 200000 # records packed and indexed by 1 worker process at a time
+
+class PartitionDisk(Disk):
+    # a Disk over the file of the disk being built that only hands out the blocks reserved for 1 partition
+    # used by the worker processes, the allocation state of the file is left to the Disk of the main process
+    def __init__(self, block_size, disk_size, path, start, end):
+        super().__init__(block_size, disk_size) # without path, so the superblock is not restored
+        self.path = path
+        self.next_free_idx = start
+        self.end = end
+
+    def get_next_free(self):
+        if self.free_queue:
+            return self.free_queue.popleft()
+        if self.next_free_idx == self.end:
+            raise Exception(f"Partition ran out of its reserved blocks (up to block {self.end - 1})")
+        self.next_free_idx += 1
+        return self.next_free_idx - 1
+
+    def get_unused(self):
+        # the reserved blocks that were never handed out or were freed
+        return list(self.free_queue) + list(range(self.next_free_idx, self.end))
+
+def get_num_reserved_blocks(tree, num_records, fill_factor):
+    # upper bound on the blocks used to pack and index num_records records in 1 partition
+    records_per_block = (tree.disk.block_size - 13) // RECORD_STRUCT.size
+    num_leaves = -(-num_records // tree.get_leaf_target(fill_factor)) + 1
+    num_non_leaves = num_leaves // (tree.get_child_target(fill_factor) - 1) + 64 # + 2 per level for the rebalanced groups
+    return -(-num_records // records_per_block) + num_leaves + num_non_leaves
+
+def iter_partitions(sorted_records, partition_size):
+    # yields consecutive lists of partition_size records, a short last partition is merged into the one before it
+    # so every partition is big enough to build at least 1 non-leaf level
+    records = iter(sorted_records)
+    partition = list(itertools.islice(records, partition_size))
+    while partition:
+        nxt = list(itertools.islice(records, partition_size))
+        if len(nxt) < partition_size // 2:
+            partition += nxt
+            nxt = []
+        yield partition
+        partition = nxt
+
+def build_partition(task):
+    # runs in a worker process: packs the records of 1 partition into its reserved data blocks, builds the leaves and
+    # the non-leaf levels that have enough nodes on top of them, and writes every block into the shared disk file
+    # returns (levels, data_block_ids, non_full_data_block_ids, unused block ids)
+    # levels is list[list[(block_id, low key)]] bottom-up, the leaves are None unless they are the only level
+    path, block_size, disk_size, start, end, records_bytes, fill_factor, max_keys, key_format, tconst_prefix, packed_keys = task
+    disk = PartitionDisk(block_size, disk_size, path, start, end)
+    tree = Tree(disk, max_keys, key_format=key_format, tconst_prefix=tconst_prefix, packed_keys=packed_keys)
+    data_block_ids = []
+    leaves = tree.build_leaves(pack_records(disk, convert_bytes_to_records(records_bytes), data_block_ids), fill_factor)
+    # a level is only built on a level big enough for its nodes not to underflow once they have siblings from other partitions
+    levels = tree.build_levels(leaves, [node.keys[0] for node in leaves], fill_factor, 2 * (tree.max_keys + 1))
+    tree.save()
+    res = [[(node.block_id, low) for node, low in zip(nodes, lows)] for nodes, lows in levels]
+    if len(res) > 1:
+        res[0] = None
+    return res, data_block_ids, list(disk.non_full_data_queue), disk.get_unused()
+
+def get_first_leaf(node):
+    while not node.leaf:
+        node = node.get_child(0)
+    return node
+
+def get_last_leaf(node):
+    while not node.leaf:
+        node = node.get_child(len(node.pointers) - 1)
+    return node
+
+def parallel_bulk_load(disk, sorted_records, num_workers=None, partition_size=PARTITION_SIZE, fill_factor=1.0, max_keys=None,
+                       cache_size=None, compact=False, key_format="f", tconst_prefix=None, packed_keys=False, data_block_ids=None):
+    # CLIENT API
+    # packs the records (sorted by augmented key) into data blocks and builds a B+ tree on them like
+    # Tree.bulk_load(disk, pack_records(disk, sorted_records)), with the work spread over num_workers processes
+    # the input is cut into partitions of consecutive keys, each worker packs and indexes 1 partition at a time into
+    # blocks reserved for it, writing straight into the shared memory-mapped disk file, so disk must be file backed
+    # the subtrees of the partitions are then stitched together: their leaf chains are linked and the non-leaf levels
+    # above the highest level all of them built are built here
+    # cache_size == None materializes every node like Tree.bulk_load, otherwise the tree is returned like from Tree.open
+    # and the nodes written by the workers are loaded on demand into the node cache
+    # if data_block_ids is given, the id of every data block used is appended to it
+    base_disk = getattr(disk, "disk", disk) # a BufferPool keeps its Disk in .disk
+    if base_disk.path == None:
+        raise Exception("parallel_bulk_load needs a file backed Disk (Disk(path=...)) to share with the worker processes")
+    if base_disk.wal != None:
+        raise Exception("parallel_bulk_load cannot log the blocks the worker processes write, use a Disk without wal")
+    if not 0 < fill_factor <= 1:
+        raise Exception(f"fill_factor: {fill_factor} must be within (0, 1]")
+    if max_keys == None:
+        max_keys = get_max_keys(disk.block_size, tconst_prefix)
+    num_workers = num_workers or os.cpu_count()
+    base_disk.get_view() # the file gets its full size before the workers map it
+
+    # sizes only, the blocks of this tree are never written
+    sizing_tree = Tree(Disk(disk.block_size), max_keys)
+    partition_size = max(partition_size, 4 * (max_keys + 1) * sizing_tree.get_leaf_target(fill_factor))
+
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(num_workers) as executor:
+        pending = collections.deque() # at most 2 partitions per worker are held in memory
+        prev_key = None
+        for partition in iter_partitions(sorted_records, partition_size):
+            if prev_key != None and augmented_key(partition[0]) <= prev_key:
+                raise Exception(f"parallel_bulk_load input must be strictly increasing, got {augmented_key(partition[0])} after {prev_key}")
+            prev_key = augmented_key(partition[-1])
+            num_blocks = get_num_reserved_blocks(sizing_tree, len(partition), fill_factor)
+            start = disk.reserve(num_blocks)
+            task = (base_disk.path, disk.block_size, base_disk.disk_size, start, start + num_blocks,
+                    convert_records_to_bytes(partition), fill_factor, max_keys, key_format, tconst_prefix, packed_keys)
+            pending.append(executor.submit(build_partition, task))
+            if len(pending) >= 2 * num_workers:
+                results.append(pending.popleft().result())
+        results.extend(future.result() for future in pending)
+
+    if not results:
+        return Tree(disk, max_keys, cache_size, compact=compact, key_format=key_format, tconst_prefix=tconst_prefix,
+                    packed_keys=packed_keys)
+    for _, partition_data_block_ids, non_full_data_block_ids, unused in results:
+        if data_block_ids != None:
+            data_block_ids.extend(partition_data_block_ids)
+        for block_id in non_full_data_block_ids:
+            disk.add_non_full_data_block(block_id)
+        disk.release(unused)
+
+    # the levels above the highest level every partition built are freed and rebuilt over all partitions
+    height = min(len(levels) for levels, _, _, _ in results)
+    top = []
+    boundaries = [] # index in top of the first node of every partition but the first
+    for levels, _, _, _ in results:
+        if top:
+            boundaries.append(len(top))
+        top.extend(levels[height - 1])
+        for level in levels[height:]:
+            for block_id, _ in level:
+                disk.deallocate(block_id)
+
+    tree = Tree(disk, max_keys, cache_size, top[0][0], compact, key_format, False, tconst_prefix, packed_keys)
+    nodes = [tree.root] + [tree.load_node(block_id) for block_id, _ in top[1:]]
+    for i in boundaries:
+        last_leaf = get_last_leaf(nodes[i - 1])
+        last_leaf.pointers[-1] = get_first_leaf(nodes[i])
+        last_leaf.mark_dirty()
+    if len(nodes) > 1:
+        for node in nodes:
+            node.mark_dirty() # parent block id is in the header
+    level, _ = tree.build_levels(nodes, [low for _, low in top], fill_factor)[-1]
+    tree.root = level[0]
+    if cache_size == None:
+        tree.materialize()
+    tree.evict()
+    return tree
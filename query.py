@@ -0,0 +1,167 @@
+import itertools
+import operator
+
+from index import INDEX_FIELDS, MIN_KEY, MAX_KEY
+from tracker import Tracker
+from utils import *
+
+OPERATORS = {"==": operator.eq, ">=": operator.ge, ">": operator.gt, "<=": operator.le, "<": operator.lt}
+
+class QueryResult:
+    # records: the selected records [tconst, averageRating, numVotes] in key order (block order for an intersection)
+    # data_blocks: data block id => all records of the block, each accessed data block is read and decoded once
+    # leaf_nodes, non_leaf_nodes: index nodes accessed by the query (in access order)
+    # buffer_hits, buffer_misses: buffer pool accesses made by the query, 0 when the tree is not on a BufferPool
+    # plan: the QueryPlan that was executed, None for execute_range_query
+    # stats: the Stats measured while the query ran (see Tracker.measure), e.g. stats.to_json() for export
+    def __init__(self, records, data_blocks, leaf_nodes, non_leaf_nodes, buffer_hits, buffer_misses, plan=None, stats=None):
+        self.records = records
+        self.data_blocks = data_blocks
+        self.leaf_nodes = leaf_nodes
+        self.non_leaf_nodes = non_leaf_nodes
+        self.buffer_hits = buffer_hits
+        self.buffer_misses = buffer_misses
+        self.plan = plan
+        self.stats = stats
+
+    def get_num_index_nodes(self):
+        return len(self.leaf_nodes) + len(self.non_leaf_nodes)
+
+    def get_num_data_blocks(self):
+        return len(self.data_blocks)
+
+def fetch_data_blocks(disk, pointers):
+    # reads and decodes every data block referenced by pointers [(block_id, offset)] once, in block id order
+    # returns dict block_id => list of the records in every slot of the block (see read_all_slots_from_data_block)
+    data_blocks = {}
+    for block_id in sorted({block_id for block_id, _ in pointers}):
+        data_blocks[block_id] = read_all_slots_from_data_block(disk.read_block(block_id))
+    return data_blocks
+
+def fetch_records(disk, pointers):
+    # returns (records in the order of pointers, dict block_id => all records of the block)
+    data_blocks = fetch_data_blocks(disk, pointers)
+    records = [data_blocks[block_id][(offset - 13) // RECORD_STRUCT.size] for block_id, offset in pointers]
+    for block_id, slots in data_blocks.items():
+        data_blocks[block_id] = [record for record in slots if record[0]] # deleted records
+    return records, data_blocks
+
+def make_query_result(records, data_blocks, stats, plan=None):
+    return QueryResult(
+        records,
+        data_blocks,
+        list(stats.nodes["leaf"].values()),
+        list(stats.nodes["non-leaf"].values()),
+        stats.counts["buffer_hit"],
+        stats.counts["buffer_miss"],
+        plan,
+        stats,
+    )
+
+def execute_range_query(tree, lower, upper):
+    # runs lower <= averageRating <= upper (None for unbounded) against the tree and fetches the selected records
+    # the query is measured in its own Stats (QueryResult.stats)
+    with Tracker.measure(keep_nodes=True) as stats:
+        with Tracker.phase("search"):
+            pointers = tree.search_range(lower, upper)
+        with Tracker.phase("fetch"):
+            records, data_blocks = fetch_records(tree.disk, pointers)
+    return make_query_result(records, data_blocks, stats)
+
+class QueryPlan:
+    # indexes: the indexes to scan, the pointers they return are intersected if there is more than 1
+    # key_ranges: (lower, upper) augmented keys scanned in each index
+    # cost: estimated block reads per record in the table
+    def __init__(self, indexes, key_ranges, cost):
+        self.indexes = indexes
+        self.key_ranges = key_ranges
+        self.cost = cost
+
+    def __repr__(self):
+        scans = " AND ".join(f"{index.field}[{lower}, {upper}]" for index, (lower, upper) in zip(self.indexes, self.key_ranges))
+        return f"{'INTERSECT ' if len(self.indexes) > 1 else ''}{scans} (cost {self.cost:.4f})"
+
+def check_conditions(conditions):
+    for field, op, _ in conditions:
+        if field not in INDEX_FIELDS:
+            raise Exception(f"Invalid field: {field}. Must be one of {list(INDEX_FIELDS)}")
+        if op not in OPERATORS:
+            raise Exception(f"Invalid operator: {op}. Must be one of {list(OPERATORS)}")
+
+def get_key_range(index, conditions):
+    # intersects the key ranges of the conditions on index.field, returns (lower, upper) with None for unbounded
+    lower, upper = None, None
+    for field, op, value in conditions:
+        if field == index.field:
+            low, high = index.get_key_range(op, value)
+            if low != None and (lower == None or low > lower):
+                lower = low
+            if high != None and (upper == None or high < upper):
+                upper = high
+    return lower, upper
+
+def plan_query(indexes, conditions):
+    # picks how to run the conjunction of conditions [(field, op, value)] with the indexes {field: Index}
+    # candidates: a full scan of the clustered index, a range scan of 1 index, or the intersection of the pointers of 2
+    # the cost is estimated in block reads per record in the table, index selectivities come from estimate_fraction
+    check_conditions(conditions)
+    clustered = [index for index in indexes.values() if index.clustered]
+    if not clustered:
+        raise Exception("The clustered index is needed to plan a query")
+    clustered = clustered[0]
+    records_per_block = (clustered.tree.disk.block_size - 13) // RECORD_STRUCT.size
+
+    def get_fetch_cost(fraction, clustered_fraction):
+        # data blocks read to fetch fraction of the records, each data block is read once (see fetch_data_blocks)
+        # the records in range of the clustered index are packed together, others are scattered over the data blocks
+        cost = min(fraction, 1 / records_per_block)
+        if clustered_fraction != None:
+            cost = min(cost, clustered_fraction / records_per_block)
+        return cost
+
+    scans = [] # (index, key range, fraction)
+    for field in sorted({field for field, _, _ in conditions}):
+        if field in indexes:
+            index = indexes[field]
+            lower, upper = get_key_range(index, conditions)
+            fraction = 0.0 if lower != None and upper != None and lower > upper else index.tree.root.estimate_fraction(
+                index.tree.encode_key(lower if lower != None else MIN_KEY), index.tree.encode_key(upper if upper != None else MAX_KEY)
+            )
+            index.tree.evict()
+            scans.append((index, (lower, upper), fraction))
+
+    plans = [QueryPlan([clustered], [(None, None)], 1 / clustered.tree.max_keys + 1 / records_per_block)]
+    for index, key_range, fraction in scans:
+        cost = fraction / index.tree.max_keys + get_fetch_cost(fraction, fraction if index.clustered else None)
+        plans.append(QueryPlan([index], [key_range], cost))
+    for (index_1, key_range_1, fraction_1), (index_2, key_range_2, fraction_2) in itertools.combinations(scans, 2):
+        clustered_fraction = fraction_1 if index_1.clustered else fraction_2 if index_2.clustered else None
+        cost = fraction_1 / index_1.tree.max_keys + fraction_2 / index_2.tree.max_keys + \
+            get_fetch_cost(fraction_1 * fraction_2, clustered_fraction)
+        plans.append(QueryPlan([index_1, index_2], [key_range_1, key_range_2], cost))
+    return min(plans, key=lambda plan: plan.cost)
+
+def execute_query(indexes, conditions, plan=None):
+    # runs the conjunction of conditions [(field, op, value)], e.g. [("averageRating", ">=", 8.0), ("numVotes", ">", 100000)]
+    # with the plan chosen by plan_query, every condition is rechecked on the fetched records
+    # the query (and its planning) is measured in its own Stats (QueryResult.stats)
+    with Tracker.measure(keep_nodes=True) as stats:
+        if plan == None:
+            with Tracker.phase("plan"):
+                plan = plan_query(indexes, conditions)
+            # the nodes read to plan are not reported as accessed by the query
+            stats.blocks.clear()
+            stats.nodes.clear()
+        with Tracker.phase("search"):
+            pointers = None
+            for index, (lower, upper) in zip(plan.indexes, plan.key_ranges):
+                found = index.tree.root.search_range(
+                    index.tree.encode_key(lower if lower != None else MIN_KEY), index.tree.encode_key(upper if upper != None else MAX_KEY)
+                )
+                index.tree.evict()
+                pointers = found if pointers == None else sorted(set(pointers).intersection(found))
+        with Tracker.phase("fetch"):
+            records, data_blocks = fetch_records(plan.indexes[0].tree.disk, pointers)
+        checks = [(INDEX_FIELDS[field][0], OPERATORS[op], value) for field, op, value in conditions]
+        records = [record for record in records if all(check(record[position], value) for position, check, value in checks)]
+    return make_query_result(records, data_blocks, stats, plan)
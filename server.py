@@ -0,0 +1,296 @@
+import argparse
+import asyncio
+import bisect
+import json
+import random
+import time
+
+from benchmark_suite import generate_records, get_percentile
+from hash_index import HashIndex
+from ingest import external_sort, pack_records
+from query import fetch_data_blocks
+from structures import Disk, BLOCK_SIZE
+from tracker import Stats, Tracker
+from tree import Tree
+from utils import *
+
+# a query server over a local socket, 1 JSON object per line in both directions:
+#   {"id": 1, "op": "point", "rating": 7.5}                    records with averageRating == 7.5
+#   {"id": 2, "op": "range", "lower": 7.0, "upper": 8.0}        records with lower <= averageRating <= upper (null for unbounded)
+#   {"id": 3, "op": "tconst", "tconst": "tt0000001"}            the record with this tconst (needs a HashIndex)
+# => {"id": 1, "records": [[tconst, averageRating, numVotes], ...]} or {"id": 1, "error": "..."}
+# responses on a connection come in the order the queries finish, the id (any JSON value) tells them apart
+BATCH_WINDOW = 0.002 # seconds a batch stays open for more queries after its first one arrives
+MAX_BATCH = 1024 # queries per batch
+DEFAULT_MIX = {"point": 0.6, "range": 0.2, "tconst": 0.2} # share of each op sent by run_load
+RANGE_WIDTHS = (0.0, 0.1, 0.5) # rating ranges sent by run_load are [lower, lower + width]
+STREAM_LIMIT = 2 ** 28 # longest line a connection reads, a response holds every record of its query
+
+def parse_request(message):
+    # request dict => query tuple ("point", rating), ("range", lower, upper) or ("tconst", tconst), raises ValueError
+    op = message.get("op")
+    if op == "point":
+        return "point", float(message["rating"])
+    if op == "range":
+        lower, upper = message.get("lower"), message.get("upper")
+        return "range", float(lower) if lower != None else None, float(upper) if upper != None else None
+    if op == "tconst":
+        if not isinstance(message.get("tconst"), str):
+            raise ValueError("tconst must be a string")
+        return "tconst", message["tconst"]
+    raise ValueError(f"Invalid op: {op}. Must be one of point, range, tconst")
+
+def execute_batch(tree, queries, hash_index=None):
+    # runs the queries (see parse_request) together, returns the records of each one in key order
+    # the rating ranges are sorted and overlapping ones merged, so the leaves they share are walked once and the
+    # descents go left to right, and every data block referenced by the batch is read and decoded once
+    # a tconst lookup without a hash index gives an Exception in place of the records
+    ranges = []
+    for i, query in enumerate(queries):
+        if query[0] == "point":
+            ranges.append((query[1], query[1], i))
+        elif query[0] == "range":
+            lower = query[1] if query[1] != None else float("-inf")
+            upper = query[2] if query[2] != None else float("inf")
+            ranges.append((lower, upper, i))
+    ranges.sort()
+    merged = [] # [lower, upper, [(lower, upper, i) of the queries in it]]
+    for lower, upper, i in ranges:
+        if merged and lower <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], upper)
+        else:
+            merged.append([lower, upper, []])
+        merged[-1][2].append((lower, upper, i))
+
+    pointers = []
+    for group in merged:
+        group.append(tree.search_range(group[0], group[1]))
+        pointers.extend(group[3])
+    results = [None] * len(queries)
+    tconst_pointers = {}
+    for i, query in enumerate(queries):
+        if query[0] == "tconst":
+            if hash_index == None:
+                results[i] = Exception("tconst lookups need a hash index")
+                continue
+            pointer = hash_index.search(query[1])
+            if pointer != None:
+                tconst_pointers[i] = pointer
+                pointers.append(pointer)
+            else:
+                results[i] = []
+
+    data_blocks = fetch_data_blocks(tree.disk, pointers)
+    def get_record(pointer):
+        return data_blocks[pointer[0]][(pointer[1] - 13) // RECORD_STRUCT.size]
+    for _, _, members, group_pointers in merged:
+        records = [get_record(pointer) for pointer in group_pointers]
+        ratings = [record[1] for record in records]
+        for lower, upper, i in members:
+            results[i] = records[bisect.bisect_left(ratings, lower): bisect.bisect_right(ratings, upper)]
+    for i, pointer in tconst_pointers.items():
+        results[i] = [get_record(pointer)]
+    return results
+
+class QueryServer:
+    # serves queries from a tree (and a HashIndex for tconst lookups) over TCP or a unix socket, see start
+    # queries that arrive within window seconds of each other are run as 1 batch (see execute_batch) once the window closes
+    # the batch runs on the event loop, so queries arriving meanwhile make up the next batch
+    # stats: the Stats of every batch so far, num_batches/num_queries: batches run and queries in them
+    def __init__(self, tree, hash_index=None, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.tree = tree
+        self.hash_index = hash_index
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = [] # (query, future) waiting for the next batch
+        self.wakeup = None
+        self.server = None
+        self.batcher = None
+        self.stats = Stats()
+        self.num_batches = 0
+        self.num_queries = 0
+
+    async def start(self, host="127.0.0.1", port=0, path=None):
+        # listens on host:port (port 0 picks a free one), or on the unix socket at path if given
+        # returns the address to connect to: (host, port), or path
+        self.wakeup = asyncio.Event()
+        self.batcher = asyncio.create_task(self.run_batches())
+        if path != None:
+            self.server = await asyncio.start_unix_server(self.handle, path)
+            return path
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.batcher.cancel()
+
+    async def query(self, query):
+        # queues query for the next batch and waits for its records
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((query, future))
+        self.wakeup.set()
+        return await future
+
+    async def run_batches(self):
+        while True:
+            await self.wakeup.wait()
+            await asyncio.sleep(self.window)
+            batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+            if not self.pending:
+                self.wakeup.clear()
+            with Tracker.measure() as stats:
+                try:
+                    results = execute_batch(self.tree, [query for query, _ in batch], self.hash_index)
+                except Exception as e:
+                    results = [e] * len(batch)
+            self.stats.merge(stats)
+            self.num_batches += 1
+            self.num_queries += len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done(): # the connection may be gone
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+
+    async def respond(self, line, writer):
+        message = None
+        try:
+            message = json.loads(line)
+            response = {"id": message.get("id"), "records": await self.query(parse_request(message))}
+        except Exception as e:
+            response = {"id": message.get("id") if isinstance(message, dict) else None, "error": str(e)}
+        if not writer.is_closing():
+            writer.write(json.dumps(response).encode() + b"\n")
+
+    async def handle(self, reader, writer):
+        # 1 connection, queries are answered as they finish so a client may send many without waiting
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.create_task(self.respond(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                await writer.drain()
+            if tasks:
+                await asyncio.gather(*tasks)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+async def open_connection(address):
+    # address is (host, port) or the path of a unix socket
+    if isinstance(address, str):
+        return await asyncio.open_unix_connection(address, limit=STREAM_LIMIT)
+    return await asyncio.open_connection(*address, limit=STREAM_LIMIT)
+
+async def request(reader, writer, message):
+    writer.write(json.dumps(message).encode() + b"\n")
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+async def run_load(address, num_clients=32, num_requests=10000, mix=DEFAULT_MIX, seed=0):
+    # load generator: num_clients connections each send 1 query at a time (closed loop) until num_requests are answered
+    # the tconsts looked up are taken from the records of a few range queries sent first
+    # returns {"requests", "errors", "seconds", "qps", "p50_us", "p99_us", "p999_us"}
+    rng = random.Random(seed)
+    reader, writer = await open_connection(address)
+    tconsts = []
+    for rating in (5.0, 6.5, 7.0, 7.5, 8.0):
+        response = await request(reader, writer, {"id": 0, "op": "point", "rating": rating})
+        tconsts.extend(record[0] for record in response.get("records", [])[:1000])
+    writer.close()
+    ops = [op for op in mix if op != "tconst" or tconsts]
+    weights = [mix[op] for op in ops]
+
+    def make_request(i):
+        op = rng.choices(ops, weights)[0]
+        if op == "point":
+            return {"id": i, "op": "point", "rating": rng.randint(10, 100) / 10}
+        if op == "range":
+            lower = rng.randint(10, 100) / 10
+            return {"id": i, "op": "range", "lower": lower, "upper": round(lower + rng.choice(RANGE_WIDTHS), 1)}
+        return {"id": i, "op": "tconst", "tconst": rng.choice(tconsts)}
+
+    latencies = []
+    errors = 0
+    next_id = 0
+    async def client():
+        nonlocal errors, next_id
+        reader, writer = await open_connection(address)
+        try:
+            while next_id < num_requests:
+                message = make_request(next_id)
+                next_id += 1
+                start = time.perf_counter_ns()
+                response = await request(reader, writer, message)
+                latencies.append(time.perf_counter_ns() - start)
+                if "error" in response or response["id"] != message["id"]:
+                    errors += 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(num_clients)))
+    seconds = time.perf_counter() - start
+    latencies = [latency / 1000 for latency in sorted(latencies)]
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": seconds,
+        "qps": len(latencies) / seconds if seconds else 0.0,
+        "p50_us": get_percentile(latencies, 0.5),
+        "p99_us": get_percentile(latencies, 0.99),
+        "p999_us": get_percentile(latencies, 0.999),
+    }
+
+def load_tree(block_size, num_rows=None, data_path=None, seed=0):
+    # bulk loads the records of data_path (a tsv like data.tsv), or num_rows synthetic ones, with a HashIndex on tconst
+    disk = Disk(block_size)
+    records = iter_data(data_path) if data_path != None else generate_records(num_rows, seed)
+    tree = Tree.bulk_load(disk, pack_records(disk, external_sort(records)))
+    return tree, HashIndex.build(tree)
+
+async def serve(args):
+    tree, hash_index = load_tree(args.block_size, args.rows, args.data)
+    server = QueryServer(tree, hash_index, args.window / 1000)
+    address = await server.start(args.host, args.port, args.path)
+    print(f"Serving {args.data or f'{args.rows} synthetic records'} on {address}")
+    if args.serve:
+        await asyncio.Event().wait()
+    result = await run_load(address, args.clients, args.requests)
+    await server.close()
+    return server, result
+
+def print_load(result, server=None):
+    print(f"{result['requests']} requests in {result['seconds']:.2f}s: {result['qps']:.0f} QPS, "
+          f"p50 {result['p50_us']:.0f}us, p99 {result['p99_us']:.0f}us, p99.9 {result['p999_us']:.0f}us, {result['errors']} errors")
+    if server != None:
+        print(f"{server.num_batches} batches, {server.num_queries / max(server.num_batches, 1):.1f} queries per batch, "
+              f"{server.stats.get_io('logical_read') / max(server.num_queries, 1):.2f} block reads per query")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query server with request batching, and a load generator to measure it")
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE, help="block size in bytes")
+    parser.add_argument("--rows", type=int, default=100000, help="number of synthetic records to serve")
+    parser.add_argument("--data", help="serve the records of this tsv file (e.g. data.tsv) instead of synthetic ones")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="0 picks a free port")
+    parser.add_argument("--path", help="listen on (or with --connect, connect to) this unix socket instead of host:port")
+    parser.add_argument("--window", type=float, default=BATCH_WINDOW * 1000, help="batching window in milliseconds")
+    parser.add_argument("--serve", action="store_true", help="only serve, until interrupted")
+    parser.add_argument("--connect", action="store_true", help="only run the load generator against a running server")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent connections of the load generator")
+    parser.add_argument("--requests", type=int, default=20000, help="requests sent by the load generator")
+    args = parser.parse_args()
+    if args.connect:
+        print_load(asyncio.run(run_load(args.path or (args.host, args.port), args.clients, args.requests)))
+    else:
+        print_load(*reversed(asyncio.run(serve(args))))
@@ -1,19 +1,27 @@
 import collections
+import mmap
+import os
+import threading
 
+from tracker import Tracker
 from utils import *
+from wal import BLOCK, COMMIT, GROUP_COMMIT_INTERVAL, WriteAheadLog
 
 # constants (bytes)
 BLOCK_SIZE = 100
 DISK_SIZE = 200 * 1024 * 1024
 NUM_BLOCKS = DISK_SIZE // BLOCK_SIZE
+CHECKPOINT_BYTES = 64 * 1024 * 1024 # log written before a checkpoint begins
+CHECKPOINT_STEP = 1024 # blocks written to the file per commit while a checkpoint is in progress
 
 
 class Block:
-    def __init__(self, block_size=BLOCK_SIZE):
-        self.bytes = bytearray(block_size)
+    def __init__(self, block_size=BLOCK_SIZE, bytes_=None):
+        # bytes_ is given when the block is a view (memoryview) into the disk rather than a standalone bytearray
+        self.bytes = bytearray(block_size) if bytes_ is None else bytes_
 
     def __len__(self):
-        return BLOCK_SIZE
+        return len(self.bytes)
 
     def __repr__(self):
         return [value for value in self.bytes].__repr__()
@@ -23,56 +31,273 @@ class Block:
 
 
 class Disk:
-    # use this class as a static class. Don't instantiate. All methods are class methods.
-    blocks = []
-    for _ in range(NUM_BLOCKS):
-        blocks.append(Block())
-    next_free_idx = 1  # 0 is never used to prevent getting mixed with None
-    free_queue = collections.deque()
-    non_full_data_queue = collections.deque()
-
-    @classmethod
-    def read_block(cls, block_id):
-        if not 1 <= block_id < NUM_BLOCKS:
+    # all blocks live in 1 memory-mapped region (anonymous, or backed by the file at path), mapped on first access
+    # block 0 is never handed out, it is the superblock: next_free_idx (4 bytes), block size (4 bytes)
+    # lock guards the allocation state and the read-modify-write of data blocks (see Tree(concurrent=True))
+    # wal == True logs every block write to <path>.wal, see wal.py and the README for commits and checkpoints
+    def __init__(self, block_size=BLOCK_SIZE, bytes_=None):
+        # bytes_ is given when the block is a view (memoryview) into the disk rather than a standalone bytearray
+        self.bytes = bytearray(block_size) if bytes_ is None else bytes_
+
+    def __len__(self):
+        return len(self.bytes)
+
+    def __repr__(self):
+        return [value for value in self.bytes].__repr__()
+
+    def __eq__(self, other):
+        return self.bytes == other.bytes
+
+
+class Disk:
+    # all blocks live in 1 contiguous memory-mapped region, so pages are only backed by memory once written
+    # the region is anonymous (in memory only) unless a path is given to back it with a file that persists across runs
+    # the region is only mapped on first access, so creating a Disk is free
+    # block 0 is never handed out, it is the superblock: next_free_idx (4 bytes), block size (4 bytes)
+    # lock guards the allocation state, and the read-modify-write of a data block by store_record and Tree.delete_records,
+    # so threads can allocate and store records concurrently (see Tree(concurrent=True))
+    # with wal == True every block write is also appended to a write-ahead log in <path>.wal (see wal.py) and the file is
+    # mapped privately, so it only changes at checkpoints: commit makes the writes so far 1 atomic, durable group
+    # (without having to write the blocks to the file), and opening the disk again replays the log of every commit
+    # commit returns once the group is durable, async_commit == True lets it return before (see WriteAheadLog)
+    # blocks read from a disk with a write-ahead log are copies, changes only reach the disk through write_block
+    # once checkpoint_bytes of log were written, a fuzzy checkpoint begins: the blocks written until then are written
+    # to the file over the next commits, CHECKPOINT_STEP at a time, while writes go on, then the log before it is removed
+    # a group is whatever was written before the commit, so threads writing concurrently commit when none of them is
+    # in the middle of a change (e.g. after Tree.save)
+    def __init__(self, block_size=BLOCK_SIZE, disk_size=DISK_SIZE, path=None, wal=False, async_commit=False,
+                 group_commit_interval=GROUP_COMMIT_INTERVAL, checkpoint_bytes=CHECKPOINT_BYTES):
+        self.block_size = block_size
+        self.disk_size = disk_size
+        self.num_blocks = disk_size // block_size
+        self.path = path
+        self.buffer = None
+        self.view = None
+        self.next_free_idx = 1  # 0 is never used to prevent getting mixed with None
+        self.free_queue = collections.deque()
+        self.non_full_data_queue = {} # block_id => True, data blocks with room for a record, oldest first
+        self.lock = threading.RLock()
+        self.wal = None
+        if wal:
+            if path == None:
+                raise Exception("A write-ahead log needs a file backed Disk (Disk(path=...))")
+            self.wal = WriteAheadLog(path + ".wal", async_commit, group_commit_interval)
+        self.checkpoint_bytes = checkpoint_bytes
+        self.fd = None # the file, kept open with a write-ahead log to write checkpoints
+        self.dirty_blocks = {} # block_id => True, written since the last checkpoint began (with a write-ahead log)
+        self.checkpoint_blocks = [] # blocks left to write to the file for the checkpoint in progress, last first
+        self.checkpoint_segment = None # the log segment the checkpoint in progress began
+        if path != None and os.path.exists(path):
+            self.restore()
+
+    def get_view(self):
+        # maps the region on first access
+        if self.view == None:
+            if self.path == None:
+                self.buffer = mmap.mmap(-1, self.disk_size)
+            else:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+                try:
+                    if os.fstat(fd).st_size < self.disk_size:
+                        os.ftruncate(fd, self.disk_size)  # sparse, does not write disk_size bytes
+                    if self.wal == None:
+                        self.buffer = mmap.mmap(fd, self.disk_size)
+                    else:
+                        # copy-on-write, changes to the blocks never reach the file before their log
+                        self.buffer = mmap.mmap(fd, self.disk_size, flags=mmap.MAP_PRIVATE)
+                        self.fd, fd = fd, None
+                finally:
+                    if fd != None:
+                        os.close(fd)
+            self.view = memoryview(self.buffer)
+            if self.wal != None:
+                self.wal.recover(self.redo)
+        return self.view
+
+    def redo(self, block_id, data):
+        # applies a block write replayed from the write-ahead log
+        self.view[block_id * self.block_size: (block_id + 1) * self.block_size] = data
+        self.dirty_blocks[block_id] = True
+
+    def restore(self):
+        # restores allocation state from the superblock, blocks below next_free_idx without a header are free
+        view = self.get_view()
+        next_free_idx = convert_bytes_to_uint(view[0:4])
+        block_size = convert_bytes_to_uint(view[4:8])
+        if next_free_idx == 0:
+            return
+        if block_size != self.block_size:
+            raise Exception(f"Disk at {self.path} has block size {block_size}, expected {self.block_size}")
+        self.next_free_idx = next_free_idx
+        self.free_queue = collections.deque()
+        self.non_full_data_queue = {}
+        for block_id in range(1, self.next_free_idx):
+            start = block_id * self.block_size
+            if convert_bytes_to_uint(view[start + 1: start + 5]) == 0:
+                self.free_queue.append(block_id)
+            elif view[start] == 0:
+                block = Block(bytes_=view[start: start + self.block_size])
+                if not is_data_block_full(block):
+                    self.non_full_data_queue[block_id] = True
+
+    def write_superblock(self):
+        view = self.get_view()
+        view[0:4] = convert_uint_to_bytes(self.next_free_idx)
+        view[4:8] = convert_uint_to_bytes(self.block_size)
+        self.log_block(0)
+
+    def flush(self):
+        # write the superblock and persist all changes to the backing file (if any)
+        # with a write-ahead log they are committed and the log is synced instead
+        if self.wal != None:
+            self.commit()
+            self.wal.sync()
+            return
+        self.write_superblock()
+        if self.path != None:
+            self.buffer.flush()
+
+    def commit(self):
+        # with a write-ahead log, ends the group of writes made so far (see WriteAheadLog.commit) and returns once it is
+        # durable (unless async_commit), and takes the next step of the checkpoint in progress, or begins one
+        # without a write-ahead log it does nothing
+        if self.wal == None:
+            return
+        with self.lock:
+            lsn = self.append_commit()
+            if self.checkpoint_blocks or self.wal.segment_bytes >= self.checkpoint_bytes:
+                self.checkpoint_step()
+                return
+        self.wal.sync_commit(lsn) # without the lock, so the commits of other threads join the fsync
+
+    def append_commit(self):
+        # with self.lock held
+        self.write_superblock() # the allocation state goes with the blocks
+        return self.wal.append(COMMIT)
+
+    def checkpoint(self):
+        # commits, then writes every block written so far to the file and removes the log before it
+        if self.wal == None:
+            return
+        with self.lock:
+            self.append_commit()
+            self.checkpoint_step(force=True)
+            while self.checkpoint_blocks:
+                self.checkpoint_step()
+
+    def checkpoint_step(self, force=False):
+        # with self.lock held since the commit record was appended: writers are held off until the step is done, and
+        # the view only changes under the lock (see write_block), so the blocks written to the file hold exactly the
+        # writes committed so far
+        if not self.checkpoint_blocks:
+            if not force and self.wal.segment_bytes < self.checkpoint_bytes:
+                return
+            # the blocks written from here on are in the new segment, the ones before are written to the file
+            self.checkpoint_segment = self.wal.rotate()
+            self.checkpoint_blocks = sorted(self.dirty_blocks, reverse=True)
+            self.dirty_blocks = {}
+        # a block written to the file has to stay in the log until the file is synced, and its group has to be durable
+        self.wal.sync()
+        for _ in range(min(CHECKPOINT_STEP, len(self.checkpoint_blocks))):
+            block_id = self.checkpoint_blocks.pop()
+            start = block_id * self.block_size
+            os.pwrite(self.fd, self.view[start: start + self.block_size], start)
+            Tracker.increment_count("checkpoint_write")
+        if not self.checkpoint_blocks:
+            os.fsync(self.fd)
+            self.wal.remove_segments_before(self.checkpoint_segment)
+
+    def read_block(self, block_id, logical=True):
+        # every read is counted in Tracker as a physical read, and as a logical read unless logical == False
+        # (a BufferPool reading a block on a miss counts the logical read itself)
+        if not 1 <= block_id < self.num_blocks:
             raise Exception(
-                f"Invalid block id. Address must be within [1, {NUM_BLOCKS-1}]"
+                f"Invalid block id. Address must be within [1, {self.num_blocks-1}]"
             )
-        return cls.blocks[block_id]
+        # zero-copy: the returned block is a view into the disk, a copy with a write-ahead log
+        view = self.get_view()[block_id * self.block_size: (block_id + 1) * self.block_size]
+        block = Block(bytes_=view if self.wal == None else bytearray(view))
+        if Tracker.enabled:
+            Tracker.count_io("physical_read", block)
+            if logical:
+                Tracker.count_io("logical_read", block)
+        return block
 
-    # changes to the block that is read are actually reflected in Disk.blocks without explicitly using write_block
-    # but should use write_block to simulate disk
-    @classmethod
-    def write_block(cls, block_id, block):
-        if not 1 <= block_id < NUM_BLOCKS:
+    # changes to the block that is read are actually reflected in Disk without explicitly using write_block
+    # (except with a write-ahead log) but should use write_block to simulate disk
+    def write_block(self, block_id, block, logical=True):
+        # counted in Tracker like read_block
+        if not 1 <= block_id < self.num_blocks:
             raise Exception(
-                f"Invalid block id. Address must be within [1, {NUM_BLOCKS-1}]"
+                f"Invalid block id. Address must be within [1, {self.num_blocks-1}]"
             )
-        cls.blocks[block_id] = block
+        if len(block) != self.block_size:
+            raise Exception(f"Block size: {len(block)} != {self.block_size}")
+        if self.wal == None:
+            self.get_view()[block_id * self.block_size: (block_id + 1) * self.block_size] = block.bytes
+        else:
+            with self.lock: # the view only holds logged writes
+                self.get_view()[block_id * self.block_size: (block_id + 1) * self.block_size] = block.bytes
+                self.log_block(block_id)
+        if Tracker.enabled:
+            Tracker.count_io("physical_write", block)
+            if logical:
+                Tracker.count_io("logical_write", block)
 
-    @classmethod
-    def get_next_free(cls):
+    def log_block(self, block_id):
+        # with self.lock held
+        if self.wal != None:
+            start = block_id * self.block_size
+            self.wal.append(BLOCK, block_id, self.view[start: start + self.block_size])
+            self.dirty_blocks[block_id] = True
+
+    def get_next_free(self):
         # gets the id of the next free block (block is fully empty)
-        if cls.free_queue:
-            return cls.free_queue.popleft()
-        else:
-            cls.next_free_idx += 1
-            if cls.next_free_idx == NUM_BLOCKS:
+        with self.lock:
+            if self.free_queue:
+                return self.free_queue.popleft()
+            else:
+                self.next_free_idx += 1
+                if self.next_free_idx == self.num_blocks:
+                    raise Exception("Disk full")
+                return self.next_free_idx - 1
+
+    def reserve(self, num_blocks):
+        # hands out num_blocks consecutive blocks that were never used, returns the id of the first one
+        # e.g. for worker processes filling blocks of the same file (see parallel.py), unused ones are given back with release
+        with self.lock:
+            start = self.next_free_idx
+            if start + num_blocks >= self.num_blocks:
                 raise Exception("Disk full")
-            return cls.next_free_idx - 1
+            self.next_free_idx += num_blocks
+            return start
+
+    def release(self, block_ids):
+        # gives back blocks that were reserved but never written (unlike deallocate, which also zeroes the block)
+        with self.lock:
+            self.free_queue.extend(block_ids)
 
-    @classmethod
-    def get_non_full_data_block(cls):
+    def get_non_full_data_block(self):
         # return block id of any existing data block that is not full
         # if all allocated data blocks are full, return -1 (client should proceed to use get_next_free instead)
-        if cls.non_full_data_queue:
-            return cls.non_full_data_queue.popleft()
-        return -1
-
-    @classmethod
-    def deallocate(cls, block_id):
-        cls.free_queue.append(block_id)
-        cls.write_block(block_id, Block())
-
-    @classmethod
-    def info(cls):
-        return f"Disk size: {DISK_SIZE}, Block size: {BLOCK_SIZE}, No. blocks: {NUM_BLOCKS}"
+        # the block is taken off the queue, add_non_full_data_block puts it back if it still has room
+        with self.lock:
+            if self.non_full_data_queue:
+                block_id = next(iter(self.non_full_data_queue))
+                del self.non_full_data_queue[block_id]
+                return block_id
+            return -1
+
+    def add_non_full_data_block(self, block_id):
+        # called when a data block gets room for a record (a record is deleted, or a partly filled block is written)
+        with self.lock:
+            self.non_full_data_queue[block_id] = True
+
+    def deallocate(self, block_id):
+        with self.lock:
+            self.free_queue.append(block_id)
+            self.non_full_data_queue.pop(block_id, None)
+            self.write_block(block_id, Block(self.block_size))
+
+    def info(self):
+        return f"Disk size: {self.disk_size}, Block size: {self.block_size}, No. blocks: {self.num_blocks}"
@@ -0,0 +1,52 @@
+import copy
+import statistics
+import unittest
+
+from benchmark_suite import *
+
+class TestBenchmarkSuite(unittest.TestCase):
+
+    def test_generate_records(self):
+        records = list(generate_records(5000, seed=3))
+        self.assertEqual(records, list(generate_records(5000, seed=3)))
+        self.assertEqual(len({record[0] for record in records}), 5000)
+        ratings = [record[1] for record in records]
+        self.assertTrue(all(1.0 <= rating <= 10.0 and round(rating, 1) == rating for rating in ratings))
+        self.assertAlmostEqual(statistics.mean(ratings), 6.9, delta=0.2)
+        self.assertLess(statistics.mean(ratings), statistics.median(ratings)) # skewed to the left
+        self.assertTrue(all(record[2] >= 5 for record in records))
+        self.assertEqual(next(generate_records(1, start=12345678))[0], "tt12345678")
+
+    def test_sample_keys(self):
+        sample = []
+        records = list(sample_keys(generate_records(1000), sample, 100))
+        self.assertEqual(len(records), 1000)
+        self.assertEqual(len(sample), 100)
+        self.assertTrue(set(sample) <= {augmented_key(record) for record in records})
+
+    def test_run_suite(self):
+        suite = run_suite([100, 500], 3000, isolate=False, num_ops=200, num_range_ops=10, selectivities=[0.01, 0.1])
+        rows = {(row["block_size"], row["workload"]): row for row in suite["results"]}
+        self.assertEqual(set(rows), {(block_size, workload) for block_size in [100, 500]
+                                     for workload in ["load", "point", "range_0.01", "range_0.1", "mixed"]})
+        for block_size in [100, 500]:
+            self.assertEqual(rows[block_size, "load"]["p99_us"], None)
+            self.assertGreater(rows[block_size, "point"]["logical_reads"], 0)
+            self.assertLessEqual(rows[block_size, "point"]["physical_reads"], rows[block_size, "point"]["logical_reads"])
+            self.assertGreater(rows[block_size, "range_0.1"]["records_per_op"], rows[block_size, "range_0.01"]["records_per_op"])
+            self.assertGreater(rows[block_size, "mixed"]["logical_writes"], 0)
+            self.assertLessEqual(rows[block_size, "point"]["p50_us"], rows[block_size, "point"]["p99_us"])
+        self.assertEqual(suite["config"]["selectivities"], [0.01, 0.1])
+
+    def test_compare_results(self):
+        baseline = {"config": {}, "results": [
+            {"block_size": 100, "workload": "point", "throughput": 1000.0, "p50_us": 10.0, "p99_us": 50.0, "peak_rss_mb": 30.0,
+             "physical_reads": 100, "physical_writes": 0},
+        ]}
+        current = copy.deepcopy(baseline)
+        self.assertFalse(any(regressed for *_, regressed in compare_results(baseline, current)))
+        current["results"][0]["throughput"] = 850.0
+        current["results"][0]["p99_us"] = 40.0
+        regressed = {metric for _, _, metric, _, _, regressed in compare_results(baseline, current) if regressed}
+        self.assertEqual(regressed, {"throughput"})
+        self.assertEqual(compare_results(baseline, current, threshold=0.2)[0][-1], False)
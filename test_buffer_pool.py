@@ -0,0 +1,88 @@
+import unittest
+
+from buffer_pool import BufferPool
+from structures import Block, Disk
+from tracker import Tracker
+from tree import Tree
+
+def make_block(disk, value):
+    block = Block(disk.block_size)
+    block.bytes[0] = value
+    return block
+
+class TestBufferPool(unittest.TestCase):
+
+    def setUp(self):
+        Tracker.reset_all()
+        self.disk = Disk(disk_size=100 * 64)
+        for block_id in range(1, 9):
+            self.disk.write_block(block_id, make_block(self.disk, block_id))
+
+    def test_hits_and_misses(self):
+        pool = BufferPool(self.disk, 2)
+        self.assertEqual(pool.read_block(1).bytes[0], 1)
+        self.assertEqual(pool.read_block(1).bytes[0], 1)
+        pool.read_block(2)
+        self.assertEqual(Tracker.stats.counts["buffer_miss"], 2)
+        self.assertEqual(Tracker.stats.counts["buffer_hit"], 1)
+
+    def test_lru_eviction(self):
+        pool = BufferPool(self.disk, 2, "lru")
+        pool.read_block(1)
+        pool.read_block(2)
+        pool.read_block(1)
+        pool.read_block(3) # evicts 2
+        self.assertEqual(set(pool.frames), {1, 3})
+
+    def test_clock_eviction(self):
+        pool = BufferPool(self.disk, 3, "clock")
+        for block_id in [1, 2, 3]:
+            pool.read_block(block_id)
+        pool.read_block(4) # first sweep clears every reference bit, evicts 1
+        self.assertEqual(set(pool.frames), {2, 3, 4})
+        pool.read_block(2) # second chance for 2
+        pool.read_block(5) # evicts 3
+        self.assertEqual(set(pool.frames), {2, 4, 5})
+
+    def test_pinned_blocks_are_not_evicted(self):
+        pool = BufferPool(self.disk, 2)
+        pool.pin(1)
+        pool.pin(2)
+        with self.assertRaises(Exception):
+            pool.read_block(3)
+        pool.unpin(2)
+        pool.read_block(3)
+        self.assertEqual(set(pool.frames), {1, 3})
+        with self.assertRaises(Exception):
+            pool.unpin(3)
+
+    def test_write_back(self):
+        pool = BufferPool(self.disk, 2)
+        block = pool.pin(1)
+        block.bytes[0] = 42
+        pool.unpin(1, dirty=True)
+        pool.write_block(8, make_block(self.disk, 88)) # whole block write, no read
+        self.assertEqual(Tracker.stats.counts["buffer_miss"], 1)
+        self.assertEqual(self.disk.read_block(1).bytes[0], 1) # not written back yet
+        pool.read_block(2) # evicts 1
+        self.assertEqual(self.disk.read_block(1).bytes[0], 42)
+        self.assertEqual(Tracker.stats.counts["buffer_write_back"], 1)
+        pool.flush()
+        self.assertEqual(self.disk.read_block(8).bytes[0], 88)
+        self.assertEqual(Tracker.stats.counts["buffer_write_back"], 2)
+
+    def test_deallocate(self):
+        pool = BufferPool(self.disk, 2)
+        pool.write_block(1, make_block(self.disk, 11))
+        pool.deallocate(1)
+        self.assertNotIn(1, pool.frames)
+        self.assertEqual(self.disk.read_block(1), Block(self.disk.block_size))
+
+    def test_tree_on_buffer_pool(self):
+        pool = BufferPool(Disk(), 4, "clock")
+        items = [((i / 10, f"tt{i:07d}"), (i, 13)) for i in range(1, 200)]
+        tree = Tree.bulk_load(pool, items)
+        tree.save()
+        pool.flush()
+        self.assertGreater(Tracker.stats.counts["buffer_write_back"], 0)
+        self.assertEqual(tree.search_range(None, None), [value for _, value in items])
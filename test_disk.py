@@ -1,35 +1,161 @@
+import os
+import tempfile
+import threading
 import unittest
 
-from structures import Disk
+from structures import Block, Disk
+from tracker import Tracker
 from utils import *
 
 class TestDisk(unittest.TestCase):
 
     def test_disk(self):
-        self.assertEqual(Disk.next_free_idx, 1)
-        self.assertEqual(len(Disk.free_queue), 0)
+        disk = Disk()
+        self.assertEqual(disk.next_free_idx, 1)
+        self.assertEqual(len(disk.free_queue), 0)
         
-        idx = Disk.get_next_free()
-        block = Disk.read_block(idx)
+        idx = disk.get_next_free()
+        block = disk.read_block(idx)
         block.bytes[0] = 10
-        Disk.write_block(idx, block)
-        self.assertEqual(block, Disk.read_block(idx))
+        disk.write_block(idx, block)
+        self.assertEqual(block, disk.read_block(idx))
 
-        idx = Disk.get_next_free()
+        idx = disk.get_next_free()
         self.assertEqual(idx, 2)
-        idx = Disk.get_next_free()
+        idx = disk.get_next_free()
         self.assertEqual(idx, 3)
-        Disk.deallocate(1)
-        self.assertEqual(len(Disk.free_queue), 1)
-        idx = Disk.get_next_free()
+        disk.deallocate(1)
+        self.assertEqual(len(disk.free_queue), 1)
+        idx = disk.get_next_free()
         self.assertEqual(idx, 1)
-        self.assertEqual(len(Disk.free_queue), 0)
-        idx = Disk.get_next_free()
+        self.assertEqual(len(disk.free_queue), 0)
+        idx = disk.get_next_free()
         self.assertEqual(idx, 4)
-        Disk.deallocate(4)
-        Disk.deallocate(2)
-        self.assertEqual(len(Disk.free_queue), 2)
-        idx = Disk.get_next_free()
+        disk.deallocate(4)
+        disk.deallocate(2)
+        self.assertEqual(len(disk.free_queue), 2)
+        idx = disk.get_next_free()
         self.assertEqual(idx, 4)
-        idx = Disk.get_next_free()
-        self.assertEqual(idx, 2)
\ No newline at end of file
+        idx = disk.get_next_free()
+        self.assertEqual(idx, 2)
+
+    def test_block_size_per_disk(self):
+        small = Disk(block_size=100, disk_size=100 * 10)
+        large = Disk(block_size=500, disk_size=500 * 10)
+        self.assertEqual(small.view, None) # nothing is mapped until first access
+        self.assertEqual(len(small.read_block(small.get_next_free())), 100)
+        self.assertEqual(len(large.read_block(large.get_next_free())), 500)
+        with self.assertRaises(Exception):
+            small.write_block(1, Block(500))
+        with self.assertRaises(Exception):
+            small.read_block(10)
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "disk.bin")
+            disk = Disk(path=path)
+            data_id = disk.get_next_free()
+            freed_id = disk.get_next_free()
+            data_block = disk.read_block(data_id)
+            set_data_block_header(data_block, data_id)
+            insert_record_bytes(data_block, convert_record_to_bytes(["tt0000001", 5.6, 1645]))
+            disk.write_block(data_id, data_block)
+            disk.flush()
+
+            reopened = Disk(path=path)
+            self.assertEqual(reopened.next_free_idx, freed_id + 1)
+            self.assertEqual(list(reopened.free_queue), [freed_id])
+            self.assertEqual(list(reopened.non_full_data_queue), [data_id]) # 1 of 4 slots used
+            self.assertEqual(read_all_records_from_data_block(reopened.read_block(data_id)), [["tt0000001", 5.6, 1645]])
+            with self.assertRaises(Exception):
+                Disk(block_size=500, path=path)
+
+    def test_wal(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "disk.bin")
+            with self.assertRaises(Exception):
+                Disk(wal=True)
+            disk = Disk(disk_size=100 * 1000, path=path, wal=True)
+            records = [["tt0000001", 5.6, 1645], ["tt0000002", 7.0, 20]]
+            data_id = disk.get_next_free()
+            data_block = disk.read_block(data_id)
+            set_data_block_header(data_block, data_id)
+            insert_record_bytes(data_block, convert_record_to_bytes(records[0]))
+            disk.write_block(data_id, data_block)
+            disk.commit()
+            # not committed, lost in the crash
+            insert_record_bytes(data_block, convert_record_to_bytes(records[1]))
+            disk.write_block(data_id, data_block)
+            disk.get_next_free()
+            disk.wal.sync()
+            # the file itself only changes at checkpoints
+            self.assertEqual(Disk(disk_size=100 * 1000, path=path).next_free_idx, 1)
+
+            recovered = Disk(disk_size=100 * 1000, path=path, wal=True) # crash: disk is never used again
+            self.assertEqual(recovered.next_free_idx, data_id + 1)
+            self.assertEqual(read_all_records_from_data_block(recovered.read_block(data_id)), records[:1])
+
+            data_block = recovered.read_block(data_id)
+            insert_record_bytes(data_block, convert_record_to_bytes(records[1]))
+            self.assertEqual(read_all_records_from_data_block(recovered.read_block(data_id)), records[:1]) # a copy
+            recovered.write_block(data_id, data_block)
+            recovered.checkpoint()
+            self.assertEqual(len(recovered.wal.get_segments()), 1)
+            reopened = Disk(disk_size=100 * 1000, path=path)
+            self.assertEqual(read_all_records_from_data_block(reopened.read_block(data_id)), records)
+
+    def test_fuzzy_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "disk.bin")
+            disk = Disk(disk_size=100 * 10000, path=path, wal=True, checkpoint_bytes=100 * 1000)
+            expected = {}
+            with Tracker.measure() as stats:
+                for i in range(5000):
+                    block_id = disk.get_next_free() if i < 4000 else i % 4000 + 1
+                    block = disk.read_block(block_id)
+                    block.bytes[0:4] = convert_uint_to_bytes(i + 1)
+                    disk.write_block(block_id, block)
+                    expected[block_id] = i + 1
+                    if i % 10 == 9:
+                        disk.commit()
+            # checkpoints ran along the commits and kept the log short
+            self.assertGreater(stats.counts["checkpoint_write"], 3000)
+            self.assertLessEqual(len(disk.wal.get_segments()), 2)
+
+            recovered = Disk(disk_size=100 * 10000, path=path, wal=True)
+            self.assertEqual(recovered.next_free_idx, 4001)
+            for block_id, value in expected.items():
+                self.assertEqual(convert_bytes_to_uint(recovered.read_block(block_id).bytes[0:4]), value)
+
+    def test_checkpoint_with_concurrent_writer(self):
+        # a block written by another thread after the commit record must not reach the file with the checkpoint
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "disk.bin")
+            disk = Disk(disk_size=100 * 1000, path=path, wal=True)
+            block_id = disk.get_next_free()
+            block = disk.read_block(block_id)
+            block.bytes[0:4] = convert_uint_to_bytes(1)
+            disk.write_block(block_id, block)
+            disk.commit()
+
+            def write():
+                block.bytes[0:4] = convert_uint_to_bytes(2)
+                disk.write_block(block_id, block)
+
+            writer = threading.Thread(target=write)
+            sync = disk.wal.sync
+            def sync_with_writer(lsn=None):
+                # the writer runs while the checkpoint waits for the log
+                if not writer.is_alive() and writer.ident == None:
+                    writer.start()
+                    writer.join(0.2)
+                sync(lsn)
+            disk.wal.sync = sync_with_writer
+            disk.checkpoint()
+            writer.join()
+            disk.wal.sync = sync
+            disk.wal.sync() # the write is in the log, but not committed
+
+            self.assertEqual(convert_bytes_to_uint(Disk(disk_size=100 * 1000, path=path).read_block(block_id).bytes[0:4]), 1)
+            recovered = Disk(disk_size=100 * 1000, path=path, wal=True)
+            self.assertEqual(convert_bytes_to_uint(recovered.read_block(block_id).bytes[0:4]), 1)
@@ -0,0 +1,70 @@
+import unittest
+
+from hash_index import *
+from ingest import compact_data_blocks, pack_records, store_record
+from structures import Disk
+from test_tree import make_records
+from tracker import Tracker
+from tree import Tree
+from utils import *
+
+class TestHashIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.records = make_records(3000)
+
+    def test_insert_search_delete(self):
+        disk = Disk(100)
+        index = HashIndex(disk)
+        pointers = {record[0]: (i + 1, 13 + i % 4 * 18) for i, record in enumerate(self.records)}
+        for tconst, pointer in pointers.items():
+            index.insert(tconst, pointer)
+        self.assertGreater(index.get_global_depth(), 5)
+
+        Tracker.reset_all()
+        for tconst, pointer in pointers.items():
+            self.assertEqual(index.search(tconst), pointer)
+        self.assertEqual(Tracker.stats.counts["hash_bucket_read"], len(pointers)) # 1 block per lookup
+        self.assertEqual(index.search("tt0"), None)
+
+        tconsts = list(pointers)
+        index.insert(tconsts[0], (7, 31))
+        self.assertEqual(index.search(tconsts[0]), (7, 31))
+        for tconst in tconsts[::2]:
+            self.assertTrue(index.delete(tconst))
+        self.assertFalse(index.delete(tconsts[0]))
+        for i, tconst in enumerate(tconsts):
+            self.assertEqual(index.search(tconst), None if i % 2 == 0 else pointers[tconst])
+
+        reopened = HashIndex.open(disk, index.save())
+        self.assertEqual(reopened.directory, index.directory)
+        for i, tconst in enumerate(tconsts):
+            self.assertEqual(reopened.search(tconst), None if i % 2 == 0 else pointers[tconst])
+        with self.assertRaises(Exception):
+            HashIndex.open(disk, index.directory[0]) # bucket block
+
+    def test_sync_with_tree(self):
+        disk = Disk(200)
+        tree = Tree.bulk_load(disk, pack_records(disk, self.records[::2]))
+        index = HashIndex.build(tree)
+
+        def check():
+            for record in self.records:
+                pointer = index.search(record[0])
+                if pointer == None:
+                    self.assertNotIn(record, expected)
+                else:
+                    self.assertEqual(convert_bytes_to_record(read_record_bytes(disk.read_block(pointer[0]), pointer[1])), record)
+        expected = self.records[::2]
+        check()
+
+        for record in self.records[1::2]:
+            tree.insert(*store_record(disk, record))
+        tree.delete_range(2.0, 6.0)
+        tree.delete(9.0)
+        expected = [record for record in self.records if not 2.0 <= record[1] <= 6.0 and record[1] != 9.0]
+        check()
+        self.assertEqual(sum(index.search(record[0]) != None for record in self.records), len(expected))
+
+        compact_data_blocks(tree)
+        check()
@@ -0,0 +1,102 @@
+import unittest
+
+from index import *
+from ingest import augmented_key, compact_data_blocks, pack_records, store_record
+from query import *
+from structures import Disk
+from test_tree import make_records
+from tree import Tree
+from utils import *
+
+class TestIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.records = make_records(3000, max_votes=2279223) # numVotes up to its maximum in data.tsv
+        self.disk = Disk(500)
+        tree = Tree.bulk_load(self.disk, pack_records(self.disk, self.records))
+        self.indexes = {"averageRating": Index("averageRating", tree, clustered=True)}
+        for field in ["numVotes", "tconst"]:
+            self.indexes[field] = build_index(tree, field)
+
+    def select(self, conditions):
+        checks = [(INDEX_FIELDS[field][0], OPERATORS[op], value) for field, op, value in conditions]
+        return [record for record in self.records if all(check(record[position], value) for position, check, value in checks)]
+
+    def test_build_index(self):
+        for field, index in self.indexes.items():
+            index.tree.validate()
+            self.assertEqual(
+                [record for record, _ in iter_records_with_pointers(index.tree)],
+                sorted(self.records, key=index.get_key)
+            )
+        self.assertEqual(self.indexes["numVotes"].tree.key_format, "I")
+
+    def test_execute_query(self):
+        queries = [
+            [("averageRating", ">=", 8.0), ("numVotes", ">", 100000)],
+            [("numVotes", ">", 2200000)],
+            [("numVotes", "<=", 100000), ("numVotes", ">=", 50000), ("averageRating", "<", 5.0)],
+            [("averageRating", "==", 7.0)],
+            [("averageRating", ">", 9.5), ("averageRating", "<=", 9.0)],
+            [("tconst", "==", "tt0001234")],
+            [("tconst", ">", "tt0002990"), ("averageRating", ">", 2.0)],
+            [("tconst", "<", "tt0000010")],
+            [("numVotes", ">", 2000000), ("tconst", "<", "tt0000300")],
+            [],
+        ]
+        for conditions in queries:
+            result = execute_query(self.indexes, conditions)
+            self.assertEqual(sorted(result.records), sorted(self.select(conditions)), conditions)
+
+    def test_plan_query(self):
+        plan = plan_query(self.indexes, [("tconst", "==", "tt0001234"), ("averageRating", ">=", 2.0)])
+        self.assertEqual([index.field for index in plan.indexes], ["tconst"])
+        plan = plan_query(self.indexes, [("numVotes", ">", 2200000)])
+        self.assertEqual([index.field for index in plan.indexes], ["numVotes"])
+        # numVotes is not selective, scanning it would only add leaf reads
+        plan = plan_query(self.indexes, [("averageRating", ">=", 9.9), ("numVotes", ">", 10)])
+        self.assertEqual([index.field for index in plan.indexes], ["averageRating"])
+        plan = plan_query(self.indexes, [])
+        self.assertEqual(plan.key_ranges, [(None, None)])
+        # each of them matches records in most data blocks, their intersection only in a few
+        plan = plan_query(self.indexes, [("numVotes", ">", 2000000), ("tconst", "<", "tt0000300")])
+        self.assertEqual(sorted(index.field for index in plan.indexes), ["numVotes", "tconst"])
+        # the records in the range of the clustered index are already packed together
+        plan = plan_query(self.indexes, [("averageRating", ">=", 8.0), ("numVotes", ">", 2000000)])
+        self.assertEqual([index.field for index in plan.indexes], ["averageRating"])
+        with self.assertRaises(Exception):
+            plan_query(self.indexes, [("title", "==", "x")])
+
+    def test_index_maintenance(self):
+        # the secondary indexes follow the inserts, deletes and compaction of the clustered tree
+        tree = self.indexes["averageRating"].tree
+        new_records = [["tt9000001", 8.5, 2279000], ["tt9000002", 1.0, 2278999]]
+        for record in new_records:
+            tree.insert(*store_record(self.disk, record))
+        self.records = sorted(self.records + new_records, key=augmented_key)
+        queries = [[("numVotes", ">", 2278000)], [("numVotes", "<=", 100000), ("tconst", "<", "tt0001000")],
+                   [("tconst", "==", "tt9000001")], [("numVotes", ">", 10), ("averageRating", "<", 5.0)]]
+        def check():
+            for index in self.indexes.values():
+                index.tree.validate()
+            for conditions in queries:
+                self.assertEqual(sorted(execute_query(self.indexes, conditions).records), sorted(self.select(conditions)), conditions)
+        check()
+
+        tree.delete_range(1.0, 7.0)
+        tree.delete_key(augmented_key(new_records[0]))
+        self.records = [record for record in self.records if not 1.0 <= record[1] <= 7.0 and record != new_records[0]]
+        check()
+
+        # sparse data blocks left by deleting every other record are repacked, the secondary pointers follow
+        for record in self.records[::2]:
+            tree.delete_key(augmented_key(record))
+        self.records = self.records[1::2]
+        self.assertGreater(compact_data_blocks(tree), 0)
+        check()
+
+        # a saved secondary index is reopened with its key format
+        numVotes = self.indexes["numVotes"].tree
+        numVotes.save()
+        reopened = Tree.open(self.disk, numVotes.root.block_id, cache_size=8, key_format="I", secondary=True)
+        self.assertEqual(reopened.search_range(None, None), numVotes.search_range(None, None))
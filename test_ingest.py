@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+
+from ingest import *
+from structures import Disk
+from test_tree import make_records
+from tree import Tree
+from utils import *
+
+class TestIngest(unittest.TestCase):
+
+    def setUp(self):
+        self.records = sorted(make_records(3000), key=lambda record: record[0]) # in tconst order, like data.tsv
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "data.tsv")
+        with open(self.path, "w") as f:
+            f.write("tconst\taverageRating\tnumVotes\n")
+            for record in self.records:
+                f.write(f"{record[0]}\t{record[1]}\t{record[2]}\n")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_iter_data(self):
+        self.assertEqual(list(iter_data(self.path)), self.records)
+        self.assertEqual(parse_data(self.path), self.records)
+
+    def test_external_sort(self):
+        expected = sorted(self.records, key=augmented_key)
+        # fits in 1 run
+        self.assertEqual(list(external_sort(iter_data(self.path))), expected)
+        # spills 8 runs (the last one partial) to tmp_dir
+        self.assertEqual(list(external_sort(iter_data(self.path), run_size=400, tmp_dir=self.tmp_dir.name)), expected)
+        self.assertEqual(list(external_sort(self.records, run_size=1000)), expected)
+        self.assertEqual(list(external_sort([])), [])
+
+    def test_pack_records(self):
+        disk = Disk()
+        data_block_ids = []
+        sorted_records = list(external_sort(self.records, run_size=700))
+        tree = Tree.bulk_load(disk, pack_records(disk, iter(sorted_records), data_block_ids))
+        tree.validate()
+        records_per_block = (disk.block_size - 13) // 18
+        self.assertEqual(len(data_block_ids), -(-len(self.records) // records_per_block))
+        records = [convert_bytes_to_record(read_record_bytes(disk.read_block(block_id), offset))
+                   for block_id, offset in tree.search_range(None, None)]
+        self.assertEqual(records, sorted_records)
+        records = [convert_bytes_to_record(read_record_bytes(disk.read_block(block_id), offset))
+                   for block_id, offset in tree.search(8.0)]
+        self.assertEqual(records, [record for record in sorted_records if record[1] == 8.0])
+
+    def test_store_record_and_compaction(self):
+        disk = Disk(200)
+        # stored in tconst order so that deleting a rating range leaves holes all over the data blocks
+        data_block_ids = []
+        tree = Tree.bulk_load(disk, sorted(pack_records(disk, self.records[:2000], data_block_ids)))
+        tree.delete_range(3.0, 8.0)
+        self.assertGreater(len(disk.non_full_data_queue), len(data_block_ids) // 2)
+        def get_data_block_ids():
+            return {block_id for block_id, _ in tree.search_range(None, None)}
+
+        # new records go into the holes
+        for record in self.records[2000:2100]:
+            tree.insert(*store_record(disk, record))
+        self.assertLessEqual(len(get_data_block_ids()), len(data_block_ids))
+        expected = sorted([record for record in self.records[:2000] if not 3.0 <= record[1] <= 8.0] + self.records[2000:2100], key=augmented_key)
+        self.assertEqual(list(tree.scan(None, None)), expected)
+
+        # a compaction failing midway leaves every record in place
+        encode_key = tree.encode_key
+        calls = []
+        def failing_encode_key(key):
+            calls.append(key)
+            if len(calls) == 50:
+                raise Exception("failure")
+            return encode_key(key)
+        tree.encode_key = failing_encode_key
+        with self.assertRaises(Exception):
+            compact_data_blocks(tree)
+        del tree.encode_key
+        tree.validate()
+        self.assertEqual(list(tree.scan(None, None)), expected)
+
+        num_data_blocks = len(get_data_block_ids())
+        freed = compact_data_blocks(tree)
+        self.assertGreater(freed, 0)
+        self.assertEqual(len(get_data_block_ids()), num_data_blocks - freed)
+        self.assertEqual(compact_data_blocks(tree), 0)
+        tree.validate()
+        self.assertEqual(list(tree.scan(None, None)), expected)
+        tree.save()
+        self.assertEqual(list(Tree.open(disk, tree.root.block_id, cache_size=8).scan(None, None)), expected)
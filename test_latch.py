@@ -0,0 +1,43 @@
+import threading
+import time
+import unittest
+
+from latch import RWLatch
+
+class TestLatch(unittest.TestCase):
+
+    def test_readers_share(self):
+        latch = RWLatch()
+        latch.acquire_read()
+        self.assertTrue(latch.acquire_read(blocking=False))
+        latch.release_read()
+        latch.release_read()
+        with self.assertRaises(Exception):
+            latch.release_read()
+        with self.assertRaises(Exception):
+            latch.release_write()
+
+    def test_writer_excludes(self):
+        latch = RWLatch()
+        latch.acquire_read()
+        events = []
+        writer = threading.Thread(target=lambda: (latch.acquire_write(), events.append("write"), latch.release_write()))
+        writer.start()
+        while latch.waiting_writers == 0:
+            time.sleep(0.001)
+        # a waiting writer goes before new readers
+        self.assertFalse(latch.acquire_read(blocking=False))
+        self.assertEqual(events, [])
+        latch.release_read()
+        writer.join()
+        self.assertEqual(events, ["write"])
+
+        latch.acquire_write()
+        self.assertFalse(latch.acquire_read(blocking=False))
+        reader = threading.Thread(target=lambda: (latch.acquire_read(), events.append("read"), latch.release_read()))
+        reader.start()
+        time.sleep(0.01)
+        self.assertEqual(events, ["write"])
+        latch.release_write()
+        reader.join()
+        self.assertEqual(events, ["write", "read"])
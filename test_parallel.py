@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+
+from buffer_pool import BufferPool
+from ingest import pack_records
+from parallel import *
+from structures import Disk
+from test_tree import make_records
+from tree import Tree
+from utils import *
+
+class TestParallel(unittest.TestCase):
+
+    def setUp(self):
+        self.records = make_records(20000)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "disk.bin")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_iter_partitions(self):
+        self.assertEqual([len(partition) for partition in iter_partitions(range(1000), 300)], [300, 300, 400])
+        self.assertEqual([len(partition) for partition in iter_partitions(range(1000), 450)], [450, 550])
+        self.assertEqual([len(partition) for partition in iter_partitions(range(100), 400)], [100])
+        self.assertEqual(list(iter_partitions([], 400)), [])
+
+    def test_parallel_bulk_load(self):
+        for block_size, cache_size, options in [(100, None, {}), (500, 16, {"tconst_prefix": "tt", "packed_keys": True})]:
+            disk = Disk(block_size, path=self.path + str(block_size))
+            data_block_ids = []
+            tree = parallel_bulk_load(disk, self.records, 2, 3000, cache_size=cache_size, data_block_ids=data_block_ids, **options)
+            tree.validate()
+            self.assertEqual(list(tree.scan(None, None)), self.records)
+            self.assertEqual(list(tree.scan(7.0, 8.0)), [record for record in self.records if 7.0 <= record[1] <= 8.0])
+            expected = Tree.bulk_load(Disk(block_size), pack_records(Disk(block_size), self.records), **options)
+            self.assertEqual(tree.get_height(), expected.get_height())
+            self.assertEqual(len(data_block_ids), len(set(data_block_ids)))
+            self.assertEqual(sum(len(read_all_records_from_data_block(disk.read_block(i))) for i in data_block_ids), len(self.records))
+
+            # the reserved blocks that were not used are handed out again
+            self.assertGreater(len(disk.free_queue), 0)
+            tree.delete_range(3.0, 6.0)
+            tree.validate()
+            tree.save()
+            disk.flush()
+            reopened = Tree.open(Disk(block_size, path=self.path + str(block_size)), tree.root.block_id, cache_size=8, **options)
+            reopened.validate()
+            self.assertEqual(list(reopened.scan(None, None)), [record for record in self.records if not 3.0 <= record[1] <= 6.0])
+
+    def test_parallel_bulk_load_buffer_pool(self):
+        pool = BufferPool(Disk(path=self.path), 64)
+        tree = parallel_bulk_load(pool, self.records[:5000], 2, 1000)
+        tree.validate()
+        self.assertEqual(list(tree.scan(None, None)), self.records[:5000])
+        self.assertEqual(list(parallel_bulk_load(pool, [], 2).scan(None, None)), [])
+
+    def test_parallel_bulk_load_invalid_input(self):
+        with self.assertRaises(Exception):
+            parallel_bulk_load(Disk(), self.records, 2) # not file backed
+        with self.assertRaises(Exception):
+            parallel_bulk_load(Disk(path=self.path), self.records[::-1], 2, 1000)
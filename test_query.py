@@ -0,0 +1,42 @@
+import unittest
+import random
+
+from buffer_pool import BufferPool
+from ingest import pack_records
+from query import *
+from structures import Disk
+from test_tree import make_records
+from tracker import Tracker
+from tree import Tree
+from utils import *
+
+class TestQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.records = make_records(3000)
+        self.pool = BufferPool(Disk(), num_frames=64)
+        self.tree = Tree.bulk_load(self.pool, pack_records(self.pool, self.records))
+
+    def test_fetch_records(self):
+        pointers = self.tree.search_range(None, None)
+        shuffled = pointers[:]
+        random.Random(1).shuffle(shuffled)
+        records, data_blocks = fetch_records(self.pool, shuffled)
+        self.assertEqual(records, [self.records[pointers.index(pointer)] for pointer in shuffled])
+        self.assertEqual(list(data_blocks), sorted({block_id for block_id, _ in pointers}))
+        self.assertEqual(sum(data_blocks.values(), []), self.records)
+        self.assertEqual(fetch_records(self.pool, []), ([], {}))
+
+    def test_execute_range_query(self):
+        Tracker.reset_all()
+        result = execute_range_query(self.tree, 7.0, 9.0)
+        expected = [record for record in self.records if 7.0 <= record[1] <= 9.0]
+        self.assertEqual(result.records, expected)
+        self.assertEqual(result.get_num_data_blocks(), len({block_id for block_id, _ in self.tree.search_range(7.0, 9.0)}))
+        self.assertEqual(result.buffer_misses, result.get_num_data_blocks()) # each data block is read once
+        self.assertEqual(len(result.non_leaf_nodes), self.tree.get_height() - 1)
+        self.assertGreater(len(result.leaf_nodes), 1)
+
+        result = execute_range_query(self.tree, 8.0, 8.0)
+        self.assertEqual(result.records, [record for record in self.records if record[1] == 8.0])
+        self.assertEqual(execute_range_query(self.tree, 9.0, 7.0).records, [])
@@ -0,0 +1,80 @@
+import asyncio
+import json
+import unittest
+
+from hash_index import HashIndex
+from ingest import pack_records
+from server import *
+from structures import Disk
+from test_tree import make_records
+from tracker import Tracker
+from tree import Tree
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.disk = Disk(200)
+        self.records = make_records(3000)
+        self.tree = Tree.bulk_load(self.disk, pack_records(self.disk, self.records))
+        self.hash_index = HashIndex.build(self.tree)
+
+    def test_parse_request(self):
+        self.assertEqual(parse_request({"op": "point", "rating": 7}), ("point", 7.0))
+        self.assertEqual(parse_request({"op": "range", "lower": 7.5, "upper": None}), ("range", 7.5, None))
+        self.assertEqual(parse_request({"op": "tconst", "tconst": "tt0000001"}), ("tconst", "tt0000001"))
+        for message in [{"op": "delete"}, {"op": "point"}, {"op": "point", "rating": "high"}, {"op": "tconst", "tconst": 1}]:
+            with self.assertRaises((ValueError, KeyError)):
+                parse_request(message)
+
+    def test_execute_batch(self):
+        queries = [("range", 7.0, 8.0), ("point", 7.5), ("tconst", "tt0000042"), ("range", 7.9, 8.5), ("point", 2.0),
+                   ("tconst", "tt9999999"), ("range", None, 1.5), ("range", 9.0, 8.0)]
+        expected = [list(self.tree.scan(7.0, 8.0)), list(self.tree.scan(7.5, 7.5)),
+                    [record for record in self.records if record[0] == "tt0000042"], list(self.tree.scan(7.9, 8.5)),
+                    list(self.tree.scan(2.0, 2.0)), [], list(self.tree.scan(None, 1.5)), []]
+        self.assertEqual(execute_batch(self.tree, queries, self.hash_index), expected)
+
+        # the overlapping ranges share their data blocks
+        overlapping = queries[:2] + queries[3:4]
+        with Tracker.measure() as batched:
+            execute_batch(self.tree, overlapping)
+        with Tracker.measure() as separate:
+            for query in overlapping:
+                execute_batch(self.tree, [query])
+        block_ids = {block_id for block_id, _ in self.tree.search_range(7.0, 8.5)}
+        self.assertEqual(batched.counts["logical_read.data"], len(block_ids))
+        self.assertLess(batched.counts["logical_read.data"], separate.counts["logical_read.data"])
+
+        self.assertIsInstance(execute_batch(self.tree, [("tconst", "tt0000042")])[0], Exception)
+
+    def test_server(self):
+        async def run():
+            server = QueryServer(self.tree, self.hash_index, window=0.01)
+            address = await server.start()
+            reader, writer = await open_connection(address)
+            messages = [{"id": i, "op": "point", "rating": 5.0 + i / 10} for i in range(10)]
+            messages += [{"id": "r", "op": "range", "lower": 6.0, "upper": 6.5}, {"id": "t", "op": "tconst", "tconst": "tt0000007"}]
+            messages += [{"id": "bad", "op": "delete"}]
+            for message in messages:
+                writer.write(json.dumps(message).encode() + b"\n")
+            await writer.drain()
+            responses = {}
+            for _ in messages:
+                response = json.loads(await reader.readline())
+                responses[response["id"]] = response
+            writer.close()
+            load = await run_load(address, num_clients=4, num_requests=100)
+            await server.close()
+            return server, responses, load
+
+        server, responses, load = asyncio.run(run())
+        for i in range(10):
+            self.assertEqual(responses[i]["records"], list(self.tree.scan(5.0 + i / 10, 5.0 + i / 10)))
+        self.assertEqual(responses["r"]["records"], list(self.tree.scan(6.0, 6.5)))
+        self.assertEqual(responses["t"]["records"], [record for record in self.records if record[0] == "tt0000007"])
+        self.assertIn("error", responses["bad"])
+        self.assertEqual(load["requests"], 100)
+        self.assertEqual(load["errors"], 0)
+        self.assertLessEqual(load["p50_us"], load["p99_us"])
+        # the queries sent together were run in 1 batch
+        self.assertLess(server.num_batches, server.num_queries - 10)
@@ -0,0 +1,117 @@
+import json
+import unittest
+
+from buffer_pool import BufferPool
+from ingest import pack_records
+from query import execute_range_query
+from structures import Disk
+from test_tree import make_records
+from tracker import Stats, Tracker
+from tree import Tree
+from utils import get_data_block_header
+
+class TestTracker(unittest.TestCase):
+
+    def setUp(self):
+        Tracker.reset_all()
+
+    def tearDown(self):
+        Tracker.enabled = True
+
+    def test_measure(self):
+        Tracker.increment_count("a")
+        with Tracker.measure() as outer:
+            Tracker.increment_count("a")
+            with Tracker.measure() as inner:
+                Tracker.increment_count("a", 2)
+                Tracker.add_block("data", 7)
+            self.assertEqual(inner.counts["a"], 2)
+            self.assertEqual(outer.counts["a"], 3)
+            self.assertEqual(list(outer.blocks["data"]), [7])
+        self.assertEqual(Tracker.stats.counts["a"], 4)
+        self.assertEqual(Tracker.outer, [])
+
+        with self.assertRaises(ValueError):
+            with Tracker.measure():
+                raise ValueError()
+        self.assertEqual(Tracker.outer, [])
+
+    def test_logical_and_physical_io(self):
+        disk = Disk()
+        tree = Tree.bulk_load(disk, pack_records(disk, make_records(500)))
+        tree.save()
+        pool = BufferPool(disk, 4)
+        with Tracker.measure() as stats:
+            pool.read_block(tree.root.block_id)
+            pool.read_block(tree.root.block_id)
+            pool.write_block(tree.root.block_id, pool.read_block(tree.root.block_id))
+            pool.flush()
+        self.assertEqual(stats.counts["logical_read.non-leaf"], 3)
+        self.assertEqual(stats.counts["physical_read.non-leaf"], 1)
+        self.assertEqual(stats.counts["logical_write.non-leaf"], 1)
+        self.assertEqual(stats.counts["physical_write.non-leaf"], 1)
+        self.assertEqual(stats.get_io("logical_read"), 3)
+
+        # without a buffer pool every access reaches the disk
+        with Tracker.measure() as stats:
+            list(tree.scan(5.0, 5.0))
+        self.assertGreater(stats.counts["logical_read.data"], 0)
+        self.assertEqual(stats.counts["logical_read.data"], stats.counts["physical_read.data"])
+        self.assertEqual(stats.counts["logical_read.data"], len(stats.blocks["data"]))
+        # every slot of a data block read is decoded
+        self.assertEqual(stats.counts["bytes_decoded"], sum(get_data_block_header(disk.read_block(block_id))[2] - 13
+                                                           for block_id in stats.blocks["data"]))
+
+    def test_splits_and_merges(self):
+        disk = Disk()
+        tree = Tree(disk, secondary=True) # the pointers are not to real records
+        records = make_records(200)
+        with Tracker.measure() as stats:
+            for i, record in enumerate(records):
+                tree.insert((record[1], record[0]), (i + 1, 13))
+        self.assertGreater(stats.counts["split"], 0)
+        self.assertEqual(stats.counts["merge"], 0)
+        with Tracker.measure() as stats:
+            for record in records[:150]:
+                tree.delete(record[1])
+        self.assertGreater(stats.counts["merge"], 0)
+
+    def test_query_stats(self):
+        disk = Disk()
+        tree = Tree.bulk_load(disk, pack_records(disk, make_records(1000)))
+        result = execute_range_query(tree, 7.0, 8.0)
+        stats = result.stats
+        self.assertEqual([node.block_id for node in result.leaf_nodes], list(stats.blocks["leaf"]))
+        self.assertEqual(len(result.non_leaf_nodes), tree.get_height() - 1)
+        self.assertEqual(stats.counts["logical_read.data"], result.get_num_data_blocks())
+        self.assertEqual(set(stats.phases), {"search", "fetch"})
+
+        # the session Stats get the counts but no references to the nodes
+        self.assertEqual(Tracker.stats.nodes, None)
+        self.assertEqual(Tracker.stats.counts["logical_read.data"], result.get_num_data_blocks())
+
+        exported = json.loads(stats.to_json())
+        self.assertEqual(exported["blocks"]["leaf"], len(result.leaf_nodes))
+        self.assertEqual(exported["counts"]["logical_read.data"], result.get_num_data_blocks())
+
+    def test_lazy_keys_decode_fewer_bytes(self):
+        disk = Disk(500)
+        tree = Tree.bulk_load(disk, pack_records(disk, make_records(3000)))
+        tree.save()
+        decoded = []
+        for lazy_keys in [False, True]:
+            opened = Tree.open(disk, tree.root.block_id, cache_size=1, lazy_keys=lazy_keys)
+            with Tracker.measure() as stats:
+                opened.search(7.0)
+            decoded.append(stats.counts["bytes_decoded"])
+        self.assertLess(decoded[1], decoded[0])
+
+    def test_disabled(self):
+        Tracker.enabled = False
+        disk = Disk()
+        with Tracker.measure() as stats:
+            with Tracker.phase("load"):
+                tree = Tree.bulk_load(disk, pack_records(disk, make_records(500)))
+                tree.save()
+            list(tree.scan(None, None))
+        self.assertEqual(stats.to_dict(), Stats().to_dict())
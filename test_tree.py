@@ -0,0 +1,418 @@
+import bisect
+import os
+import unittest
+import random
+import sys
+import tempfile
+import threading
+
+from ingest import augmented_key, pack_records, store_record
+from structures import Disk
+from tracker import Tracker
+from tree import KeyArray, LazyKeys, PointerArray, Tree
+from utils import *
+
+def make_items(n, seed=0):
+    # returns sorted list[(augmented_key, (block_id, offset))] with duplicate ratings
+    rng = random.Random(seed)
+    keys = sorted({(rng.randint(10, 100) / 10, f"tt{rng.randint(0, 10**7):07d}") for _ in range(n)})
+    return [(key, (i // 4 + 1, 13 + (i % 4) * 18)) for i, key in enumerate(keys)]
+
+def make_records(n, seed=0, max_votes=10**6):
+    # returns records sorted by augmented key, shared by the other test modules
+    rng = random.Random(seed)
+    records = [[f"tt{i:07d}", rng.randint(10, 100) / 10, rng.randint(5, max_votes)] for i in range(n)]
+    return sorted(records, key=augmented_key)
+
+class TestTree(unittest.TestCase):
+
+    def test_bulk_load_matches_insert(self):
+        items = make_items(2000)
+        inserted = Tree(Disk())
+        for key, value in items:
+            inserted.insert(key, value)
+        loaded = Tree.bulk_load(Disk(), iter(items))
+        loaded.validate()
+        self.assertEqual(loaded.search_range(None, None), inserted.search_range(None, None))
+        self.assertEqual(loaded.search(5.5), inserted.search(5.5))
+        self.assertEqual(loaded.search_range(3.0, 7.5), inserted.search_range(3.0, 7.5))
+        self.assertLessEqual(loaded.get_num_nodes(), inserted.get_num_nodes())
+
+    def test_bulk_load_fill_factor(self):
+        for n in [0, 1, 2, 3, 4, 5, 7, 10, 17, 100, 1000]:
+            items = make_items(n, seed=n)
+            for fill_factor in [0.1, 0.5, 0.7, 1.0]:
+                tree = Tree.bulk_load(Disk(), items, fill_factor)
+                if items:
+                    tree.validate()
+                self.assertEqual(tree.search_range(None, None), [value for _, value in items])
+
+    def test_bulk_load_then_insert(self):
+        items = make_items(500)
+        tree = Tree.bulk_load(Disk(), items[::2], fill_factor=0.7)
+        for key, value in items[1::2]:
+            tree.insert(key, value)
+        tree.validate()
+        self.assertEqual(tree.search_range(None, None), [value for _, value in items])
+
+    def test_insert_and_search_large_nodes(self):
+        items = make_items(3000, seed=1)
+        shuffled = items[:]
+        random.Random(1).shuffle(shuffled)
+        tree = Tree(Disk(), max_keys=21)
+        for key, value in shuffled:
+            tree.insert(key, value)
+        tree.validate()
+        self.assertEqual(tree.max_keys, 21)
+        self.assertEqual(tree.search_range(None, None), [value for _, value in items])
+        self.assertEqual(tree.search(5.5), [value for key, value in items if key[0] == 5.5])
+        self.assertEqual(tree.search_range(2.05, 2.95), [value for key, value in items if 2.05 <= key[0] <= 2.95])
+
+    def test_bulk_load_invalid_input(self):
+        with self.assertRaises(Exception):
+            Tree.bulk_load(Disk(), [((2.0, "b"), (1, 13)), ((1.0, "a"), (1, 31))])
+        with self.assertRaises(Exception):
+            Tree.bulk_load(Disk(), [], fill_factor=0)
+
+    def test_open(self):
+        disk = Disk()
+        records = make_records(2000)
+        tree = Tree.bulk_load(disk, pack_records(disk, records))
+        tree.save()
+        expected = tree.search_range(None, None)
+
+        opened = Tree.open(disk, tree.root.block_id, cache_size=8)
+        self.assertEqual(len(opened.cache), 1) # only the root is materialized
+        self.assertEqual(opened.search(5.5), tree.search(5.5))
+        self.assertLessEqual(len(opened.cache), 8)
+        self.assertEqual(opened.search_range(None, None), expected)
+        self.assertLessEqual(len(opened.cache), 8)
+        self.assertEqual(opened.get_height(), tree.get_height())
+        with self.assertRaises(Exception):
+            Tree.open(disk, expected[0][0]) # data block
+
+    def test_open_insert_and_delete(self):
+        disk = Disk()
+        records = make_records(3000, seed=2)
+        tree = Tree.bulk_load(disk, pack_records(disk, records[::2]), fill_factor=0.7)
+        tree.save()
+        opened = Tree.open(disk, tree.root.block_id, cache_size=6)
+        del tree
+        for (key, value) in pack_records(disk, records[1::2]):
+            opened.insert(key, value)
+            self.assertLessEqual(len(opened.cache), 6 + opened.get_height())
+        opened.delete(7.0)
+        opened.delete(2.5)
+        opened.save()
+
+        reopened = Tree.open(disk, opened.root.block_id, cache_size=4)
+        reopened.validate()
+        remaining = [record for record in records if record[1] not in (7.0, 2.5)]
+        self.assertEqual(
+            [convert_bytes_to_record(read_record_bytes(disk.read_block(block_id), offset)) for block_id, offset in reopened.search_range(None, None)],
+            remaining
+        )
+
+    def test_incremental_save(self):
+        disk = Disk()
+        records = make_records(1500, seed=3)
+        tree = Tree.bulk_load(disk, pack_records(disk, records[1:]))
+        self.assertEqual(tree.save(), tree.get_num_nodes())
+        self.assertEqual(tree.save(), 0)
+
+        # an insert only rewrites the nodes it changed
+        for key, value in pack_records(disk, records[:1]):
+            tree.insert(key, value)
+        self.assertLess(tree.save(), tree.get_num_nodes() // 10)
+
+        # blocks of merged away nodes (and temporary split nodes) are freed and reused
+        num_nodes = tree.get_num_nodes()
+        tree.delete(5.0)
+        tree.delete(5.1)
+        self.assertLess(tree.get_num_nodes(), num_nodes)
+        self.assertGreaterEqual(len(disk.free_queue), num_nodes - tree.get_num_nodes())
+        self.assertLess(tree.save(), tree.get_num_nodes())
+
+        reopened = Tree.open(disk, tree.root.block_id)
+        reopened.validate()
+        self.assertEqual(reopened.search_range(None, None), tree.search_range(None, None))
+
+    def test_compressed_keys(self):
+        for block_size in [100, 500]:
+            disk = Disk(block_size)
+            records = make_records(2000, seed=4)
+            tree = Tree.bulk_load(disk, pack_records(disk, records[::2]), tconst_prefix="tt")
+            self.assertGreater(tree.max_keys, Tree(Disk(block_size)).max_keys)
+            for key, value in pack_records(disk, records[1::2]):
+                tree.insert(key, value)
+            tree.delete(5.0)
+            tree.save()
+
+            reopened = Tree.open(disk, tree.root.block_id, cache_size=8, tconst_prefix="tt")
+            reopened.validate()
+            self.assertEqual(reopened.search_range(None, None), tree.search_range(None, None))
+            self.assertEqual(reopened.get_height(), tree.get_height())
+            self.assertEqual(list(reopened.scan(3.0, 4.0)), [record for record in records if 3.0 <= record[1] <= 4.0])
+
+        tree = Tree(Disk(), tconst_prefix="tt")
+        tree.insert((5.0, "nm0000001"), (1, 13))
+        with self.assertRaises(Exception):
+            tree.save()
+
+    def test_packed_keys(self):
+        records = make_records(2000, seed=5)
+        for compact in [False, True]:
+            disk = Disk(500)
+            tree = Tree.bulk_load(disk, pack_records(disk, records[::2]), compact=compact, tconst_prefix="tt", packed_keys=True)
+            for key, value in pack_records(disk, records[1::2]):
+                tree.insert(key, value)
+            tree.validate()
+            self.assertEqual(tree.decode_key(tree.root.get_min_key()), augmented_key(records[0]))
+            self.assertEqual(list(tree.scan(7.25, 8.0)), [record for record in records if 7.25 <= record[1] <= 8.0])
+            # the same ranges as an unpacked tree, also for bounds like 5.6 + 0.1 == 5.699999999999999
+            unpacked_disk = Disk(500)
+            unpacked = Tree.bulk_load(unpacked_disk, pack_records(unpacked_disk, records))
+            for k in range(10, 100):
+                lower, upper = k / 10, k / 10 + 0.1
+                self.assertEqual(list(tree.scan(lower, upper)), list(unpacked.scan(lower, upper)), (lower, upper))
+            tree.delete(5.0)
+            self.assertEqual(tree.delete_range(2.0, 3.0), unpacked.delete_range(2.0, 3.0))
+            self.assertEqual(tree.delete_range(5.6, 5.6 + 0.1), unpacked.delete_range(5.6, 5.6 + 0.1))
+            tree.save()
+
+            reopened = Tree.open(disk, tree.root.block_id, cache_size=8, compact=compact, tconst_prefix="tt", packed_keys=True)
+            reopened.validate()
+            remaining = [record for record in records if record[1] != 5.0 and not 2.0 <= record[1] <= 3.0 and record[1] != 5.6]
+            self.assertEqual(list(reopened.scan(None, None)), remaining)
+            self.assertEqual(reopened.search(6.1), tree.search(6.1))
+        with self.assertRaises(Exception):
+            Tree(Disk(), packed_keys=True)
+
+    def test_lazy_keys(self):
+        records = make_records(3000, seed=6)
+        for tconst_prefix, packed_keys, compact in [(None, False, False), (None, False, True), ("tt", False, False), ("tt", True, True)]:
+            disk = Disk(500)
+            tree = Tree.bulk_load(disk, pack_records(disk, records[::2]), compact=compact, tconst_prefix=tconst_prefix,
+                                  packed_keys=packed_keys)
+            tree.save()
+            opened = Tree.open(disk, tree.root.block_id, cache_size=8, compact=compact, tconst_prefix=tconst_prefix,
+                               packed_keys=packed_keys, lazy_keys=True)
+            leaf, _ = opened.root.search_first_gte(opened.encode_key((5.5, "")))
+            self.assertLess(sum(key != None for key in leaf.keys.decoded), len(leaf.keys) // 2)
+            self.assertEqual(opened.search(5.5), tree.search(5.5))
+            for key, value in pack_records(disk, records[1::2]):
+                opened.insert(key, value)
+            opened.delete(7.0)
+            opened.delete_range(2.0, 2.5)
+            opened.validate()
+            remaining = [record for record in records if record[1] != 7.0 and not 2.0 <= record[1] <= 2.5]
+            self.assertEqual(list(opened.scan(None, None)), remaining)
+
+        keys = LazyKeys(5, lambda i: (i / 10, f"tt{i:07d}"))
+        self.assertEqual(bisect.bisect_left(keys, (0.3, "")), 3)
+        self.assertEqual(sum(key != None for key in keys.decoded), 3)
+        self.assertEqual([] + keys, [(i / 10, f"tt{i:07d}") for i in range(5)])
+        keys.pop(0)
+        keys.insert(0, (-1.0, "tt0000000"))
+        self.assertEqual(keys[:2], [(-1.0, "tt0000000"), (0.1, "tt0000001")])
+        self.assertEqual(len(keys), 5)
+
+    def test_key_and_pointer_arrays(self):
+        keys = [(1.0, "tt0000001"), (5.6, ""), (10.0, "tt99999999")]
+        key_array = KeyArray(keys)
+        self.assertEqual(list(key_array), keys)
+        self.assertEqual(list(key_array[1:] + key_array[:1]), keys[1:] + keys[:1])
+        key_array.insert(1, (2.5, "tt1"))
+        self.assertEqual(key_array.pop(), (10.0, "tt99999999"))
+        key_array[0] = (1.1, "a")
+        self.assertEqual(list(key_array), [(1.1, "a"), (2.5, "tt1"), (5.6, "")])
+
+        pointers = [(4, 13), (5, 31), (9, 0)] # (9, 0) points to the right neighbour
+        pointer_array = PointerArray(pointers)
+        self.assertEqual(list(pointer_array), pointers)
+        self.assertEqual(list(pointer_array[:-1] + pointer_array[1:]), [(4, 13), (5, 31), (5, 31), (9, 0)])
+        pointer_array.insert(-1, (6, 49))
+        self.assertEqual(pointer_array[-1], (9, 0))
+        self.assertEqual(pointer_array.pop(), (9, 0))
+        pointer_array.append(None)
+        self.assertEqual(list(pointer_array), [(4, 13), (5, 31), (6, 49), None])
+
+    def test_compact(self):
+        records = make_records(3000, seed=4)
+        trees = []
+        for compact in [False, True]:
+            disk = Disk()
+            tree = Tree.bulk_load(disk, pack_records(disk, records[::2]), fill_factor=0.8, compact=compact)
+            for key, value in pack_records(disk, records[1::2]):
+                tree.insert(key, value)
+            tree.delete(6.6)
+            tree.validate()
+            tree.save()
+            trees.append((disk, tree))
+        (_, tree), (compact_disk, compact_tree) = trees
+        self.assertEqual(compact_tree.search_range(None, None), tree.search_range(None, None))
+        self.assertEqual(compact_tree.search_range(3.0, 4.0), tree.search_range(3.0, 4.0))
+        reopened = Tree.open(compact_disk, compact_tree.root.block_id, cache_size=16, compact=True)
+        reopened.validate()
+        self.assertEqual(reopened.search_range(None, None), tree.search_range(None, None))
+
+    def test_scan(self):
+        disk = Disk()
+        records = make_records(3000, seed=5)
+        tree = Tree.bulk_load(disk, pack_records(disk, records))
+        self.assertEqual(list(tree.scan(None, None)), records)
+        self.assertEqual(list(tree.scan(8.0, 8.0)), [record for record in records if record[1] == 8.0])
+        self.assertEqual(list(tree.scan(3.05, 4.5)), [record for record in records if 3.05 <= record[1] <= 4.5])
+        self.assertEqual(list(tree.scan(4.5, 3.0)), [])
+
+        # each data block is read once, and the scan stops at the first key past the upper bound
+        Tracker.reset_all()
+        scan = tree.scan(7.0, 9.0)
+        self.assertEqual(next(scan), [record for record in records if record[1] >= 7.0][0])
+        self.assertEqual(len(Tracker.stats.blocks["data"]), 1)
+        rest = list(scan)
+        expected = [record for record in records if 7.0 <= record[1] <= 9.0]
+        self.assertEqual(rest, expected[1:])
+        self.assertEqual(list(Tracker.stats.blocks["data"]), list(dict.fromkeys(block_id for block_id, _ in tree.search_range(7.0, 9.0))))
+
+    def test_delete_range(self):
+        for compact in [False, True]:
+            disk = Disk(200)
+            records = make_records(3000, seed=6)
+            tree = Tree.bulk_load(disk, pack_records(disk, records), fill_factor=0.8, compact=compact)
+            num_nodes = tree.get_num_nodes()
+            self.assertEqual(tree.delete_range(7.0, 7.0), len([record for record in records if record[1] == 7.0]))
+            self.assertEqual(tree.delete_range(3.05, 5.55), len([record for record in records if 3.05 <= record[1] <= 5.55]))
+            self.assertEqual(tree.delete_range(9.5, None), len([record for record in records if record[1] >= 9.5]))
+            self.assertEqual(tree.delete_range(6.0, 5.0), 0)
+            tree.validate()
+            remaining = [record for record in records if record[1] != 7.0 and not 3.05 <= record[1] <= 5.55 and record[1] < 9.5]
+            self.assertEqual(list(tree.scan(None, None)), remaining)
+            self.assertLess(tree.get_num_nodes(), num_nodes)
+
+            # blocks of freed nodes and emptied data blocks are reused
+            self.assertGreater(len(disk.free_queue), num_nodes - tree.get_num_nodes())
+            tree.save()
+            reopened = Tree.open(disk, tree.root.block_id, cache_size=8, compact=compact)
+            for key, value in pack_records(disk, [record for record in records if record[1] == 7.0]):
+                reopened.insert(key, value)
+            reopened.validate()
+            self.assertEqual(list(reopened.scan(None, None)), sorted(remaining + [record for record in records if record[1] == 7.0], key=augmented_key))
+
+            self.assertEqual(reopened.delete_range(None, None), len(remaining) + len([record for record in records if record[1] == 7.0]))
+            self.assertEqual(reopened.get_num_nodes(), 1)
+            self.assertEqual(list(reopened.scan(None, None)), [])
+
+    def test_delete_key(self):
+        disk = Disk(200)
+        records = make_records(500, seed=8)
+        tree = Tree.bulk_load(disk, pack_records(disk, records))
+        for record in records[::3]:
+            self.assertTrue(tree.delete_key(augmented_key(record)))
+        self.assertFalse(tree.delete_key(augmented_key(records[0])))
+        self.assertFalse(tree.delete_key((5.0, "tt9999999")))
+        tree.validate()
+        self.assertEqual(list(tree.scan(None, None)), [record for i, record in enumerate(records) if i % 3])
+
+    def test_commit(self):
+        # a crash after commit recovers the tree (nodes and records) as of the commit from the write-ahead log
+        records = make_records(600, seed=9)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "disk.bin")
+            disk = Disk(200, 200 * 5000, path, wal=True)
+            tree = Tree.bulk_load(disk, pack_records(disk, records[:300]))
+            tree.commit()
+            for record in records[300:500]:
+                tree.insert(*store_record(disk, record))
+            tree.delete_range(records[0][1], records[0][1])
+            tree.commit()
+            root_block_id = tree.root.block_id
+            committed = sorted([record for record in records[:500] if record[1] != records[0][1]], key=augmented_key)
+            for record in records[500:]:
+                tree.insert(*store_record(disk, record))
+            tree.delete_range(None, None)
+            tree.save() # written, but not committed
+
+            recovered = Tree.open(Disk(200, 200 * 5000, path, wal=True), root_block_id)
+            recovered.validate()
+            self.assertEqual(list(recovered.scan(None, None)), committed)
+
+    def test_concurrent(self):
+        # writer threads move records to new ratings (delete_key + insert) and insert and delete records while reader threads
+        # scan and search, the records no writer touches must be seen by every reader
+        disk = Disk(200)
+        records = make_records(3000, seed=9)
+        tree = Tree.bulk_load(disk, pack_records(disk, records), fill_factor=0.7, concurrent=True)
+        stable = records[::2]
+        owned = [records[1 + 2 * i::8] for i in range(4)] # records[1::2] split between 4 writers
+        errors = []
+        writers_done = threading.Event()
+
+        def write(i, live):
+            rng = random.Random(i)
+            try:
+                for n in range(300):
+                    op = rng.random()
+                    if op < 0.2 or not live:
+                        record = [f"tt{9000000 + i * 1000 + n:07d}", rng.randint(10, 100) / 10, n]
+                        tree.insert(*store_record(disk, record))
+                        live.append(record)
+                        continue
+                    record = live.pop(rng.randrange(len(live)))
+                    if not tree.delete_key(augmented_key(record)):
+                        raise AssertionError(f"{record} not found")
+                    if op < 0.3:
+                        continue
+                    record = [record[0], rng.randint(10, 100) / 10, record[2]]
+                    tree.insert(*store_record(disk, record))
+                    live.append(record)
+            except BaseException as e:
+                errors.append(e)
+
+        def read(i):
+            rng = random.Random(100 + i)
+            try:
+                while not writers_done.is_set():
+                    lower = rng.randint(10, 100) / 10
+                    upper = lower + rng.choice([0.0, 0.5, 3.0])
+                    scanned = list(tree.scan(lower, upper))
+                    if any(not lower <= record[1] <= upper for record in scanned):
+                        raise AssertionError(f"scan({lower}, {upper}) returned a record outside of the range")
+                    if [augmented_key(record) for record in scanned] != sorted(augmented_key(record) for record in scanned):
+                        raise AssertionError(f"scan({lower}, {upper}) is not in key order")
+                    expected = [record for record in stable if lower <= record[1] <= upper]
+                    scanned = set(map(tuple, scanned))
+                    if any(tuple(record) not in scanned for record in expected):
+                        raise AssertionError(f"scan({lower}, {upper}) missed a record")
+                    keys = tree.search(lower, return_key=True)
+                    if any(key[0] != lower for key in keys) or len(set(keys)) != len(keys):
+                        raise AssertionError(f"search({lower}) is wrong")
+            except BaseException as e:
+                errors.append(e)
+
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-5) # switch threads often to shake out races
+        try:
+            writers = [threading.Thread(target=write, args=(i, owned[i])) for i in range(4)]
+            readers = [threading.Thread(target=read, args=(i,)) for i in range(4)]
+            for thread in writers + readers:
+                thread.start()
+            for thread in writers:
+                thread.join()
+            writers_done.set()
+            for thread in readers:
+                thread.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+        self.assertEqual(errors, [])
+        tree.validate()
+        expected = sorted(stable + [record for live in owned for record in live], key=augmented_key)
+        self.assertEqual(list(tree.scan(None, None)), expected)
+        self.assertEqual(tree.search_range(3.0, 7.5), tree.root.search_range((3.0, ""), (7.5, chr(255))))
+
+        tree.save()
+        reopened = Tree.open(disk, tree.root.block_id, cache_size=None, concurrent=True)
+        self.assertTrue(reopened.delete_key(augmented_key(expected[0])))
+        self.assertEqual(list(reopened.scan(None, None)), expected[1:])
+        with self.assertRaises(Exception):
+            Tree.open(disk, tree.root.block_id, concurrent=True) # needs cache_size=None
@@ -50,6 +50,67 @@ class TestUtils(unittest.TestCase):
             for i in range(3):
                 self.assertEqual(record[i], converted_back_record[i])
     
+    def test_batch_record_conversion(self):
+        records = [["tt0000001", 5.6, 1645], ["", 10.0, 0], ["tt99167789", 1.0, 2279223]]
+        bytes_ = convert_records_to_bytes(records)
+        self.assertEqual(len(bytes_), 18 * len(records))
+        self.assertEqual(bytes_, b"".join(convert_record_to_bytes(record) for record in records))
+        self.assertEqual(convert_bytes_to_records(bytes_), records)
+        self.assertEqual(convert_bytes_to_records(bytearray()), [])
+
+        test_block = Block()
+        set_data_block_header(test_block, 3)
+        for record in records:
+            insert_record_bytes(test_block, convert_record_to_bytes(record))
+        self.assertEqual(read_all_slots_from_data_block(test_block), records)
+        # a slot with an empty tconst is a deleted record
+        self.assertEqual(read_all_records_from_data_block(test_block), records[::2])
+
+    def test_free_slots(self):
+        records = [["tt0000001", 5.6, 1645], ["tt0000002", 8.0, 23], ["tt0000003", 1.0, 7], ["tt0000004", 2.5, 9]]
+        test_block = Block()
+        set_data_block_header(test_block, 3)
+        offsets = [insert_record_bytes(test_block, convert_record_to_bytes(record)) for record in records]
+        self.assertEqual(insert_record_bytes(test_block, convert_record_to_bytes(records[0])), -1)
+        self.assertTrue(is_data_block_full(test_block))
+
+        delete_record_bytes(test_block, offsets[1])
+        self.assertEqual(get_free_slots(test_block), [offsets[1]])
+        self.assertFalse(is_data_block_full(test_block))
+        self.assertEqual(read_all_records_from_data_block(test_block), records[:1] + records[2:])
+
+        # deleting the last records gives their slots back to the end of the block
+        delete_record_bytes(test_block, offsets[3])
+        delete_record_bytes(test_block, offsets[2])
+        self.assertEqual(get_data_block_header(test_block)[2], offsets[1])
+        self.assertEqual(get_free_slots(test_block), [])
+
+        delete_record_bytes(test_block, offsets[0])
+        self.assertEqual(get_data_block_header(test_block)[2], 13)
+        self.assertEqual(insert_record_bytes(test_block, convert_record_to_bytes(records[2])), 13)
+        self.assertEqual(insert_record_bytes(test_block, convert_record_to_bytes(records[1])), 31)
+        delete_record_bytes(test_block, 13)
+        with self.assertRaises(Exception):
+            insert_record_bytes(test_block, convert_record_to_bytes(records[0]), 31) # not free
+        self.assertEqual(insert_record_bytes(test_block, convert_record_to_bytes(records[0]), 13), 13)
+        self.assertEqual(read_all_records_from_data_block(test_block), records[:2])
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_array_record_conversion(self):
+        records = [["tt0000001", 5.6, 1645], ["tt0000002", 8.0, 23]]
+        array = convert_records_to_array(records)
+        self.assertEqual(array.tobytes(), convert_records_to_bytes(records))
+        test_blocks = []
+        for i, record in enumerate(records):
+            test_block = Block()
+            set_data_block_header(test_block, i + 1)
+            insert_record_bytes(test_block, convert_record_to_bytes(record))
+            test_blocks.append(test_block)
+        array = read_all_records_array_from_data_blocks(test_blocks)
+        self.assertEqual(list(array["tconst"]), [b"tt0000001", b"tt0000002"])
+        self.assertEqual(list(array["numVotes"]), [1645, 23])
+        self.assertEqual(int((array["averageRating"] == np.float32(8.0)).sum()), 1)
+
     def test_data_block_header_setter_and_getter(self):
         test_block = Block()
         set_data_block_header(test_block, 23)
@@ -125,4 +186,72 @@ class TestUtils(unittest.TestCase):
         keys_pointers_bytes = serialize_ptrs_keys(pointers, keys)
         set_ptrs_keys_bytes(test_block, keys_pointers_bytes)
         self.assertEqual(deserialize_index_block(test_block), (pointers, keys))
-        # TODO: write test for exceptions
\ No newline at end of file
+        # TODO: write test for exceptions
+
+    def test_serialize_and_deserialize_compressed_index_block(self):
+        keys = [(5.6, "tt0000001"), (6.6, "tt12345678"), (7.6, "tt0999999")]
+        for index_type, pointers in [("leaf", [(4, 13), (5, 31), (6, 49), None]), ("non-leaf", [(4, 0), (5, 0), (6, 0), (7, 0)])]:
+            test_block = Block()
+            set_index_block_header(test_block, index_type, 5, 0, key_size=COMPRESSED_KEY_SIZE)
+            ptrs_keys_bytes = serialize_compressed_ptrs_keys(pointers, keys, "tt", index_type == "leaf")
+            self.assertEqual(len(ptrs_keys_bytes), get_compressed_ptrs_keys_size(len(keys), "tt", index_type == "leaf"))
+            set_ptrs_keys_bytes(test_block, ptrs_keys_bytes, len(keys))
+            self.assertEqual(deserialize_index_block(test_block), ([p if p else (0, 0) for p in pointers], keys))
+
+        self.assertEqual(convert_uint_to_tconst(convert_tconst_to_uint("tt0000042", "tt"), "tt"), "tt0000042")
+        for tconst in ["tt42", "nm0000042", "tt00000042", "tt000004a", "tt"]:
+            with self.assertRaises(Exception):
+                convert_tconst_to_uint(tconst, "tt")
+
+    def test_packed_key_conversion(self):
+        keys = [(1.0, "tt0000001"), (1.0, "tt0000002"), (7.5, "tt0000001"), (7.5, "tt12345678"), (10.0, "tt0000000")]
+        packed = [convert_key_to_packed(key, "tt") for key in keys]
+        self.assertEqual(packed, sorted(packed))
+        self.assertEqual([convert_packed_to_key(key, "tt") for key in packed], keys)
+        self.assertEqual([PACKED_KEY_STRUCT.pack(key) for key in packed], sorted(PACKED_KEY_STRUCT.pack(key) for key in packed))
+        self.assertEqual(convert_packed_to_key(convert_key_to_packed((2279223, "tt0000001"), "tt", "I"), "tt", "I"), (2279223, "tt0000001"))
+
+        # search bounds
+        self.assertLess(convert_key_to_packed((7.5, ""), "tt"), packed[2])
+        self.assertGreater(convert_key_to_packed((7.5, chr(255)), "tt"), packed[3])
+        self.assertGreater(convert_key_to_packed((7.45, ""), "tt"), packed[1])
+        self.assertLess(convert_key_to_packed((7.55, chr(255)), "tt"), packed[4])
+        self.assertLess(convert_key_to_packed((float("-inf"), ""), "tt"), packed[0])
+        self.assertGreater(convert_key_to_packed((float("inf"), chr(255)), "tt"), packed[-1])
+        # a bound just below a 0.1 step stays below it, even where the bound * 10 rounds up to the step
+        self.assertEqual(5.6 + 0.1, 5.699999999999999)
+        self.assertEqual(convert_key_to_packed((5.6 + 0.1, chr(255)), "tt") >> 32, 56)
+        self.assertEqual(convert_key_to_packed((5.6 + 0.1, ""), "tt") >> 32, 57)
+        self.assertEqual(convert_key_to_packed((0.7 - 1e-16, ""), "tt") >> 32, 7)
+        for k in range(101):
+            self.assertEqual(convert_key_to_packed((k / 10, ""), "tt") >> 32, k)
+            self.assertEqual(convert_key_to_packed((k / 10, chr(255)), "tt") >> 32, k)
+
+        test_block = Block()
+        set_index_block_header(test_block, "leaf", 5, 0, key_size=COMPRESSED_KEY_SIZE)
+        pointers = [(4, 13), (5, 31), (6, 49), (7, 67), (8, 85), None]
+        set_ptrs_keys_bytes(test_block, serialize_compressed_ptrs_keys(pointers, packed, "tt", True, packed=True), len(packed))
+        self.assertEqual(deserialize_index_block(test_block, packed=True), (pointers[:-1] + [(0, 0)], packed))
+
+    def test_deserialize_index_block_lazy(self):
+        keys = [(5.6, "tt0000001"), (6.6, "tt12345678"), (7.6, "tt0999999")]
+        blocks = []
+        for index_type, pointers in [("leaf", [(4, 13), (5, 31), (6, 49), (0, 0)]), ("non-leaf", [(4, 0), (5, 0), (6, 0), (7, 0)])]:
+            test_block = Block()
+            set_index_block_header(test_block, index_type, 5, 0)
+            set_ptrs_keys_bytes(test_block, serialize_ptrs_keys(pointers, keys))
+            blocks.append((test_block, "f", False))
+            test_block = Block()
+            set_index_block_header(test_block, index_type, 5, 0, key_size=COMPRESSED_KEY_SIZE)
+            set_ptrs_keys_bytes(test_block, serialize_compressed_ptrs_keys(pointers, keys, "tt", index_type == "leaf"), len(keys))
+            blocks.append((test_block, "f", False))
+            packed = [convert_key_to_packed(key, "tt") for key in keys]
+            test_block = Block()
+            set_index_block_header(test_block, index_type, 5, 0, key_size=COMPRESSED_KEY_SIZE)
+            set_ptrs_keys_bytes(test_block, serialize_compressed_ptrs_keys(pointers, packed, "tt", index_type == "leaf", packed=True), len(keys))
+            blocks.append((test_block, "f", True))
+        for test_block, key_format, packed in blocks:
+            pointers, keys = deserialize_index_block(test_block, key_format, packed)
+            lazy_pointers, num_keys, decode_key = deserialize_index_block_lazy(test_block, key_format, packed)
+            test_block.bytes[17:] = bytearray(len(test_block) - 17) # decode_key reads its own copy
+            self.assertEqual((lazy_pointers, [decode_key(i) for i in range(num_keys)]), (pointers, keys))
@@ -0,0 +1,115 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from tracker import Tracker
+from wal import *
+
+class TestWriteAheadLog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmp_dir.name, "disk.bin.wal")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def recover(self, **kwargs):
+        wal = WriteAheadLog(self.directory, **kwargs)
+        replayed = []
+        wal.recover(lambda block_id, data: replayed.append((block_id, bytes(data))))
+        return wal, replayed
+
+    def test_recover(self):
+        wal, replayed = self.recover()
+        self.assertEqual(replayed, [])
+        wal.append(BLOCK, 1, b"a" * 10)
+        wal.append(BLOCK, 2, b"b" * 10)
+        wal.commit()
+        wal.append(BLOCK, 1, b"c" * 10)
+        lsn = wal.commit()
+        wal.append(BLOCK, 3, b"d" * 10) # never committed
+        wal.sync()
+
+        wal, replayed = self.recover()
+        self.assertEqual(replayed, [(1, b"a" * 10), (2, b"b" * 10), (1, b"c" * 10)])
+        self.assertEqual(wal.lsn, lsn)
+        # the uncommitted record was cut off, new records follow the last commit
+        wal.append(BLOCK, 4, b"e" * 10)
+        wal.commit()
+        wal, replayed = self.recover()
+        self.assertEqual(replayed[3:], [(4, b"e" * 10)])
+
+    def test_torn_and_corrupt_records(self):
+        wal, _ = self.recover()
+        wal.append(BLOCK, 1, b"a" * 10)
+        wal.commit()
+        wal.append(BLOCK, 2, b"b" * 10)
+        wal.commit()
+        wal.sync()
+        path = os.path.join(self.directory, wal.segment)
+        with open(path, "r+b") as f:
+            data = f.read()
+            f.seek(len(data) - 2 * RECORD_HEADER.size - 1) # the last byte of block 2
+            f.write(b"x")
+        _, replayed = self.recover()
+        self.assertEqual(replayed, [(1, b"a" * 10)])
+
+        with open(path, "ab") as f:
+            f.write(make_record(10, BLOCK, 5, b"f" * 10)[:-3]) # torn
+        wal, replayed = self.recover()
+        self.assertEqual(replayed, [(1, b"a" * 10)])
+        self.assertEqual(os.path.getsize(path), 2 * RECORD_HEADER.size + 10)
+
+    def test_group_commit(self):
+        # every commit is durable when it returns, the threads committing at the same time share fsyncs
+        wal, _ = self.recover()
+        lsns = []
+        def commit(i):
+            for j in range(20):
+                wal.append(BLOCK, i + 1, bytes(10))
+                lsn = wal.commit()
+                lsns.append(wal.durable_lsn >= lsn)
+        with Tracker.measure() as stats:
+            threads = [threading.Thread(target=commit, args=(i,)) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(lsns, [True] * 160)
+        self.assertLessEqual(stats.counts["wal_fsync"], 160)
+        _, replayed = self.recover()
+        self.assertEqual(len(replayed), 160)
+
+    def test_async_commit(self):
+        wal, _ = self.recover(async_commit=True, group_commit_interval=0.5)
+        with Tracker.measure() as stats:
+            for i in range(100):
+                wal.append(BLOCK, i + 1, bytes(10))
+                wal.commit()
+            # only the first commit waited for an fsync, the others are made durable by the timer
+            self.assertEqual(stats.counts["wal_fsync"], 1)
+            self.assertEqual(wal.durable_lsn, 2)
+            timer = wal.timer
+            timer.join()
+        self.assertEqual(wal.durable_lsn, 200)
+        self.assertEqual(stats.counts["wal_fsync"], 2)
+        _, replayed = self.recover()
+        self.assertEqual(len(replayed), 100)
+
+    def test_rotate(self):
+        wal, _ = self.recover()
+        wal.append(BLOCK, 1, b"a" * 10)
+        wal.commit()
+        first = wal.segment
+        second = wal.rotate()
+        wal.append(BLOCK, 2, b"b" * 10)
+        wal.commit()
+        wal.sync()
+        self.assertEqual(wal.get_segments(), [first, second])
+        _, replayed = self.recover()
+        self.assertEqual(replayed, [(1, b"a" * 10), (2, b"b" * 10)])
+        wal.remove_segments_before(second)
+        _, replayed = self.recover()
+        self.assertEqual(replayed, [(2, b"b" * 10)])
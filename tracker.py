@@ -1,34 +1,120 @@
 import collections
+import contextlib
+import json
+import time
+
+# the first byte of a block (see get_block_type) => name of the block type in the I/O counters
+BLOCK_TYPE_NAMES = ("data", "root", "non-leaf", "leaf", "bucket", "directory")
+IO_COUNTERS = {
+    op: tuple(f"{op}.{BLOCK_TYPE_NAMES[i] if i < len(BLOCK_TYPE_NAMES) else 'unknown'}" for i in range(256))
+    for op in ("logical_read", "physical_read", "logical_write", "physical_write")
+}
+
+class Stats:
+    # the measurements of 1 unit of work, e.g. 1 query, see Tracker.measure
+    # counts: name => count
+    #   "logical_read.<block type>", "logical_write.<block type>": block accesses asked of the Disk or BufferPool
+    #   "physical_read.<block type>", "physical_write.<block type>": block accesses that reached the Disk
+    #   "split", "merge", "free": index nodes split, merged away and freed by delete_range
+    #   "bytes_encoded", "bytes_decoded": bytes of records and index entries converted to/from Python values
+    #   "buffer_hit", "buffer_miss", "buffer_write_back", "hash_bucket_read", "hash_bucket_write"
+    # blocks: name => {block_id: True}, the distinct blocks accessed in access order ("leaf", "non-leaf", "data")
+    # phases: name => wall time in seconds, see Tracker.phase
+    # nodes: "leaf"/"non-leaf" => {block_id: Node}, the index nodes accessed, only kept with keep_nodes == True
+    # so that only the Stats of 1 query and not the whole session hold references to the tree
+    def __init__(self, keep_nodes=False):
+        self.counts = collections.defaultdict(int)
+        self.blocks = collections.defaultdict(dict)
+        self.phases = collections.defaultdict(float)
+        self.nodes = collections.defaultdict(dict) if keep_nodes else None
+
+    def clear(self):
+        self.__init__(self.nodes != None)
+
+    def merge(self, other):
+        # adds the measurements of other, the nodes are not carried over
+        for key, count in other.counts.items():
+            self.counts[key] += count
+        for key, block_ids in other.blocks.items():
+            self.blocks[key].update(block_ids)
+        for key, seconds in other.phases.items():
+            self.phases[key] += seconds
+
+    def get_io(self, op):
+        # op is one of IO_COUNTERS, returns the total over all block types
+        return sum(self.counts[key] for key in set(IO_COUNTERS[op]) if key in self.counts)
+
+    def to_dict(self):
+        # plain dict for export, the blocks are reported as the number of distinct blocks of each kind
+        return {
+            "counts": dict(sorted(self.counts.items())),
+            "blocks": {key: len(block_ids) for key, block_ids in sorted(self.blocks.items())},
+            "phases": dict(self.phases),
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
 
 class Tracker:
-    track_counts = collections.defaultdict(int)
-    track_set = collections.defaultdict(dict) # use dict instead of set because dict retains order in python 3.6+
+    # measurements go to Tracker.stats: the Stats of the innermost Tracker.measure() context,
+    # or the session Stats outside of any context
+    # Tracker.enabled = False turns every measurement into a single attribute check
+    enabled = True
+    stats = Stats()
+    outer = [] # Stats of the enclosing measure() contexts, innermost last
 
     @classmethod
-    def increment_count(cls, key):
-        cls.track_counts[key] += 1
+    def increment_count(cls, key, amount=1):
+        if cls.enabled:
+            cls.stats.counts[key] += amount
 
     @classmethod
-    def reset_count(cls, key):
-        cls.track_counts[key] = 0
+    def add_block(cls, key, block_id):
+        if cls.enabled:
+            cls.stats.blocks[key][block_id] = True
 
     @classmethod
-    def reset_all_count(cls):
-        cls.track_counts = collections.defaultdict(int)
+    def add_node(cls, node):
+        # records an access to an index node by its block id, and the node itself if the Stats keep nodes
+        if cls.enabled:
+            key = "leaf" if node.leaf else "non-leaf"
+            cls.stats.blocks[key][node.block_id] = True
+            if cls.stats.nodes != None:
+                cls.stats.nodes[key][node.block_id] = node
 
     @classmethod
-    def add_to_set(cls, key, value):
-        cls.track_set[key][value] = True
-    
+    def count_io(cls, op, block):
+        # op is one of IO_COUNTERS, the block type is read from the first byte of the block
+        if cls.enabled:
+            cls.stats.counts[IO_COUNTERS[op][block.bytes[0]]] += 1
+
     @classmethod
-    def reset_set(cls, key):
-        cls.track_set[key] = {}
-    
+    @contextlib.contextmanager
+    def measure(cls, keep_nodes=False):
+        # with Tracker.measure() as stats: ... collects the measurements made inside the block into a new Stats
+        # which is added to the enclosing Stats on exit, so the session Stats still see everything
+        stats = Stats(keep_nodes)
+        cls.outer.append(cls.stats)
+        cls.stats = stats
+        try:
+            yield stats
+        finally:
+            cls.stats = cls.outer.pop()
+            cls.stats.merge(stats)
+
     @classmethod
-    def reset_all_set(cls):
-        cls.track_set = collections.defaultdict(dict)
+    @contextlib.contextmanager
+    def phase(cls, name):
+        # with Tracker.phase("load"): ... adds the wall time of the block to stats.phases[name]
+        stats = cls.stats
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if cls.enabled:
+                stats.phases[name] += time.perf_counter() - start
 
     @classmethod
     def reset_all(cls):
-        cls.track_counts = collections.defaultdict(int)
-        cls.track_set = collections.defaultdict(dict)
\ No newline at end of file
+        # clears the current Stats
+        cls.stats.clear()
@@ -1,28 +1,304 @@
+import array
+import bisect
+import collections
+
 from utils import *
 from structures import *
 from tracker import Tracker
+from latch import RWLatch
+
+def get_max_keys(block_size, tconst_prefix=None):
+    # see README (Index Block and Compressed Index Block) for the derivation
+    if tconst_prefix == None:
+        return (block_size - 25) // 22
+    # a compressed leaf node takes more bytes than a non-leaf node with as many keys
+    return (block_size - 17 - get_compressed_ptrs_keys_size(0, tconst_prefix, True)) // (LEAF_POINTER_STRUCT.size + COMPRESSED_KEY_SIZE)
+
+class KeyArray:
+    # compact list of leaf keys (averageRating, tconst) for Tree(compact=True)
+    # stored as parallel arrays: averageRating as float32, tconst as fixed width 10 bytes (zero padded)
+    # key_format "I" stores the first component as uint32 instead (e.g. numVotes), see KEY_FORMATS
+    # supports the list operations used by Node, items are (float, str) tuples like in a normal list of keys
+    __slots__ = ("ratings", "tconsts")
+
+    def __init__(self, keys=(), key_format="f"):
+        self.ratings = array.array(key_format)
+        self.tconsts = bytearray()
+        self.extend(keys)
+
+    def __len__(self):
+        return len(self.ratings)
+
+    def normalize(self, i):
+        if i < 0:
+            i += len(self.ratings)
+        if not 0 <= i < len(self.ratings):
+            raise IndexError("KeyArray index out of range")
+        return i
+
+    def __getitem__(self, i):
+        if type(i) is slice:
+            start, stop, step = i.indices(len(self.ratings))
+            assert step == 1
+            res = KeyArray(key_format=self.ratings.typecode)
+            res.ratings = self.ratings[start:stop]
+            res.tconsts = self.tconsts[start*10:max(start, stop)*10]
+            return res
+        i = self.normalize(i)
+        value = round(self.ratings[i], 1) if self.ratings.typecode == "f" else self.ratings[i]
+        return (value, convert_bytes_to_string(self.tconsts[i*10:i*10+10]))
+
+    def __setitem__(self, i, key):
+        i = self.normalize(i)
+        self.ratings[i] = key[0]
+        self.tconsts[i*10:i*10+10] = convert_string_to_bytes(key[1], 10)
+
+    def __iter__(self):
+        for i in range(len(self.ratings)):
+            yield self[i]
+
+    def __add__(self, other):
+        res = self[:]
+        res.extend(other)
+        return res
+
+    def insert(self, i, key):
+        i = min(max(i + len(self.ratings) if i < 0 else i, 0), len(self.ratings))
+        self.ratings.insert(i, key[0])
+        self.tconsts[i*10:i*10] = convert_string_to_bytes(key[1], 10)
+
+    def append(self, key):
+        self.insert(len(self.ratings), key)
+
+    def extend(self, keys):
+        for key in keys:
+            self.append(key)
+
+    def pop(self, i=-1):
+        i = self.normalize(i)
+        key = self[i]
+        del self.ratings[i]
+        del self.tconsts[i*10:i*10+10]
+        return key
+
+class PointerArray:
+    # compact list of leaf pointers for Tree(compact=True)
+    # data pointers (block_id, offset) are stored as parallel array('I'), the pointer to the right neighbour is kept in tail
+    # a data pointer always has offset >= 13 (data block header) so (block_id, 0), None and Nodes go to tail
+    __slots__ = ("block_ids", "offsets", "tail", "has_tail")
+
+    def __init__(self, pointers=()):
+        self.block_ids = array.array("I")
+        self.offsets = array.array("I")
+        self.tail = None
+        self.has_tail = False
+        self.extend(pointers)
+
+    def __len__(self):
+        return len(self.block_ids) + self.has_tail
+
+    def normalize(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("PointerArray index out of range")
+        return i
+
+    def __getitem__(self, i):
+        if type(i) is slice:
+            start, stop, step = i.indices(len(self))
+            assert step == 1
+            res = PointerArray()
+            res.block_ids = self.block_ids[start:stop]
+            res.offsets = self.offsets[start:stop]
+            if self.has_tail and start <= len(self.block_ids) < stop:
+                res.tail = self.tail
+                res.has_tail = True
+            return res
+        i = self.normalize(i)
+        if i == len(self.block_ids):
+            return self.tail
+        return (self.block_ids[i], self.offsets[i])
+
+    def __setitem__(self, i, pointer):
+        i = self.normalize(i)
+        if i == len(self.block_ids):
+            self.tail = pointer
+        else:
+            self.block_ids[i], self.offsets[i] = pointer
 
-MAX_KEYS = (BLOCK_SIZE - 25) // 22
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __add__(self, other):
+        res = self[:]
+        res.extend(other)
+        return res
+
+    def insert(self, i, pointer):
+        # data pointers can only go before the tail
+        i = min(max(i + len(self) if i < 0 else i, 0), len(self.block_ids))
+        self.block_ids.insert(i, pointer[0])
+        self.offsets.insert(i, pointer[1])
+
+    def append(self, pointer):
+        if self.has_tail:
+            raise Exception("Cannot append after the pointer to the right neighbour")
+        if type(pointer) is tuple and pointer[1] != 0:
+            self.insert(len(self.block_ids), pointer)
+        else:
+            self.tail = pointer
+            self.has_tail = True
+
+    def extend(self, pointers):
+        for pointer in pointers:
+            self.append(pointer)
+
+    def pop(self, i=-1):
+        i = self.normalize(i)
+        if i == len(self.block_ids):
+            pointer = self.tail
+            self.tail = None
+            self.has_tail = False
+            return pointer
+        pointer = (self.block_ids[i], self.offsets[i])
+        del self.block_ids[i]
+        del self.offsets[i]
+        return pointer
+
+class LazyKeys:
+    # keys of a node of an opened tree with lazy_keys=True, see deserialize_index_block_lazy
+    # a key is only decoded the first time it is accessed, so a binary search decodes about log2(n) of the n keys
+    # the first change decodes every key into items (made by make_items, a list or a KeyArray) and is applied there
+    __slots__ = ("decode_key", "decoded", "items", "make_items")
+
+    def __init__(self, num_keys, decode_key, make_items=list):
+        self.decode_key = decode_key
+        self.decoded = [None] * num_keys # None until decoded
+        self.items = None
+        self.make_items = make_items
+
+    def get(self, i):
+        key = self.decoded[i]
+        if key == None:
+            key = self.decoded[i] = self.decode_key(i if i >= 0 else i + len(self.decoded))
+        return key
+
+    def materialize(self):
+        if self.items == None:
+            self.items = self.make_items([self.get(i) for i in range(len(self.decoded))])
+        return self.items
+
+    def __len__(self):
+        return len(self.items) if self.items != None else len(self.decoded)
+
+    def __getitem__(self, i):
+        if self.items != None or type(i) is slice:
+            return self.materialize()[i]
+        return self.get(i)
+
+    def __setitem__(self, i, key):
+        self.materialize()[i] = key
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __add__(self, other):
+        return self.materialize() + other
+
+    def __radd__(self, other):
+        return other + self.materialize()
+
+    def insert(self, i, key):
+        self.materialize().insert(i, key)
+
+    def append(self, key):
+        self.materialize().append(key)
+
+    def extend(self, keys):
+        self.materialize().extend(keys)
+
+    def pop(self, i=-1):
+        return self.materialize().pop(i)
 
 class Node:
-    def __init__(self, max_keys=MAX_KEYS): # max_keys = (len(block) - 25) // 22
-        self.block_id = Disk.get_next_free()
+    __slots__ = ("tree", "disk", "block_id", "parent", "leaf", "evicted", "dirty", "keys", "pointers", "latch")
+
+    def __init__(self, tree, block_id=None): # block_id is given when materializing an existing index block
+        self.tree = tree
+        self.disk = tree.disk
+        self.block_id = block_id if block_id != None else tree.disk.get_next_free()
         self.parent = None
         self.leaf = True
+        self.evicted = False # set once the node is evicted from the node cache of an opened tree, or discarded
+        self.dirty = False # set when the node differs from its index block, only dirty nodes are written by save
+        self.latch = RWLatch() if tree.concurrent else None
 
-        self.keys = []
-        self.pointers = [None] # len(pointers) is always len(keys) + 1
+        self.keys = tree.new_key_array() if tree.compact else []
+        self.pointers = PointerArray([None]) if tree.compact else [None] # len(pointers) is always len(keys) + 1
+
+        tree.cache_node(self)
+        if block_id == None:
+            self.mark_dirty()
+
+    def mark_dirty(self):
+        self.dirty = True
+        self.tree.dirty_nodes[self.block_id] = self
+
+    def get_child(self, i):
+        # pointers of a non-leaf node are Nodes, or (block_id, 0) for children of an opened tree that are not materialized
+        child = self.pointers[i]
+        if type(child) is not Node or child.evicted:
+            child = self.tree.load_node(child[0] if type(child) is tuple else child.block_id)
+            self.pointers[i] = child
+        else:
+            self.tree.cache_node(child)
+        child.parent = self
+        return child
+
+    def get_next_leaf(self):
+        # the last pointer of a leaf node is its right neighbour, None for the rightmost leaf node
+        nxt = self.pointers[-1]
+        if nxt == None:
+            return None
+        if type(nxt) is not Node or nxt.evicted:
+            nxt = self.tree.load_node(nxt[0] if type(nxt) is tuple else nxt.block_id)
+            self.pointers[-1] = nxt
+        else:
+            self.tree.cache_node(nxt)
+        return nxt
+
+    def adopt(self, i):
+        # sets the parent of the child at pointers[i] to self if it is materialized
+        if type(self.pointers[i]) is Node:
+            self.pointers[i].parent = self
+            self.pointers[i].mark_dirty() # parent block id is in the header
+
+    def is_evictable(self):
+        # a node can only leave the node cache once none of its children are materialized
+        if self.leaf:
+            return True
+        return all(type(p) is not Node or p.evicted for p in self.pointers)
+
+    def unload(self):
+        # drops the materialized contents of the node, a later access loads it again from its index block
+        if self.parent != None:
+            for i in range(len(self.parent.pointers)):
+                if self.parent.pointers[i] is self:
+                    self.parent.pointers[i] = (self.block_id, 0)
+        self.evicted = True
+        self.parent = None
+        self.keys = None
+        self.pointers = None
 
-        self.max_keys = max_keys
-        self.min_leaf_keys = (self.max_keys + 1) // 2
-        self.min_non_leaf_keys = self.max_keys // 2
-        
     def get_right_sibling(self):
         if self.parent == None:
             return None
         for i in range(len(self.parent.pointers)-1):
             if self.parent.pointers[i] is self:
-                return self.parent.pointers[i+1]
+                return self.parent.get_child(i+1)
         return None
 
     def get_left_sibling(self):
@@ -30,18 +306,31 @@ class Node:
             return None
         for i in range(1, len(self.parent.pointers)):
             if self.parent.pointers[i] is self:
-                return self.parent.pointers[i-1]
+                return self.parent.get_child(i-1)
         return None
 
     def flush_to_disk(self):
+        # writes this node and every materialized node below it
+        self.write()
+        if not self.leaf:
+            for p in self.pointers:
+                if type(p) is Node and not p.evicted:
+                    p.flush_to_disk()
+
+    def write(self):
+        # writes this node to its index block
+        self.dirty = False
+        self.tree.dirty_nodes.pop(self.block_id, None)
         if self.block_id == 0:
             raise Exception("Block id of 0 is forbidden")
-        block = Disk.read_block(self.block_id)
+        block = self.disk.read_block(self.block_id)
         parent_block_id = self.parent.block_id if self.parent else 0
+        prefix = self.tree.tconst_prefix
+        key_size = 14 if prefix == None else COMPRESSED_KEY_SIZE
         if self.leaf:
-            set_index_block_header(block, "leaf", self.block_id, parent_block_id)
+            set_index_block_header(block, "leaf", self.block_id, parent_block_id, key_size=key_size)
         else:
-            set_index_block_header(block, "non-leaf", self.block_id, parent_block_id)
+            set_index_block_header(block, "non-leaf", self.block_id, parent_block_id, key_size=key_size)
         pointers = []
         for p in self.pointers:
             if p == None:
@@ -50,25 +339,27 @@ class Node:
                 pointers.append((p.block_id, 0)) # pointers to index dont need offset, let it be 0
             else:
                 pointers.append(p)
-        set_ptrs_keys_bytes(block, serialize_ptrs_keys(pointers, self.keys))
-        Disk.write_block(self.block_id, block)
-        if not self.leaf:
-            for i in range(len(self.pointers)):
-                if self.pointers[i]:
-                    self.pointers[i].flush_to_disk()
+        if prefix == None:
+            set_ptrs_keys_bytes(block, serialize_ptrs_keys(pointers, self.keys, self.tree.key_format))
+        else:
+            ptrs_keys_bytes = serialize_compressed_ptrs_keys(pointers, self.keys, prefix, self.leaf, self.tree.key_format, self.tree.packed_keys)
+            set_ptrs_keys_bytes(block, ptrs_keys_bytes, len(self.keys))
+        self.disk.write_block(self.block_id, block)
     
     def deallocate(self):
-        Disk.deallocate(self.block_id)
+        self.disk.deallocate(self.block_id)
     
     def remove_from_parent_next_pointer_and_key(self):
         for i in range(len(self.parent.pointers)-1):
             if self.parent.pointers[i] is self:
+                self.parent.mark_dirty()
                 self.parent.pointers.pop(i+1) # alr deallocated in leaf merge
                 return self.parent.keys.pop(i)
             
     def remove_from_parent_prev_pointer_and_key(self):
         for i in range(1, len(self.parent.pointers)):
             if self.parent.pointers[i] is self:
+                self.parent.mark_dirty()
                 self.parent.pointers.pop(i-1)
                 return self.parent.keys.pop(i-1)
 
@@ -78,6 +369,7 @@ class Node:
         for i in range(len(self.keys)):
             if self.keys[i] == old:
                 self.keys[i] = new
+                self.mark_dirty()
 
     def distribute(self, right):
         # print("distribute")   
@@ -92,37 +384,44 @@ class Node:
         
         num_left = (len(right.keys) + len(self.keys) + 1) // 2
         num_right = (len(right.keys) + len(self.keys)) - num_left
+        self.mark_dirty()
+        right.mark_dirty()
+        self.parent.mark_dirty()
         
         if num_left > len(self.keys):
             for _ in range(num_left - len(self.keys)):
                 self.keys.append(self.parent.keys[pivot_pos])
                 self.parent.keys[pivot_pos] = right.keys.pop(0)
                 self.pointers.append(right.pointers.pop(0))
-                self.pointers[-1].parent = self
+                self.adopt(-1)
 
         else:
             for _ in range(num_right - len(right.keys)):
                 right.keys.insert(0, self.parent.keys[pivot_pos])
                 self.parent.keys[pivot_pos] = self.keys.pop()
                 right.pointers.insert(0, self.pointers.pop())
-                right.pointers[0].parent = right
+                right.adopt(0)
 
     def merge_with_right(self, right):
         Tracker.increment_count("merge")
+        self.tree.discard_node(right)
+        self.mark_dirty()
         self.keys.append(self.remove_from_parent_next_pointer_and_key())
         for i in range(len(right.pointers)):
             self.pointers.append(right.pointers[i])
-            self.pointers[-1].parent = self
+            self.adopt(-1)
             if i == len(right.keys): # consider the fact that there is 1 more pointer than key
                 break
             self.keys.append(right.keys[i])
 
     def merge_with_left(self, left):
         Tracker.increment_count("merge")
+        self.tree.discard_node(left)
+        self.mark_dirty()
         self.keys.insert(0, self.remove_from_parent_prev_pointer_and_key())
         while left.pointers:
             self.pointers.insert(0, left.pointers.pop())
-            self.pointers[0].parent = self
+            self.adopt(0)
             if left.keys: # consider the fact that there is 1 more pointer than key
                 self.keys.insert(0, left.keys.pop())
     
@@ -131,6 +430,8 @@ class Node:
         all_keys = self.keys + right.keys
         all_pointers = self.pointers[:-1] + right.pointers[:-1]
         num_left = (len(all_keys) + 1) // 2
+        self.mark_dirty()
+        right.mark_dirty()
 
         self.keys = all_keys[:num_left]
         self.pointers = all_pointers[:num_left] + [self.pointers[-1]]
@@ -144,6 +445,8 @@ class Node:
     def leaf_merge(self, right): # seems like its symmetric - need further test
         # print("leaf_merge")
         Tracker.increment_count("merge")
+        self.tree.discard_node(right)
+        self.mark_dirty()
         self.keys.extend(right.keys)
         self.pointers.pop()
         self.pointers.extend(right.pointers)
@@ -154,39 +457,39 @@ class Node:
         for i in range(1, len(self.parent.pointers)):
             if self.parent.pointers[i] is self:
                 self.parent.keys[i-1] = self.keys[0]
+                self.parent.mark_dirty()
 
     def delete(self, key):
         if self.leaf:
-            for i in range(len(self.keys)):
-                if self.keys[i] == key:
-                    self.keys.pop(i)
-                    data_block_id, offset = self.pointers.pop(i)
-                    data_block = Disk.read_block(data_block_id)
-                    assert get_block_type(data_block) == "data"
-                    delete_record_bytes(data_block, offset)
-                    Disk.write_block(data_block_id, data_block)
-                    next_largest = self.keys[i] if i < len(self.keys) else None
-                    break
+            i = bisect.bisect_left(self.keys, key)
+            if i < len(self.keys) and self.keys[i] == key:
+                self.mark_dirty()
+                self.keys.pop(i)
+                pointer = self.pointers.pop(i)
+                if not self.tree.secondary:
+                    self.tree.delete_records([pointer])
+                next_largest = self.keys[i] if i < len(self.keys) else None
             if next_largest == None:
-                next_largest = self.pointers[-1].keys[0] if self.pointers[-1] else None
+                next_leaf = self.get_next_leaf()
+                next_largest = next_leaf.keys[0] if next_leaf else None
 
             if self.parent == None:
                 return False, next_largest
             
-            if len(self.keys) >= self.min_leaf_keys:
+            if len(self.keys) >= self.tree.min_leaf_keys:
                 return False, next_largest
             
             # print("Leaf underflow")
             # check if can borrow from left sibling
             left_sibling = self.get_left_sibling()
-            if left_sibling and len(left_sibling.keys) > self.min_leaf_keys:
+            if left_sibling and len(left_sibling.keys) > self.tree.min_leaf_keys:
                 # print("Leaf borrow from left")
                 left_sibling.leaf_distribute(self)
                 return False, next_largest
             
             # check if can borrow from right sibling
             right_sibling = self.get_right_sibling()
-            if right_sibling and len(right_sibling.keys) > self.min_leaf_keys:
+            if right_sibling and len(right_sibling.keys) > self.tree.min_leaf_keys:
                 # print("Leaf borrow from right")
                 self.leaf_distribute(right_sibling)
                 return False, next_largest
@@ -206,33 +509,24 @@ class Node:
             raise Exception("Leaf deletion underflow could never borrow nor merge")
                 
         elif not self.leaf:
-            deleted = False
-            for i in range(len(self.keys)):
-                if key < self.keys[i]:
-                    pos = i
-                    res = self.pointers[i].delete(key)
-                    deleted = True
-                    break
+            pos = bisect.bisect_right(self.keys, key)
+            res = self.get_child(pos).delete(key)
             
-            if not deleted:
-                pos = len(self.pointers) - 1
-                res = self.pointers[-1].delete(key)
-            
-            if res[0] == False or len(self.keys) >= self.min_non_leaf_keys or self.parent == None:
+            if res[0] == False or len(self.keys) >= self.tree.min_non_leaf_keys or self.parent == None:
                 self.replace_key(key, res[1])
                 return False, res[1]
                 
             # print("Non leaf underflow")
             # check if can borrow from left sibling
             left_sibling = self.get_left_sibling()
-            if left_sibling and len(left_sibling.keys) > self.min_non_leaf_keys:
+            if left_sibling and len(left_sibling.keys) > self.tree.min_non_leaf_keys:
                 # print("Non leaf borrow from left")
                 left_sibling.distribute(self)
                 self.replace_key(key, res[1])
                 return False, res[1]
             
             right_sibling = self.get_right_sibling()
-            if right_sibling and len(right_sibling.keys) > self.min_non_leaf_keys:
+            if right_sibling and len(right_sibling.keys) > self.tree.min_non_leaf_keys:
                 # print("Non leaf borrow from right")
                 self.distribute(right_sibling)
                 self.replace_key(key, res[1])
@@ -254,30 +548,117 @@ class Node:
             
             raise Exception("Non leaf deletion underflow could never borrow nor merge")
 
+    def remove_range(self, lower, upper, removed):
+        # removes every key in [lower, upper] from the subtree in 1 pass, appending the removed data pointers to removed
+        # children fully inside the range are freed without visiting their keys, the 2 boundary children are recursed into
+        # nodes may be left underfull (see Tree.rebalance), subtrees left empty are freed
+        # returns True if the subtree is now empty, the caller frees self in that case
+        if self.leaf:
+            i = bisect.bisect_left(self.keys, lower)
+            j = bisect.bisect_right(self.keys, upper)
+            if i < j:
+                self.mark_dirty()
+                removed.extend(self.pointers[i:j])
+                self.keys = self.keys[:i] + self.keys[j:]
+                self.pointers = self.pointers[:i] + self.pointers[j:]
+            return len(self.keys) == 0
+
+        a = bisect.bisect_right(self.keys, lower)
+        b = bisect.bisect_right(self.keys, upper)
+        # (separator, child) pairs, the separator of a child is the min key of its subtree
+        entries = [(self.keys[i-1] if i > 0 else None, self.pointers[i]) for i in range(a)]
+        for i in range(a, b+1):
+            child = self.get_child(i)
+            if a < i < b:
+                child.discard_subtree(removed)
+            elif child.remove_range(lower, upper, removed):
+                Tracker.increment_count("free")
+                self.tree.discard_node(child)
+            else:
+                entries.append((child.get_min_key(), child))
+        entries.extend((self.keys[i-1], self.pointers[i]) for i in range(b+1, len(self.pointers)))
+        if not entries:
+            return True
+        self.mark_dirty()
+        self.keys = [key for key, _ in entries[1:]]
+        self.pointers = [child for _, child in entries]
+        return False
+
+    def discard_subtree(self, removed):
+        # frees self and every node below it, appending the data pointers of its leaves to removed
+        if self.leaf:
+            removed.extend(self.pointers[:-1])
+        else:
+            for i in range(len(self.pointers)):
+                self.get_child(i).discard_subtree(removed)
+        Tracker.increment_count("free")
+        self.tree.discard_node(self)
+
+    def get_min_key(self):
+        node = self
+        while not node.leaf:
+            node = node.get_child(0)
+        return node.keys[0]
+
+    def is_underfull(self):
+        if self.leaf:
+            return len(self.keys) < self.tree.min_leaf_keys
+        return len(self.keys) < self.tree.min_non_leaf_keys
+
+    def fix_underflow(self):
+        # merges with a sibling if their keys fit in 1 node, otherwise evens out the keys with it
+        # unlike delete, self may be any number of keys short
+        # returns False if self has no sibling
+        left_sibling = self.get_left_sibling()
+        right_sibling = self.get_right_sibling() if left_sibling == None else None
+        if self.leaf:
+            if left_sibling:
+                if len(left_sibling.keys) + len(self.keys) <= self.tree.max_keys:
+                    left_sibling.leaf_merge(self)
+                else:
+                    left_sibling.leaf_distribute(self)
+            elif right_sibling:
+                if len(self.keys) + len(right_sibling.keys) <= self.tree.max_keys:
+                    self.leaf_merge(right_sibling)
+                else:
+                    self.leaf_distribute(right_sibling)
+            else:
+                return False
+        else:
+            # a merge also pulls down the separator key from the parent
+            if left_sibling:
+                if len(left_sibling.keys) + len(self.keys) + 1 <= self.tree.max_keys:
+                    self.merge_with_left(left_sibling)
+                else:
+                    left_sibling.distribute(self)
+            elif right_sibling:
+                if len(self.keys) + len(right_sibling.keys) + 1 <= self.tree.max_keys:
+                    self.merge_with_right(right_sibling)
+                else:
+                    self.distribute(right_sibling)
+            else:
+                return False
+        return True
+
     def insert(self, key, value):
         if self.leaf:
-            inserted = False
-            for i in range(len(self.keys)):
-                if key < self.keys[i]:
-                    self.keys.insert(i, key)
-                    self.pointers.insert(i, value)
-                    inserted = True
-                    break
-            if not inserted:
-                self.pointers.insert(len(self.keys), value)
-                self.keys.insert(len(self.keys), key)
-            if len(self.keys) > self.max_keys:
+            i = bisect.bisect_right(self.keys, key)
+            self.mark_dirty()
+            self.keys.insert(i, key)
+            self.pointers.insert(i, value)
+            if len(self.keys) > self.tree.max_keys:
                 num_left = (len(self.keys) + 1) // 2
                 
-                right_node = Node()
+                right_node = Node(self.tree)
                 right_node.keys = self.keys[num_left:]
                 right_node.pointers = self.pointers[num_left:]
                 
                 self.keys = self.keys[:num_left]
                 self.pointers = self.pointers[:num_left]
                 self.pointers.append(right_node)
+                Tracker.increment_count("split")
                 
-                to_insert = Node()
+                to_insert = Node(self.tree)
                 to_insert.leaf = False
                 to_insert.keys = [right_node.keys[0]]
                 to_insert.pointers = [self, right_node]
@@ -290,20 +671,15 @@ class Node:
             return None
             
         elif not self.leaf:
-            inserted = False
-            for i in range(len(self.keys)):
-                if key < self.keys[i]:
-                    pos = i
-                    res = self.pointers[i].insert(key, value)
-                    inserted = True
-                    break
-            if not inserted:
-                pos = len(self.pointers) - 1
-                res = self.pointers[-1].insert(key, value)
+            pos = bisect.bisect_right(self.keys, key)
+            res = self.get_child(pos).insert(key, value)
 
             if res == None:
                 return None
             
+            # res is a temporary node holding the split child, its contents move into self
+            self.tree.discard_node(res)
+            self.mark_dirty()
             self.keys.insert(pos, res.keys[0])
             self.pointers[pos] = res.pointers[0]
             self.pointers[pos].parent = self
@@ -311,17 +687,18 @@ class Node:
             self.pointers.insert(pos+1, res.pointers[1])
             self.pointers[pos+1].parent = self
             
-            if len(self.keys) > self.max_keys:
+            if len(self.keys) > self.tree.max_keys:
                 num_left = len(self.keys) // 2
                 
-                right_node = Node()
+                right_node = Node(self.tree)
                 right_node.leaf = False
                 right_node.keys = self.keys[num_left+1:]
                 right_node.pointers = self.pointers[num_left+1:]
-                for pointer in right_node.pointers:
-                    pointer.parent = right_node
+                for i in range(len(right_node.pointers)):
+                    right_node.adopt(i)
+                Tracker.increment_count("split")
                 
-                to_insert = Node()
+                to_insert = Node(self.tree)
                 to_insert.leaf = False
                 to_insert.keys = [self.keys[num_left]]
                 to_insert.pointers = [self, right_node]
@@ -344,24 +721,24 @@ class Node:
         # asserts that root.keys[i] == min val in the subtree pointed by root.pointers[i+1]
         if self.parent != None:
             if self.leaf:
-                assert self.min_leaf_keys <= len(self.keys) <= self.max_keys
+                assert self.tree.min_leaf_keys <= len(self.keys) <= self.tree.max_keys
             else:
-                assert self.min_non_leaf_keys <= len(self.keys) <= self.max_keys
+                assert self.tree.min_non_leaf_keys <= len(self.keys) <= self.tree.max_keys
         if not self.leaf:
             for p in self.pointers:
-                assert p.parent is self
+                assert type(p) is not Node or p.evicted or p.parent is self
         for i in range(len(self.keys)-1):
             assert self.keys[i] < self.keys[i+1]
         if self.leaf:
             return self.keys[0]
         for i in range(len(self.pointers)-1):
-            assert self.pointers[i].keys[0] < self.pointers[i+1].keys[0]
+            assert self.get_child(i).keys[0] < self.get_child(i+1).keys[0]
         for i in range(len(self.pointers)):
             if i > 0:
-                assert self.keys[i-1] == self.pointers[i].validate()
+                assert self.keys[i-1] == self.get_child(i).validate()
             else:
-                self.pointers[i].validate()
-        return self.pointers[0].validate()
+                self.get_child(i).validate()
+        return self.get_child(0).validate()
 
     def search_first_gte(self, key):
         """
@@ -370,107 +747,271 @@ class Node:
         If not found, i.e. key is smaller than all keys, return None
         """
         if self.leaf:
-            Tracker.add_to_set("leaf", self)
-            for i in range(len(self.keys)):
-                if self.keys[i] >= key:
-                    return self, i
+            Tracker.add_node(self)
+            i = bisect.bisect_left(self.keys, key)
+            if i < len(self.keys):
+                return self, i
             if self.pointers[-1] == None:
                 # this is true if self is the rightmost leaf node
                 return None
             # if leaf node is not rightmost, we know the first key of the immediate right neightbour will satisfy condition
             # because self.pointers[-1].keys[0] >= some LB > key
-            return self.pointers[-1], 0
+            return self.get_next_leaf(), 0
         else:
-            Tracker.add_to_set("non-leaf", self)
+            Tracker.add_node(self)
             # find the subtree to recursively call on
-            for i in range(len(self.keys)):
-                if key < self.keys[i]:
-                    return self.pointers[i].search_first_gte(key)
-            return self.pointers[-1].search_first_gte(key)
+            return self.get_child(bisect.bisect_right(self.keys, key)).search_first_gte(key)
 
     def get_num_nodes(self):
         if self.leaf:
             return 1
-        return 1 + sum(self.pointers[i].get_num_nodes() for i in range(len(self.pointers)))
+        return 1 + sum(self.get_child(i).get_num_nodes() for i in range(len(self.pointers)))
 
     def get_height(self):
-        res = 0
+        res = 1
         cur = self
-        while cur and type(cur) == Node:
+        while not cur.leaf:
             res += 1
-            cur = cur.pointers[0]
+            cur = cur.get_child(0)
         return res
 
-    def search_range(self, lower, upper, return_key=False):
+    def iter_range(self, lower, upper, return_key=False):
         """
-        Returns a list of all values whose keys are in the range [lower, upper] inclusive
+        Yields all values whose keys are in the range [lower, upper] inclusive, in key order
+        Leaf nodes are only visited when the previous one is used up
         """
         if lower > upper:
-            return []
-        
+            return
         first_gte = self.search_first_gte(lower)
-        res = []
         if first_gte == None:
-            return res
+            return
         node, pos = first_gte
-        while node:
+        while True:
             for i in range(pos, len(node.keys)):
                 if node.keys[i] > upper:
-                    # current and all other leaf nodes on the road are greater than upper bound and not part of res
-                    # so we can just return res
-                    return res
-                if return_key:
-                    res.append(node.keys[i])
-                else:
-                    res.append(node.pointers[i])
+                    # current and all other leaf nodes on the road are greater than upper bound
+                    return
+                yield node.keys[i] if return_key else node.pointers[i]
             # move to the immediate right neighbour
             if node.pointers[-1] == None:
-                return res
-            node = node.pointers[-1]
-            Tracker.add_to_set("leaf", node)
+                return
+            node = node.get_next_leaf()
+            self.tree.evict(keep=node)
+            Tracker.add_node(node)
             pos = 0
-        # this return is needed if the res includes the rightmost leaf node
-        return res
+
+    def search_range(self, lower, upper, return_key=False):
+        """
+        Returns a list of all values whose keys are in the range [lower, upper] inclusive
+        """
+        return list(self.iter_range(lower, upper, return_key))
+
+    def estimate_fraction(self, lower, upper):
+        """
+        Estimates the fraction of the keys of the subtree that are in the range [lower, upper] from the separator keys
+        Only descends while the range falls in 1 child, so at most 1 node per level is read
+        """
+        if self.leaf:
+            if not self.keys:
+                return 0.0
+            return (bisect.bisect_right(self.keys, upper) - bisect.bisect_left(self.keys, lower)) / len(self.keys)
+        a = bisect.bisect_right(self.keys, lower)
+        b = bisect.bisect_right(self.keys, upper)
+        if a == b:
+            return self.get_child(a).estimate_fraction(lower, upper) / len(self.pointers)
+        # the 2 children at the ends are partly in the range, count them as half
+        return (b - a) / len(self.pointers)
 
     def get_child_ids(self):
         if self.leaf:
-            result = []
-            for child in self.pointers:
-                if type(child) is tuple:
-                    # Data Block pointer in format of (Block_id of data block, offset of record)
-                    result.append(child)
-                else:
-                    # Node pointer
-                    result.append(child.block_id)
+            # Data Block pointers in format of (Block_id of data block, offset of record)
+            result = list(self.pointers[:-1])
+            # Node pointer to the right neighbour
+            nxt = self.pointers[-1]
+            result.append(nxt.block_id if type(nxt) is Node else nxt[0] if nxt else None)
             return result
-        return [child.block_id for child in self.pointers]
+        return [child.block_id if type(child) is Node else child[0] for child in self.pointers]
 
 class Tree:
-    def __init__(self):
-        self.root = Node()
-    
+    def __init__(self, disk, max_keys=None, cache_size=None, root_block_id=None, compact=False, key_format="f", secondary=False,
+                 tconst_prefix=None, packed_keys=False, lazy_keys=False, concurrent=False):
+        # cache_size == None keeps every node in memory
+        # otherwise at most cache_size nodes stay materialized in self.cache (block_id => Node, least recently used first)
+        # and the others are loaded on demand from their index blocks, see Tree.open
+        # compact == True stores the keys and pointers of leaf nodes in KeyArray/PointerArray instead of lists
+        # key_format is how the first component of the keys is stored, see KEY_FORMATS
+        # secondary == True is for an index over records owned by another tree, deleting its keys leaves the records alone
+        # tconst_prefix (e.g. "tt") writes compressed index blocks that store the prefix once instead of in every key
+        # so more keys fit in a node, every tconst must be the prefix followed by a number (see convert_tconst_to_uint)
+        # packed_keys == True (needs tconst_prefix) keeps the keys in the nodes as ints (see convert_key_to_packed)
+        # the client API still takes and returns augmented keys, see encode_key and decode_key
+        # lazy_keys == True decodes the keys of nodes loaded from index blocks only when they are accessed, see LazyKeys
+        # concurrent == True lets threads call insert, delete, delete_key, search, search_range and scan at the same time,
+        # every node gets a read/write latch, see modify_latched and iter_range_latched
+        # the other operations (delete_range, save, validate, ...) still need the tree to themselves
+        if packed_keys and tconst_prefix == None:
+            raise Exception("packed_keys needs a tconst_prefix")
+        if concurrent and cache_size != None:
+            raise Exception("A concurrent tree keeps every node in memory, cache_size must be None")
+        self.disk = disk
+        self.tconst_prefix = tconst_prefix
+        self.packed_keys = packed_keys
+        self.lazy_keys = lazy_keys
+        self.max_keys = max_keys if max_keys != None else get_max_keys(disk.block_size, tconst_prefix)
+        self.min_leaf_keys = (self.max_keys + 1) // 2
+        self.min_non_leaf_keys = self.max_keys // 2
+        self.compact = compact
+        self.key_format = key_format
+        self.secondary = secondary
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict() if cache_size != None else None
+        self.dirty_nodes = {} # block_id => Node, nodes changed since the last save
+        self.hash_index = None # HashIndex on tconst kept in sync with the records of the tree, see HashIndex.build
+        self.secondary_indexes = [] # Index of every secondary index kept in sync with the records of the tree, see build_index
+        self.concurrent = concurrent
+        self.root_latch = RWLatch() if concurrent else None # held to read self.root, and for writing while changing it
+        self.root = Node(self) if root_block_id == None else self.load_node(root_block_id)
+
+    @classmethod
+    def open(cls, disk, root_block_id, max_keys=None, cache_size=1024, compact=False, key_format="f", secondary=False,
+             tconst_prefix=None, packed_keys=False, lazy_keys=False, concurrent=False):
+        # CLIENT API
+        # opens a tree previously written with save(), nodes are materialized from their index blocks on demand
+        # so memory is bounded by cache_size rather than by the size of the tree
+        # a concurrent tree needs cache_size=None, and then reads every node up front
+        tree = cls(disk, max_keys, cache_size, root_block_id, compact, key_format, secondary, tconst_prefix, packed_keys,
+                   lazy_keys, concurrent)
+        if concurrent:
+            tree.materialize()
+        return tree
+
+    def materialize(self):
+        # loads every node (each once, through its parent) and links every leaf to the node of its right neighbour,
+        # so that get_next_leaf and the latched paths of a concurrent tree follow the pointers without loading nodes
+        level = [self.root]
+        while not level[0].leaf:
+            level = [node.get_child(i) for node in level for i in range(len(node.pointers))]
+        for left, right in zip(level, level[1:]):
+            left.pointers[-1] = right
+
+    def encode_key(self, key):
+        # augmented key (or search bound) => key as kept in the nodes
+        if not self.packed_keys:
+            return key
+        return convert_key_to_packed(key, self.tconst_prefix, self.key_format)
+
+    def decode_key(self, key):
+        # key as kept in the nodes => augmented key
+        if not self.packed_keys:
+            return key
+        return convert_packed_to_key(key, self.tconst_prefix, self.key_format)
+
+    def new_key_array(self, keys=()):
+        # leaf keys of a compact tree, packed keys need no KeyArray since they already fit in an array of uint64
+        if self.packed_keys:
+            return array.array("Q", keys)
+        return KeyArray(keys, self.key_format)
+
+    def load_node(self, block_id):
+        # returns the materialized node of index block block_id, reading it from disk if it is not cached
+        if self.cache != None and block_id in self.cache:
+            self.cache.move_to_end(block_id)
+            return self.cache[block_id]
+        block = self.disk.read_block(block_id)
+        node_type = get_block_type(block)
+        if node_type not in ("leaf", "non-leaf"):
+            raise Exception(f"Block {block_id} is a {node_type} block, not an index block")
+        node = Node(self, block_id)
+        node.leaf = node_type == "leaf"
+        compact = node.leaf and self.compact
+        if self.lazy_keys:
+            pointers, num_keys, decode_key = deserialize_index_block_lazy(block, self.key_format, self.packed_keys)
+            node.keys = LazyKeys(num_keys, decode_key, self.new_key_array if compact else list)
+        else:
+            pointers, keys = deserialize_index_block(block, self.key_format, self.packed_keys)
+            node.keys = self.new_key_array(keys) if compact else keys
+        if node.leaf and pointers[-1] == (0, 0):
+            pointers[-1] = None # rightmost leaf node
+        node.pointers = PointerArray(pointers) if compact else pointers
+        return node
+
+    def cache_node(self, node):
+        # marks node as the most recently used one in the node cache
+        if self.cache != None:
+            self.cache[node.block_id] = node
+            self.cache.move_to_end(node.block_id)
+
+    def evict(self, keep=None):
+        # evicts least recently used nodes until at most cache_size are materialized, writing them back to disk
+        # the root, keep, and nodes with materialized children are skipped
+        if self.cache == None:
+            return
+        skipped = 0
+        while len(self.cache) > self.cache_size and skipped < len(self.cache):
+            block_id, node = next(iter(self.cache.items()))
+            if node is self.root or node is keep or not node.is_evictable():
+                self.cache.move_to_end(block_id)
+                skipped += 1
+                continue
+            del self.cache[block_id]
+            if node.dirty:
+                node.write()
+            node.unload()
+            skipped = 0 # its parent may have become evictable
+
+    def discard_node(self, node):
+        # frees the block of a node that was merged away (or an old root or a temporary split node)
+        if self.cache != None:
+            self.cache.pop(node.block_id, None)
+        self.dirty_nodes.pop(node.block_id, None)
+        node.deallocate()
+        node.evicted = True # a scan of a concurrent tree that kept a reference to it starts over from the root
+
     def _delete(self, key):
         self.root.delete(key)
         if self.root.pointers[0] == None:
             print("tree is empty")
         if len(self.root.keys) == 0:
             print("root is empty, shrinking tree level")
-            self.root = self.root.pointers[0]
+            self.discard_node(self.root)
+            self.root = self.root.get_child(0) if not self.root.leaf else None
             if self.root:
                 self.root.parent = None
+                self.root.mark_dirty()
             else:
                 # design choice to populate null tree with 1 empty node
-                self.root = Node()
+                self.root = Node(self)
 
     def insert(self, augmented_key, value):
         # CLIENT API
-        res = self.root.insert(augmented_key, value)
+        if self.concurrent:
+            self.modify_latched(self.encode_key(augmented_key), value)
+            if self.hash_index != None or self.secondary_indexes:
+                with self.disk.lock:
+                    self.insert_into_indexes(augmented_key, value)
+            return
+        res = self.root.insert(self.encode_key(augmented_key), value)
         if res != None:
             self.root = res
+        self.insert_into_indexes(augmented_key, value)
+        self.evict()
+
+    def insert_into_indexes(self, augmented_key, value):
+        # keeps the hash index and the secondary indexes in sync with a record inserted into the tree
+        if self.hash_index != None:
+            self.hash_index.insert(augmented_key[1], value)
+        if self.secondary_indexes:
+            record = self.read_records([value])[0]
+            for index in self.secondary_indexes:
+                index.insert(record, value)
 
     def search(self, key, return_key=False):
         # CLIENT API
-        return self.root.search_range((key, ""), (key, chr(255)), return_key)
+        if self.concurrent:
+            return self.search_range_latched(self.encode_key((key, "")), self.encode_key((key, chr(255))), return_key)
+        res = self.root.search_range(self.encode_key((key, "")), self.encode_key((key, chr(255))), return_key)
+        self.evict()
+        return res
 
     def search_range(self, lower, upper):
         # CLIENT API
@@ -478,13 +1019,332 @@ class Tree:
             lower = float("-inf")
         if upper == None:
             upper = float("inf")
-        return self.root.search_range((lower, ""), (upper, chr(255)))
+        if self.concurrent:
+            return self.search_range_latched(self.encode_key((lower, "")), self.encode_key((upper, chr(255))))
+        res = self.root.search_range(self.encode_key((lower, "")), self.encode_key((upper, chr(255))))
+        self.evict()
+        return res
+
+    def scan(self, lower, upper):
+        # CLIENT API
+        # yields the records [tconst, averageRating, numVotes] with lower <= averageRating <= upper in key order
+        # the leaf chain is walked lazily and consecutive pointers into the same data block share 1 read and decode
+        # data blocks read are added to Tracker.stats.blocks["data"]
+        # the tree must not be modified until the scan is finished, unless it is concurrent
+        if lower == None:
+            lower = float("-inf")
+        if upper == None:
+            upper = float("inf")
+        if self.concurrent:
+            for records in self.iter_range_latched(self.encode_key((lower, "")), self.encode_key((upper, chr(255))),
+                                                   lambda keys, pointers: self.read_records(pointers)):
+                yield from records
+            return
+        block_id, records = None, None
+        try:
+            for pointer_block_id, offset in self.root.iter_range(self.encode_key((lower, "")), self.encode_key((upper, chr(255)))):
+                if pointer_block_id != block_id:
+                    block_id = pointer_block_id
+                    Tracker.add_block("data", block_id)
+                    records = read_all_slots_from_data_block(self.disk.read_block(block_id))
+                yield records[(offset - 13) // RECORD_STRUCT.size]
+        finally:
+            self.evict()
 
     def delete(self, key):
         # CLIENT API
         to_delete = self.search(key, True)
         for k in to_delete:
+            if self.concurrent:
+                self.modify_latched(k) # k may be gone by now
+                continue
             self._delete(k)
+            self.evict()
+
+    def delete_key(self, augmented_key):
+        # CLIENT API
+        # deletes the record with exactly this augmented key, returns False if there is none
+        key = self.encode_key(augmented_key)
+        if self.concurrent:
+            return self.modify_latched(key)
+        leaf = self.get_path(key)[-1]
+        i = bisect.bisect_left(leaf.keys, key)
+        found = i < len(leaf.keys) and leaf.keys[i] == key
+        if found:
+            self._delete(key)
+        self.evict()
+        return found
+
+    def delete_range(self, lower, upper):
+        # CLIENT API
+        # deletes every record with lower <= averageRating <= upper (None for unbounded) in 1 sweep
+        # instead of 1 root-to-leaf descent and rebalance per key like delete
+        # returns the number of records deleted
+        if lower == None:
+            lower = float("-inf")
+        if upper == None:
+            upper = float("inf")
+        lower, upper = self.encode_key((lower, "")), self.encode_key((upper, chr(255)))
+        if lower > upper:
+            return 0
+
+        # the last leaf before the range and the first leaf after it stay, the leaves in between are freed
+        before = self.get_path(lower)[-1]
+        if not before.keys or before.keys[0] > lower:
+            before = None # the range starts at the leftmost leaf
+        first_gte = self.root.search_first_gte(upper)
+        after, after_key = (first_gte[0], first_gte[0].keys[first_gte[1]]) if first_gte else (None, None)
+        if before != None and before is not after:
+            before.pointers[-1] = after
+            before.mark_dirty()
+
+        removed = []
+        if self.root.remove_range(lower, upper, removed):
+            self.discard_node(self.root)
+            self.root = Node(self)
+        if not self.secondary:
+            self.delete_records(removed)
+        self.rebalance([lower] + ([after_key] if after_key != None else []))
+        self.evict()
+        return len(removed)
+
+    def delete_records(self, pointers):
+        # zeroes the records of pointers, each data block is read and written once
+        # data blocks left without records are freed, the others are queued for reuse of the free slots
+        pointers = sorted(pointers)
+        with self.disk.lock:
+            start = 0
+            while start < len(pointers):
+                block_id = pointers[start][0]
+                end = start
+                block = self.disk.read_block(block_id)
+                while end < len(pointers) and pointers[end][0] == block_id:
+                    if self.hash_index != None:
+                        self.hash_index.delete(convert_bytes_to_string(block.bytes[pointers[end][1]: pointers[end][1] + 10]))
+                    if self.secondary_indexes:
+                        record = convert_bytes_to_record(read_record_bytes(block, pointers[end][1]))
+                        for index in self.secondary_indexes:
+                            index.delete(record)
+                    delete_record_bytes(block, pointers[end][1])
+                    end += 1
+                _, _, next_free_offset, _ = get_data_block_header(block)
+                if next_free_offset == 13:
+                    self.disk.deallocate(block_id)
+                else:
+                    self.disk.write_block(block_id, block)
+                    self.disk.add_non_full_data_block(block_id)
+                start = end
+
+    def get_path(self, key):
+        # returns the nodes from the root to the leaf that key belongs to
+        path = [self.root]
+        while not path[-1].leaf:
+            path.append(path[-1].get_child(bisect.bisect_right(path[-1].keys, key)))
+        return path
+
+    def rebalance(self, keys):
+        # fixes underfull nodes on the paths of keys bottom-up, and shrinks the tree while the root has a single child
+        # repeated until nothing changes since a node without siblings can only be fixed after its parent is
+        changed = True
+        while changed:
+            changed = False
+            for key in keys:
+                for node in reversed(self.get_path(key)[1:]):
+                    if node.is_underfull() and node.fix_underflow():
+                        changed = True
+            while not self.root.leaf and len(self.root.keys) == 0:
+                self.discard_node(self.root)
+                self.root = self.root.get_child(0)
+                self.root.parent = None
+                self.root.mark_dirty()
+                changed = True
+
+    def read_latch_leaf(self, key):
+        # latch crabbing for readers of a concurrent tree: read latches the path to the leaf key belongs to,
+        # letting go of each node once its child is latched, returns the leaf still read latched
+        self.root_latch.acquire_read()
+        node = self.root
+        node.latch.acquire_read()
+        self.root_latch.release_read()
+        Tracker.add_node(node)
+        while not node.leaf:
+            child = node.pointers[bisect.bisect_right(node.keys, key)]
+            child.latch.acquire_read()
+            node.latch.release_read()
+            node = child
+            Tracker.add_node(node)
+        return node
+
+    def iter_range_latched(self, lower, upper, read_batch):
+        # Node.iter_range for a concurrent tree, yields read_batch(keys, pointers) for the keys in [lower, upper] of each leaf
+        # read_batch runs while the leaf is read latched, so the records it reads cannot be deleted meanwhile
+        # no latch is held while the caller uses a batch: the scan then latches the same leaf again and goes on after the
+        # last key it returned, or starts over from the root if the leaf was merged away or lost keys to its left neighbour
+        # the next leaf is only latched if that does not wait, otherwise the current leaf is let go and latched again,
+        # so a scan never holds a latch that a writer waits for while waiting itself
+        if lower > upper:
+            return
+        node, last = None, None # last is the last key returned
+        while True:
+            if node != None:
+                node.latch.acquire_read()
+                if node.evicted or last == None or not node.keys or node.keys[0] > last:
+                    node.latch.release_read()
+                    node = None
+            if node == None:
+                node = self.read_latch_leaf(lower if last == None else last)
+            batch, done = None, False
+            try:
+                while True:
+                    i = bisect.bisect_left(node.keys, lower) if last == None else bisect.bisect_right(node.keys, last)
+                    j = bisect.bisect_right(node.keys, upper)
+                    done = j < len(node.keys) or node.pointers[-1] == None
+                    if i < j:
+                        batch = read_batch(node.keys[i:j], node.pointers[i:j])
+                        last = node.keys[j-1]
+                        break
+                    if done:
+                        break
+                    nxt = node.pointers[-1]
+                    if not nxt.latch.acquire_read(blocking=False):
+                        break
+                    node.latch.release_read()
+                    node = nxt
+                    Tracker.add_node(node)
+            finally:
+                node.latch.release_read()
+            if batch != None:
+                yield batch
+            if done:
+                return
+
+    def search_range_latched(self, lower, upper, return_key=False):
+        # Node.search_range for a concurrent tree
+        res = []
+        for batch in self.iter_range_latched(lower, upper, lambda keys, pointers: keys if return_key else pointers):
+            res.extend(batch)
+        return res
+
+    def read_records(self, pointers):
+        # the records of pointers, consecutive pointers into the same data block share 1 read and decode
+        # the data blocks are read under disk.lock so a record being stored into another slot is never half read
+        res = []
+        block_id, records = None, None
+        with self.disk.lock:
+            for pointer_block_id, offset in pointers:
+                if pointer_block_id != block_id:
+                    block_id = pointer_block_id
+                    Tracker.add_block("data", block_id)
+                    records = read_all_slots_from_data_block(self.disk.read_block(block_id))
+                res.append(records[(offset - 13) // RECORD_STRUCT.size])
+        return res
+
+    def is_safe(self, node, insert):
+        # a node is safe if inserting (or deleting) a key below it cannot split it (or make it underflow, or shrink the tree)
+        # so that nothing above it changes
+        if insert:
+            return len(node.keys) < self.max_keys
+        if node.parent == None:
+            return len(node.keys) > 1
+        return len(node.keys) > (self.min_leaf_keys if node.leaf else self.min_non_leaf_keys)
+
+    def modify_latched(self, key, value=None):
+        # inserts key (value != None) or deletes it from a concurrent tree, returns False if there was no key to delete
+        # latch crabbing, first optimistically: read latches down to the leaf and a write latch on the leaf only,
+        # which is enough if the leaf is safe (and for a delete, key is not its first key, which may be a separator above)
+        # otherwise the leaf is let go and the descent is done again with write latches, see modify_pessimistic
+        insert = value != None
+        self.root_latch.acquire_read()
+        node = self.root
+        if node.leaf:
+            node.latch.acquire_write()
+        else:
+            node.latch.acquire_read()
+        self.root_latch.release_read()
+        while not node.leaf:
+            child = node.pointers[bisect.bisect_right(node.keys, key)]
+            if child.leaf:
+                child.latch.acquire_write()
+            else:
+                child.latch.acquire_read()
+            node.latch.release_read()
+            node = child
+        try:
+            if insert and self.is_safe(node, True):
+                node.insert(key, value)
+                return True
+            if not insert:
+                i = bisect.bisect_left(node.keys, key)
+                if i == len(node.keys) or node.keys[i] != key:
+                    return False
+                if i > 0 and self.is_safe(node, False):
+                    node.delete(key)
+                    return True
+        finally:
+            node.latch.release_write()
+        return self.modify_pessimistic(key, value)
+
+    def modify_pessimistic(self, key, value=None):
+        # modify_latched for a leaf that is not safe: write latches from the root down, and once a node is safe the nodes
+        # above it are let go since they cannot change, except for a delete the one with key as separator
+        # a node that is not safe may borrow from or merge with a sibling, so its siblings are write latched along with it,
+        # left to right; the root latch is held for writing as long as the root is, since the root may be replaced
+        # the insert or delete then runs from the highest node still latched
+        insert = value != None
+        self.root_latch.acquire_write()
+        root_latched = True
+        node = self.root
+        node.latch.acquire_write()
+        held = [node] # the write latched path, from the highest node that may change
+        siblings = [] # write latched siblings of the nodes of held that are not safe
+        try:
+            if self.is_safe(node, insert):
+                self.root_latch.release_write()
+                root_latched = False
+            while not node.leaf:
+                i = bisect.bisect_right(node.keys, key)
+                child = node.pointers[i]
+                if not insert and i > 0:
+                    node.pointers[i-1].latch.acquire_write()
+                    siblings.append(node.pointers[i-1])
+                child.latch.acquire_write()
+                held.append(child)
+                if not insert and i + 1 < len(node.pointers):
+                    node.pointers[i+1].latch.acquire_write()
+                    siblings.append(node.pointers[i+1])
+                if self.is_safe(child, insert):
+                    top = len(held) - 1
+                    if not insert:
+                        top = next((h for h in range(top) if key in held[h].keys), top)
+                    for n in siblings + held[:top]:
+                        n.latch.release_write()
+                    siblings = []
+                    del held[:top]
+                    if root_latched and held[0] is not self.root:
+                        self.root_latch.release_write()
+                        root_latched = False
+                node = child
+
+            if not insert:
+                i = bisect.bisect_left(node.keys, key)
+                if i == len(node.keys) or node.keys[i] != key:
+                    return False
+            if root_latched and insert:
+                res = self.root.insert(key, value)
+                if res != None:
+                    self.root = res
+            elif root_latched:
+                self._delete(key)
+            elif insert:
+                held[0].insert(key, value)
+            else:
+                held[0].delete(key)
+            return True
+        finally:
+            for n in held + siblings:
+                n.latch.release_write()
+            if root_latched:
+                self.root_latch.release_write()
 
     def show(self):
         # CLIENT API
@@ -499,10 +1359,10 @@ class Tree:
                 for key in node.keys:
                     to_print.append(key)
                 to_print.append("|")
-                for pointer in node.pointers:
+                for i in range(len(node.pointers)):
                     if node.leaf:
                         break
-                    nxt.append(pointer)
+                    nxt.append(node.get_child(i))
             print(" ".join(str(x) for x in to_print))
             print()
             cur = nxt
@@ -521,4 +1381,129 @@ class Tree:
 
     def save(self):
         # CLIENT API
-        self.root.flush_to_disk()
+        # writes only the nodes that changed since the last save (all of them the first time)
+        # returns the number of nodes written
+        dirty_nodes = list(self.dirty_nodes.values())
+        for node in dirty_nodes:
+            node.write()
+        return len(dirty_nodes)
+
+    def commit(self):
+        # CLIENT API
+        # saves, then commits every block written so far (nodes and records) as 1 durable group if the disk has a
+        # write-ahead log (see Disk.commit), so a crash after it recovers the tree as of this point
+        # returns the number of nodes written
+        num_written = self.save()
+        self.disk.commit()
+        return num_written
+
+    @classmethod
+    def bulk_load(cls, disk, sorted_iter, fill_factor=1.0, max_keys=None, compact=False, key_format="f", secondary=False,
+                  tconst_prefix=None, packed_keys=False, concurrent=False):
+        # CLIENT API
+        # builds the tree bottom-up from (augmented_key, value) pairs that are already sorted by key
+        # leaves are packed left to right, then every non-leaf level is built on top of the level below it
+        # fill_factor is the fraction of max_keys to put in each node (lower leaves room for future inserts)
+        if not 0 < fill_factor <= 1:
+            raise Exception(f"fill_factor: {fill_factor} must be within (0, 1]")
+        tree = cls(disk, max_keys, compact=compact, key_format=key_format, secondary=secondary, tconst_prefix=tconst_prefix,
+                   packed_keys=packed_keys, concurrent=concurrent)
+        leaves = tree.build_leaves(sorted_iter, fill_factor)
+        level, _ = tree.build_levels(leaves, [node.keys[0] if node.keys else None for node in leaves], fill_factor)[-1]
+        tree.root = level[0]
+        return tree
+
+    def get_leaf_target(self, fill_factor):
+        # number of keys put in each leaf by bulk_load
+        return min(self.max_keys, max(self.min_leaf_keys, int(self.max_keys * fill_factor)))
+
+    def get_child_target(self, fill_factor):
+        # number of children put in each non-leaf node by bulk_load
+        max_children = self.max_keys + 1
+        return min(max_children, max(self.min_non_leaf_keys + 1, 2, int(max_children * fill_factor)))
+
+    def build_leaves(self, sorted_iter, fill_factor=1.0):
+        # packs the (augmented_key, value) pairs (sorted by key) left to right into a chain of leaves
+        # the first leaf reuses the empty root, returns the leaves
+        max_keys = self.max_keys
+        min_leaf_keys = self.min_leaf_keys
+        leaf_target = self.get_leaf_target(fill_factor)
+        leaves = [self.root]
+        leaf = self.root
+        prev_key = None
+        for key, value in sorted_iter:
+            key = self.encode_key(key)
+            if prev_key != None and key <= prev_key:
+                raise Exception(f"bulk_load input must be strictly increasing, got {key} after {prev_key}")
+            prev_key = key
+            if len(leaf.keys) == leaf_target:
+                right = Node(self)
+                leaf.pointers[-1] = right
+                leaves.append(right)
+                leaf = right
+            leaf.keys.append(key)
+            leaf.pointers.insert(-1, value)
+
+        # the last leaf may underflow, fix it up with its left neighbour
+        if len(leaves) > 1 and len(leaves[-1].keys) < min_leaf_keys:
+            right = leaves.pop()
+            left = leaves[-1]
+            if len(left.keys) + len(right.keys) <= max_keys:
+                left.keys.extend(right.keys)
+                left.pointers = left.pointers[:-1] + right.pointers
+                self.discard_node(right)
+            else:
+                leaves.append(right)
+                all_keys = left.keys + right.keys
+                all_pointers = left.pointers[:-1] + right.pointers[:-1]
+                num_left = (len(all_keys) + 1) // 2
+                left.keys = all_keys[:num_left]
+                left.pointers = all_pointers[:num_left] + [right]
+                right.keys = all_keys[num_left:]
+                right.pointers = all_pointers[num_left:] + [None]
+        return leaves
+
+    def build_levels(self, level, lows, fill_factor=1.0, min_size=2):
+        # builds the non-leaf levels bottom-up on top of level (nodes in key order), lows[i] is the smallest key in the subtree of level[i]
+        # a level is only built on top of a level of at least min_size nodes, so the last level is the root with min_size == 2
+        # returns list[(nodes, lows)] of every level from level up
+        levels = [(level, lows)]
+        max_children = self.max_keys + 1
+        min_children = self.min_non_leaf_keys + 1
+        child_target = self.get_child_target(fill_factor)
+        while len(level) >= min_size:
+            parents = []
+            parent_lows = []
+            for start, end in Tree._group_bounds(len(level), max_children, min_children, child_target):
+                parent = Node(self)
+                parent.leaf = False
+                parent.keys = lows[start+1:end]
+                parent.pointers = level[start:end]
+                for child in parent.pointers:
+                    child.parent = parent
+                parents.append(parent)
+                parent_lows.append(lows[start])
+            level = parents
+            lows = parent_lows
+            levels.append((level, lows))
+        return levels
+
+    @staticmethod
+    def _group_bounds(n, cap, minimum, target):
+        # splits n consecutive children into groups of target, the last 2 groups are rebalanced if the last one is too small
+        # returns list[(start, end)]
+        sizes = [target] * (n // target)
+        if n % target:
+            sizes.append(n % target)
+        if len(sizes) > 1 and sizes[-1] < minimum:
+            combined = sizes.pop() + sizes.pop()
+            if combined <= cap:
+                sizes.append(combined)
+            else:
+                sizes.extend([(combined + 1) // 2, combined // 2])
+        bounds = []
+        start = 0
+        for size in sizes:
+            bounds.append((start, start + size))
+            start += size
+        return bounds
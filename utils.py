@@ -1,34 +1,50 @@
+import math
 import struct
-def parse_data(path="data.tsv"):
+
+from tracker import Tracker
+
+try:
+    import numpy as np
+except ImportError: # numpy comes with pandas, only the batch array helpers need it
+    np = None
+
+# record layout: tconst (10 bytes, zero padded), averageRating (float32), numVotes (uint32), little endian, no padding
+RECORD_STRUCT = struct.Struct("<10sfI")
+RECORD_DTYPE = np.dtype([("tconst", "S10"), ("averageRating", "<f4"), ("numVotes", "<u4")]) if np else None
+
+def iter_data(path="data.tsv"):
+    # streams the rows of the tsv file as [tconst, average_rating, num_votes], skipping the column row
     with open(path) as f:
-        lines = f.readlines()
-    data = [line.split() for i, line in enumerate(lines) if i != 0]
-    for record in data:
-        record[1] = float(record[1])
-        record[2] = int(record[2])
-    return data
+        next(f, None)
+        for line in f:
+            record = line.split()
+            record[1] = float(record[1])
+            record[2] = int(record[2])
+            yield record
 
-def convert_string_to_bytes(string, num_bytes):
-    # string => bytearray
+def parse_data(path="data.tsv"):
+    return list(iter_data(path))
+
+def encode_string(string, num_bytes):
+    # string => bytes (not padded), each char must have a byte value within [1, 255]
     if len(string) > num_bytes:
         raise Exception(f"string length: {len(string)} exceeds num_bytes: {num_bytes}")
-    res = []
-    for char in string:
-        byte_value = ord(char)
-        if not 1 <= byte_value <= 255:
-            raise Exception(f"byte value: {byte_value} invalid")
-        res.append(byte_value)
-    res.extend([0 for _ in range(num_bytes - len(res))])
-    return bytearray(res)
+    try:
+        res = string.encode("latin-1")
+    except UnicodeEncodeError:
+        res = None
+    if res == None or b"\0" in res:
+        byte_value = next(ord(char) for char in string if not 1 <= ord(char) <= 255)
+        raise Exception(f"byte value: {byte_value} invalid")
+    return res
+
+def convert_string_to_bytes(string, num_bytes):
+    # string => bytearray
+    return bytearray(encode_string(string, num_bytes).ljust(num_bytes, b"\0"))
 
 def convert_bytes_to_string(bytes_):
     # bytearray => string
-    res = []
-    for byte in bytes_:
-        if byte == 0:
-            break
-        res.append(chr(byte))
-    return "".join(res)
+    return bytes(bytes_).split(b"\0", 1)[0].decode("latin-1")
 
 def convert_float_to_bytes(float_):
     # float => bytearray
@@ -54,11 +70,44 @@ def convert_bytes_to_uint(bytes_):
 
 def convert_record_to_bytes(record):
     # (string, float, int) => bytearray
-    return convert_string_to_bytes(record[0], 10) + convert_float_to_bytes(record[1]) + convert_uint_to_bytes(record[2])
+    Tracker.increment_count("bytes_encoded", RECORD_STRUCT.size)
+    return bytearray(RECORD_STRUCT.pack(encode_string(record[0], 10), record[1], record[2]))
 
 def convert_bytes_to_record(bytes_):
     # bytearray => (string, float, int)
-    return [convert_bytes_to_string(bytes_[:10]), convert_bytes_to_float(bytes_[10:14]), convert_bytes_to_uint(bytes_[14:18])]
+    Tracker.increment_count("bytes_decoded", RECORD_STRUCT.size)
+    tconst, average_rating, num_votes = RECORD_STRUCT.unpack_from(bytes_)
+    return [tconst.split(b"\0", 1)[0].decode("latin-1"), round(average_rating, 1), num_votes]
+
+def convert_records_to_bytes(records):
+    # list[(string, float, int)] => bytearray of len(records) * 18 bytes, e.g. all the records of a data block
+    res = bytearray(RECORD_STRUCT.size * len(records))
+    for i, record in enumerate(records):
+        RECORD_STRUCT.pack_into(res, i * RECORD_STRUCT.size, encode_string(record[0], 10), record[1], record[2])
+    Tracker.increment_count("bytes_encoded", len(res))
+    return res
+
+def convert_bytes_to_records(bytes_):
+    # bytearray of n * 18 bytes => list[(string, float, int)]
+    Tracker.increment_count("bytes_decoded", len(bytes_))
+    return [
+        [tconst.split(b"\0", 1)[0].decode("latin-1"), round(average_rating, 1), num_votes]
+        for tconst, average_rating, num_votes in RECORD_STRUCT.iter_unpack(bytes_)
+    ]
+
+def convert_records_to_array(records):
+    # list[(string, float, int)] => numpy structured array of RECORD_DTYPE, .tobytes() gives the record bytes
+    if np == None:
+        raise Exception("numpy is required for convert_records_to_array")
+    return np.array([(encode_string(record[0], 10), record[1], record[2]) for record in records], dtype=RECORD_DTYPE)
+
+def convert_bytes_to_array(bytes_):
+    # bytearray of n * 18 bytes => numpy structured array of RECORD_DTYPE (zero-copy view over bytes_)
+    # tconst is zero padded bytes and averageRating is float32, e.g. select with array["averageRating"] == np.float32(8.0)
+    if np == None:
+        raise Exception("numpy is required for convert_bytes_to_array")
+    Tracker.increment_count("bytes_decoded", len(bytes_))
+    return np.frombuffer(bytes_, dtype=RECORD_DTYPE)
 
 def get_block_type(block):
     if block.bytes[0] == 0:
@@ -69,6 +118,10 @@ def get_block_type(block):
         return "non-leaf"
     elif block.bytes[0] == 3:
         return "leaf"
+    elif block.bytes[0] == 4:
+        return "bucket"
+    elif block.bytes[0] == 5:
+        return "directory"
     else:
         raise Exception(f"Block type unknown! byte at position 0 is {block.bytes[0]}") 
 
@@ -104,24 +157,26 @@ def set_index_block_header(block, index_type, block_id, parent_block_id, num_key
     block.bytes[9:13] = convert_uint_to_bytes(num_keys)
     block.bytes[13:17] = convert_uint_to_bytes(key_size)
     
+# block type, block_id, parent_block_id, num_keys, key_size
+INDEX_HEADER_STRUCT = struct.Struct("<BIIII")
+
 def get_index_block_header(block):
-    return (
-        block.bytes[0],
-        convert_bytes_to_uint(block.bytes[1:5]),
-        convert_bytes_to_uint(block.bytes[5:9]),
-        convert_bytes_to_uint(block.bytes[9:13]),
-        convert_bytes_to_uint(block.bytes[13:17])
-    )
+    return INDEX_HEADER_STRUCT.unpack_from(block.bytes)
 
-def insert_record_bytes(block, record_bytes):
-    # insert the bytes of record into the first free location in data block
+def insert_record_bytes(block, record_bytes, offset=None):
+    # insert the bytes of record at next_free_offset in data block, or into the free slot at offset if given
     # return -1 if block is full and insertion is not done
-    # return next_free_offset if insertion is successful
+    # return the offset of the record if insertion is successful
     if get_block_type(block) != "data":
         raise Exception("Can only insert record into data block!")
     _, block_id, next_free_offset, record_size = get_data_block_header(block)
     if record_size != len(record_bytes):
         raise Exception(f"Header record size: {record_size} != len(record_bytes): {len(record_bytes)}")
+    if offset != None:
+        if offset >= next_free_offset or (offset - 13) % record_size != 0 or block.bytes[offset] != 0:
+            raise Exception(f"offset {offset} is not a free slot")
+        block.bytes[offset: offset + record_size] = record_bytes
+        return offset
     if (next_free_offset - 13) % record_size != 0:
         raise Exception(f"next_free_offset must satisfy {record_size}x + 13")
     if next_free_offset + record_size > len(block):
@@ -153,19 +208,50 @@ def delete_record_bytes(block, offset):
         raise Exception(f"offset must satisfy {record_size}x + 13")
     if (offset + record_size > len(block)):
         raise Exception("offset is too big")
-    block.bytes[offset: offset+record_size] = bytearray(18)
+    block.bytes[offset: offset+record_size] = bytearray(record_size)
+    # free slots at the end go back to the unused space after next_free_offset
+    _, _, next_free_offset, _ = get_data_block_header(block)
+    while next_free_offset > 13 and block.bytes[next_free_offset - record_size] == 0:
+        next_free_offset -= record_size
+    block.bytes[5:9] = convert_uint_to_bytes(next_free_offset)
 
-def read_all_records_from_data_block(block):
+def get_free_slots(block):
+    # return the offsets of deleted records (zeroed slots) below next_free_offset
+    # a slot is free iff its first byte is 0 since a tconst is never empty, so the slots double as a bitmap
+    _, _, next_free_offset, record_size = get_data_block_header(block)
+    return [offset for offset in range(13, next_free_offset, record_size) if block.bytes[offset] == 0]
+
+def is_data_block_full(block):
+    _, _, next_free_offset, record_size = get_data_block_header(block)
+    return next_free_offset + record_size > len(block) and not get_free_slots(block)
+
+def read_all_slots_from_data_block(block):
+    # return the records of every slot below next_free_offset, so record at offset is at index (offset - 13) // 18
+    # free slots decode to ["", 0.0, 0]
     _, _, next_free_offset, record_size = get_data_block_header(block)
-    cur_offset = 13
-    records = []
-    while cur_offset != next_free_offset:
-        records.append(convert_bytes_to_record(read_record_bytes(block, cur_offset)))
-        cur_offset += record_size
-    return records
-
-def set_ptrs_keys_bytes(block, ptrs_keys_bytes):
+    if record_size != RECORD_STRUCT.size:
+        raise Exception(f"Header record size: {record_size} != {RECORD_STRUCT.size}")
+    return convert_bytes_to_records(block.bytes[13:next_free_offset])
+
+def read_all_records_from_data_block(block):
+    # deleted records are skipped
+    return [record for record in read_all_slots_from_data_block(block) if record[0]]
+
+def read_all_records_array_from_data_blocks(blocks):
+    # decodes every record of a batch of data blocks in 1 call
+    # returns a numpy structured array of RECORD_DTYPE, records are in the order of blocks
+    if np == None:
+        raise Exception("numpy is required for read_all_records_array_from_data_blocks")
+    res = bytearray()
+    for block in blocks:
+        _, _, next_free_offset, _ = get_data_block_header(block)
+        res += block.bytes[13:next_free_offset]
+    records = convert_bytes_to_array(res)
+    return records[records["tconst"] != b""] # deleted records
+
+def set_ptrs_keys_bytes(block, ptrs_keys_bytes, num_keys=None):
     # sets the data (keys and pointers) into index block (after the header)
+    # num_keys must be given for compressed index blocks, whose keys and pointers are not 22 bytes each
     # return True if setting is successful
     if get_block_type(block) == "data":
         raise Exception("Can only set key_pointers_bytes for index block!")
@@ -174,39 +260,231 @@ def set_ptrs_keys_bytes(block, ptrs_keys_bytes):
     block.bytes[17:17+len(ptrs_keys_bytes)] = ptrs_keys_bytes
     # clear out the remainder
     block.bytes[17+len(ptrs_keys_bytes): len(block)] = bytearray(len(block) - (17 + len(ptrs_keys_bytes)))
-    num_keys = (len(ptrs_keys_bytes) - 8) // 22
+    if num_keys == None:
+        num_keys = (len(ptrs_keys_bytes) - 8) // 22
     # set the number of keys
     block.bytes[9:13] = convert_uint_to_bytes(num_keys)
     return True
 
-def deserialize_index_block(block):
+# the first component of a key is stored in 4 bytes as a float32 ("f", e.g. averageRating) or a uint32 ("I", e.g. numVotes)
+KEY_FORMATS = {
+    "f": (convert_float_to_bytes, convert_bytes_to_float),
+    "I": (convert_uint_to_bytes, convert_bytes_to_uint),
+}
+
+# an index block entry is a pointer followed by a key, entries are decoded with 1 precompiled struct
+# the structs ending in pad bytes (x) decode only the pointer of each entry, see deserialize_index_block_lazy
+POINTER_STRUCT = struct.Struct("<II")
+KEY_STRUCTS = {key_format: struct.Struct("<" + key_format + "10s") for key_format in KEY_FORMATS}
+ENTRY_STRUCTS = {key_format: struct.Struct("<II" + key_format + "10s") for key_format in KEY_FORMATS}
+ENTRY_POINTER_STRUCT = struct.Struct("<II14x")
+
+def deserialize_index_block(block, key_format="f", packed=False):
     # convert the data (keys and pointers) in a index block
+    # packed == True decodes the keys of a compressed index block as packed keys (see convert_key_to_packed)
+    # the entries are unpacked straight from a memoryview of the block, no bytes are copied before decoding
     # returns list[tuple(block_id, offset)], list[key]
     if get_block_type(block) == "data":
         raise Exception("Can only deserialize index block!")
-    index_type, _, _, num_keys, key_size = get_index_block_header(block)
-    
-    pos = 17
-    pointers = []
-    keys = []
-    for i in range(num_keys):
-        pointers.append((convert_bytes_to_uint(block.bytes[pos:pos+4]), convert_bytes_to_uint(block.bytes[pos+4:pos+8])))
-        pos += 8
-        keys.append((convert_bytes_to_float(block.bytes[pos:pos+4]), convert_bytes_to_string(block.bytes[pos+4: pos+14])))
-        pos += key_size
-    pointers.append((convert_bytes_to_uint(block.bytes[pos:pos+4]), convert_bytes_to_uint(block.bytes[pos+4:pos+8])))
+    view = memoryview(block.bytes)
+    index_type, _, _, num_keys, key_size = INDEX_HEADER_STRUCT.unpack_from(view)
+    if key_size == COMPRESSED_KEY_SIZE:
+        return deserialize_compressed_index_block(block, key_format, packed)
+
+    end = 17 + num_keys * ENTRY_STRUCTS[key_format].size
+    entries = list(ENTRY_STRUCTS[key_format].iter_unpack(view[17:end]))
+    pointers = [(block_id, offset) for block_id, offset, _, _ in entries]
+    pointers.append(POINTER_STRUCT.unpack_from(view, end))
+    Tracker.increment_count("bytes_decoded", end + POINTER_STRUCT.size - 17)
+    if key_format == "f":
+        keys = [(round(value, 1), tconst.split(b"\0", 1)[0].decode("latin-1")) for _, _, value, tconst in entries]
+    else:
+        keys = [(value, tconst.split(b"\0", 1)[0].decode("latin-1")) for _, _, value, tconst in entries]
     return pointers, keys
 
-def serialize_ptrs_keys(pointers, keys):
+def deserialize_index_block_lazy(block, key_format="f", packed=False):
+    # like deserialize_index_block but only the pointers are decoded, a key is decoded when decode_key(i) is called
+    # decode_key reads a copy of the block taken here, so it stays valid when the block is rewritten or freed
+    # returns list[tuple(block_id, offset)], num_keys, decode_key
+    if get_block_type(block) == "data":
+        raise Exception("Can only deserialize index block!")
+    data = bytes(block.bytes)
+    index_type, _, _, num_keys, key_size = INDEX_HEADER_STRUCT.unpack_from(data)
+    if key_size != COMPRESSED_KEY_SIZE:
+        key_struct = KEY_STRUCTS[key_format]
+        end = 17 + num_keys * ENTRY_POINTER_STRUCT.size
+        pointers = list(ENTRY_POINTER_STRUCT.iter_unpack(data[17:end]))
+        pointers.append(POINTER_STRUCT.unpack_from(data, end))
+        Tracker.increment_count("bytes_decoded", (num_keys + 1) * POINTER_STRUCT.size)
+
+        def decode_key(i):
+            Tracker.increment_count("bytes_decoded", key_struct.size)
+            value, tconst = key_struct.unpack_from(data, 25 + i * ENTRY_POINTER_STRUCT.size)
+            return (round(value, 1) if key_format == "f" else value, tconst.split(b"\0", 1)[0].decode("latin-1"))
+        return pointers, num_keys, decode_key
+
+    leaf = index_type == 3
+    prefix = convert_bytes_to_string(data[18:18+data[17]])
+    start = 18 + data[17]
+    pointer_struct = LEAF_POINTER_STRUCT if leaf else NON_LEAF_POINTER_STRUCT
+    entry_pointer_struct = COMPRESSED_ENTRY_POINTER_STRUCTS[leaf]
+    end = start + num_keys * entry_pointer_struct.size
+    pointers = list(entry_pointer_struct.iter_unpack(data[start:end]))
+    pointers.append(pointer_struct.unpack_from(data, end))
+    if not leaf:
+        pointers = [(block_id, 0) for block_id, in pointers]
+    key_struct = PACKED_KEY_STRUCT if packed else COMPRESSED_KEY_STRUCTS[key_format]
+    Tracker.increment_count("bytes_decoded", (num_keys + 1) * pointer_struct.size)
+
+    def decode_key(i):
+        Tracker.increment_count("bytes_decoded", key_struct.size)
+        fields = key_struct.unpack_from(data, start + i * entry_pointer_struct.size + pointer_struct.size)
+        if packed:
+            return fields[0]
+        return (round(fields[0], 1) if key_format == "f" else fields[0], convert_uint_to_tconst(fields[1], prefix))
+    return pointers, num_keys, decode_key
+
+def serialize_ptrs_keys(pointers, keys, key_format="f"):
     # converts list[(block_id, offset)] and list[key] into bytes, to be used with set_ptrs_keys_bytes(block, ptrs_keys_bytes)
     # recall block_id: 4 bytes, offset: 4 bytes, key: 14 bytes
     assert len(pointers) - len(keys) == 1
+    convert_value_to_bytes, _ = KEY_FORMATS[key_format]
     res = bytearray()
     for i in range(len(keys)):
         res += convert_uint_to_bytes(pointers[i][0]) + convert_uint_to_bytes(pointers[i][1])
-        res += convert_float_to_bytes(keys[i][0]) + convert_string_to_bytes(keys[i][1], 10)
+        res += convert_value_to_bytes(keys[i][0]) + convert_string_to_bytes(keys[i][1], 10)
     if pointers[-1] == None: # possible for the rightmost leaf node
         res += convert_uint_to_bytes(0) + convert_uint_to_bytes(0)
     else:
         res += convert_uint_to_bytes(pointers[-1][0]) + convert_uint_to_bytes(pointers[-1][1])
+    Tracker.increment_count("bytes_encoded", len(res))
     return res
+
+# compressed index blocks (Tree(tconst_prefix=...)) have a key size of 8 in the header, see README (Compressed Index Block)
+# the tconst prefix shared by every key (e.g. "tt") is stored once per block and each key keeps the number after it
+COMPRESSED_KEY_SIZE = 8
+TCONST_DIGITS = 7 # the number after the prefix is zero padded to at least 7 digits, e.g. tt0000001, tt10000000
+COMPRESSED_KEY_STRUCTS = {key_format: struct.Struct("<" + key_format + "I") for key_format in KEY_FORMATS}
+LEAF_POINTER_STRUCT = struct.Struct("<IH") # block_id, offset of the record (or 0 for the right neighbour)
+NON_LEAF_POINTER_STRUCT = struct.Struct("<I") # block_id, the offset of a pointer to an index block is always 0
+COMPRESSED_ENTRY_STRUCTS = {
+    (leaf, key_format, packed): struct.Struct("<" + ("IH" if leaf else "I") + ("8s" if packed else key_format + "I"))
+    for leaf in (True, False) for key_format in KEY_FORMATS for packed in (False, True)
+}
+COMPRESSED_ENTRY_POINTER_STRUCTS = {True: struct.Struct("<IH8x"), False: struct.Struct("<I8x")}
+
+def get_compressed_ptrs_keys_size(num_keys, prefix, leaf):
+    # bytes taken after the header by a compressed index block with num_keys keys
+    pointer_size = LEAF_POINTER_STRUCT.size if leaf else NON_LEAF_POINTER_STRUCT.size
+    return 1 + len(prefix) + num_keys * (pointer_size + COMPRESSED_KEY_SIZE) + pointer_size
+
+def convert_tconst_to_uint(tconst, prefix):
+    # string => int, the number after prefix
+    # raises if tconst is not prefix followed by a zero padded number, as it could not be decoded back to the same string
+    digits = tconst[len(prefix):]
+    number = int(digits) if digits.isdigit() else -1
+    if not tconst.startswith(prefix) or str(number).zfill(TCONST_DIGITS) != digits or number >= 2**32:
+        raise Exception(f"tconst: {tconst} is not {prefix} followed by a number of at least {TCONST_DIGITS} digits")
+    return number
+
+def convert_uint_to_tconst(number, prefix):
+    # int => string
+    return prefix + str(number).zfill(TCONST_DIGITS)
+
+# packed keys (Tree(packed_keys=True)) are augmented keys packed into 1 int: first component << 32 | number after the tconst prefix
+# averageRating is packed as rating * 10, so keys compare as ints and decoding them needs no float rounding
+# a packed key is written as 8 bytes big endian, so packed keys compare like their bytes (memcmp)
+PACKED_KEY_STRUCT = struct.Struct(">Q")
+
+def convert_key_to_packed(key, prefix, key_format="f"):
+    # (value, tconst) => int
+    # also maps the bounds used by searches: tconst "" / chr(255) is below / above every tconst of the same value
+    # and an infinite value stays infinite (it still compares with ints)
+    value, tconst = key
+    if value in (float("-inf"), float("inf")):
+        return value
+    if tconst == "":
+        number = 0
+    elif tconst == chr(255):
+        number = 2**32 - 1
+    else:
+        number = convert_tconst_to_uint(tconst, prefix)
+    if key_format == "f":
+        value = pack_rating(value, tconst == chr(255))
+    return (value << 32) + number
+
+def pack_rating(value, upper):
+    # the packed rating k whose float k / 10 compares with the records like value does in an unpacked tree:
+    # the largest k with k / 10 <= value for an upper bound, otherwise the smallest k with k / 10 >= value
+    # a bound with more than 1 decimal place is rounded inwards, compared exactly (value * 10 may round across a step,
+    # e.g. 5.6 + 0.1 == 5.699999999999999 but 5.699999999999999 * 10 == 57.0)
+    if upper:
+        k = math.floor(value * 10)
+        while (k + 1) / 10 <= value:
+            k += 1
+        while k / 10 > value:
+            k -= 1
+    else:
+        k = math.ceil(value * 10)
+        while (k - 1) / 10 >= value:
+            k -= 1
+        while k / 10 < value:
+            k += 1
+    return k
+
+def convert_packed_to_key(packed, prefix, key_format="f"):
+    # int => (value, tconst)
+    value = packed >> 32
+    return (value / 10 if key_format == "f" else value, convert_uint_to_tconst(packed & 0xFFFFFFFF, prefix))
+
+def serialize_compressed_ptrs_keys(pointers, keys, prefix, leaf, key_format="f", packed=False):
+    # like serialize_ptrs_keys but for a compressed index block, to be used with set_ptrs_keys_bytes(block, ptrs_keys_bytes, len(keys))
+    # prefix length (1 byte) and prefix, then the pointers and keys
+    # key: first component (4 bytes) + number after the prefix (4 bytes)
+    # pointer: block_id (4 bytes) + offset (2 bytes) in a leaf node, block_id (4 bytes) in a non-leaf node
+    # packed == True for packed keys, written as 8 bytes big endian
+    assert len(pointers) - len(keys) == 1
+    key_struct = COMPRESSED_KEY_STRUCTS[key_format]
+    res = bytearray([len(prefix)]) + encode_string(prefix, 10)
+    for i in range(len(keys)):
+        if leaf:
+            res += LEAF_POINTER_STRUCT.pack(pointers[i][0], pointers[i][1])
+        else:
+            res += NON_LEAF_POINTER_STRUCT.pack(pointers[i][0])
+        if packed:
+            res += PACKED_KEY_STRUCT.pack(keys[i])
+        else:
+            res += key_struct.pack(keys[i][0], convert_tconst_to_uint(keys[i][1], prefix))
+    last = pointers[-1] if pointers[-1] != None else (0, 0) # None is possible for the rightmost leaf node
+    res += LEAF_POINTER_STRUCT.pack(last[0], last[1]) if leaf else NON_LEAF_POINTER_STRUCT.pack(last[0])
+    Tracker.increment_count("bytes_encoded", len(res))
+    return res
+
+def deserialize_compressed_index_block(block, key_format="f", packed=False):
+    # like deserialize_index_block for a compressed index block
+    # returns list[tuple(block_id, offset)], list[key]
+    view = memoryview(block.bytes)
+    index_type, _, _, num_keys, _ = INDEX_HEADER_STRUCT.unpack_from(view)
+    leaf = index_type == 3
+    prefix = convert_bytes_to_string(view[18:18+view[17]])
+    start = 18 + view[17]
+    entry_struct = COMPRESSED_ENTRY_STRUCTS[leaf, key_format, packed]
+    end = start + num_keys * entry_struct.size
+    entries = list(entry_struct.iter_unpack(view[start:end]))
+
+    # a leaf entry starts with block_id, offset and a non-leaf entry with block_id only
+    if leaf:
+        pointers = [entry[:2] for entry in entries]
+        pointers.append(LEAF_POINTER_STRUCT.unpack_from(view, end))
+    else:
+        pointers = [(entry[0], 0) for entry in entries]
+        pointers.append((NON_LEAF_POINTER_STRUCT.unpack_from(view, end)[0], 0))
+    Tracker.increment_count("bytes_decoded", end + (LEAF_POINTER_STRUCT if leaf else NON_LEAF_POINTER_STRUCT).size - 17)
+    n = 2 if leaf else 1
+    if packed:
+        keys = [int.from_bytes(entry[n], "big") for entry in entries]
+    elif key_format == "f":
+        keys = [(round(entry[n], 1), convert_uint_to_tconst(entry[n+1], prefix)) for entry in entries]
+    else:
+        keys = [(entry[n], convert_uint_to_tconst(entry[n+1], prefix)) for entry in entries]
+    return pointers, keys
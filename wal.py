@@ -0,0 +1,187 @@
+import os
+import struct
+import threading
+import time
+import zlib
+
+from tracker import Tracker
+
+# log record: lsn (8 bytes), kind (1 byte), block id (4 bytes), length of data (4 bytes), crc32 of the rest (4 bytes), data
+RECORD_HEADER = struct.Struct("<QBIII")
+BLOCK = 1 # data is the new contents of block block_id (redo image)
+COMMIT = 2 # the records since the previous commit form 1 atomic group
+
+GROUP_COMMIT_INTERVAL = 0.01 # seconds, with async_commit at most 1 fsync per interval
+BUFFER_BYTES = 1 << 20 # records are written to the segment (without fsync) once this many are buffered
+
+def make_record(lsn, kind, block_id, data):
+    header = RECORD_HEADER.pack(lsn, kind, block_id, len(data), 0)
+    crc = zlib.crc32(data, zlib.crc32(header[:-4]))
+    return header[:-4] + crc.to_bytes(4, "little") + data
+
+def iter_records(data):
+    # yields (end offset, lsn, kind, block_id, data) of the records of a segment, stopping at a torn or corrupt record
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        lsn, kind, block_id, length, crc = RECORD_HEADER.unpack_from(data, offset)
+        end = offset + RECORD_HEADER.size + length
+        if end > len(data):
+            return
+        record = data[offset + RECORD_HEADER.size: end]
+        if zlib.crc32(record, zlib.crc32(data[offset: offset + RECORD_HEADER.size - 4])) != crc:
+            return
+        yield end, lsn, kind, block_id, record
+        offset = end
+
+class WriteAheadLog:
+    # redo log of block writes, kept in segment files <directory>/<lsn of their first record>.log
+    # a new segment is started by every checkpoint, the segments before it are removed once the checkpoint is done
+    # (see Disk.checkpoint_step), so the log holds everything written since the last complete checkpoint began
+    # group commit: appended records are buffered, commit returns once its record is durable, and 1 thread writes and
+    # fsyncs the records of every thread committing at the time while the others wait for that fsync
+    # async_commit == True trades durability for fewer fsyncs (opt-in): a commit less than group_commit_interval after
+    # the last fsync returns at once, before it is durable, and is made durable by a timer when the interval is over,
+    # by a later commit, or by sync, so a crash can lose the commits of the last group_commit_interval
+    def __init__(self, directory, async_commit=False, group_commit_interval=GROUP_COMMIT_INTERVAL, buffer_bytes=BUFFER_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.async_commit = async_commit
+        self.group_commit_interval = group_commit_interval
+        self.buffer_bytes = buffer_bytes
+        self.cond = threading.Condition()
+        self.buffer = bytearray() # records appended but not written to the segment yet
+        self.lsn = 0 # lsn of the last record appended
+        self.durable_lsn = 0 # every record up to this lsn is fsynced
+        self.syncing = False # a thread is fsyncing, the others wait for it
+        self.last_sync = 0.0
+        self.timer = None # with async_commit, syncs the commits that did not wait once group_commit_interval is over
+        self.segment = None # name of the segment appended to
+        self.segment_bytes = 0 # bytes appended to the segment
+        self.fd = None
+
+    def get_segments(self):
+        return sorted(name for name in os.listdir(self.directory) if name.endswith(".log"))
+
+    def open_segment(self, name, size=0):
+        if self.fd != None:
+            os.close(self.fd)
+        self.segment = name
+        self.fd = os.open(os.path.join(self.directory, name), os.O_WRONLY | os.O_CREAT)
+        os.ftruncate(self.fd, size)
+        os.lseek(self.fd, size, os.SEEK_SET)
+        self.segment_bytes = size
+
+    def recover(self, apply):
+        # replays the block writes of every committed group in lsn order with apply(block_id, data), called once on open
+        # the records after the last commit (and a torn or corrupt tail) are cut off the log
+        # returns the number of block writes replayed
+        committed = [] # (block_id, data) of the groups before the last commit
+        group = []
+        last_commit = None # (segment, end offset, lsn)
+        for name in self.get_segments():
+            with open(os.path.join(self.directory, name), "rb") as f:
+                data = f.read()
+            end = 0
+            for end, lsn, kind, block_id, record in iter_records(data):
+                if kind == BLOCK:
+                    group.append((block_id, record))
+                elif kind == COMMIT:
+                    committed.extend(group)
+                    group = []
+                    last_commit = (name, end, lsn)
+            if end < len(data):
+                break # nothing after a torn record was acknowledged
+        for block_id, data in committed:
+            apply(block_id, data)
+        Tracker.increment_count("wal_redo", len(committed))
+
+        segments = self.get_segments()
+        keep = segments.index(last_commit[0]) + 1 if last_commit else 0
+        for name in segments[keep:]:
+            os.remove(os.path.join(self.directory, name))
+        if last_commit:
+            self.lsn = self.durable_lsn = last_commit[2]
+            self.open_segment(last_commit[0], last_commit[1])
+        else:
+            self.open_segment(f"{1:020d}.log")
+        return len(committed)
+
+    def append(self, kind, block_id=0, data=b""):
+        # returns the lsn of the new record
+        with self.cond:
+            self.lsn += 1
+            record = make_record(self.lsn, kind, block_id, data)
+            self.buffer += record
+            self.segment_bytes += len(record)
+            if len(self.buffer) >= self.buffer_bytes:
+                self.write_buffer()
+            Tracker.increment_count("wal_record")
+            Tracker.increment_count("wal_bytes", len(record))
+            return self.lsn
+
+    def write_buffer(self):
+        # with self.cond held
+        if self.buffer:
+            os.write(self.fd, self.buffer)
+            self.buffer = bytearray()
+
+    def commit(self):
+        # ends the group of records appended so far (by every thread), returns its lsn
+        lsn = self.append(COMMIT)
+        self.sync_commit(lsn)
+        return lsn
+
+    def sync_commit(self, lsn):
+        # waits until the commit record lsn is durable
+        # with async_commit, not if the log was fsynced less than group_commit_interval ago
+        wait = self.last_sync + self.group_commit_interval - time.monotonic()
+        if not self.async_commit or wait <= 0:
+            self.sync(lsn)
+            return
+        with self.cond:
+            if self.timer == None:
+                self.timer = threading.Timer(wait, self.sync_timer)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def sync_timer(self):
+        with self.cond:
+            self.timer = None
+            self.sync()
+
+    def sync(self, lsn=None):
+        # returns once every record up to lsn (default: the last one appended) is durable
+        # 1 thread writes and fsyncs the records of every thread waiting, the others wait for it (group commit)
+        with self.cond:
+            if lsn == None:
+                lsn = self.lsn
+            while self.durable_lsn < lsn:
+                if self.syncing:
+                    self.cond.wait()
+                    continue
+                self.syncing = True
+                self.write_buffer()
+                upto = self.lsn
+                fd = self.fd
+                self.cond.release()
+                try:
+                    os.fsync(fd)
+                finally:
+                    self.cond.acquire()
+                    self.syncing = False
+                    self.cond.notify_all()
+                self.durable_lsn = max(self.durable_lsn, upto)
+                self.last_sync = time.monotonic()
+                Tracker.increment_count("wal_fsync")
+
+    def rotate(self):
+        # syncs the log and starts a new segment, returns its name
+        with self.cond:
+            self.sync()
+            self.open_segment(f"{self.lsn + 1:020d}.log")
+            return self.segment
+
+    def remove_segments_before(self, name):
+        for segment in self.get_segments():
+            if segment < name:
+                os.remove(os.path.join(self.directory, segment))